@@ -0,0 +1,57 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from src.join_categories import get_all_parents, get_all_parents_merge
+
+
+def synthetic_category_edges(
+    n_categories: int,
+    n_edges: int,
+    n_top: int = 25,
+    seed: int = 0,
+) -> tuple[pd.DataFrame, np.ndarray]:
+    """Build a layered category graph where ~5% of the edges point downwards (cycles)."""
+    rng = np.random.default_rng(seed)
+    depth = np.minimum(rng.geometric(0.25, n_categories), 30)
+    depth[:n_top] = 0
+    child = rng.integers(n_top, n_categories, n_edges)
+    order = np.argsort(depth, kind="stable")
+    first_at_depth = np.searchsorted(depth[order], depth[child])
+    parent = order[(rng.random(n_edges) * np.maximum(first_at_depth, 1)).astype(int)]
+    backwards = rng.random(n_edges) < 0.05
+    parent[backwards] = rng.integers(n_top, n_categories, backwards.sum())
+    names = np.array([f"Kategori_{i}" for i in range(n_categories)], dtype=object)
+    joined = pd.DataFrame({"child": names[child], "parent": names[parent]})
+    return joined, names[:n_top]
+
+
+def main(args: argparse.Namespace):
+    joined, top_level = synthetic_category_edges(args.n_categories, args.n_edges)
+    timings = {}
+    results = {}
+    for name, func in {
+        "get_all_parents_merge": get_all_parents_merge,
+        "get_all_parents": get_all_parents,
+    }.items():
+        start = time.perf_counter()
+        results[name] = func(joined, top_level)
+        timings[name] = time.perf_counter() - start
+        print(f"{name:22} {timings[name]:8.2f}s {len(results[name]):10,} rows")
+    as_sets = [set(map(tuple, df.to_numpy().tolist())) for df in results.values()]
+    assert as_sets[0] == as_sets[1], "The implementations disagree"
+    print(
+        f"Speedup: {timings['get_all_parents_merge'] / timings['get_all_parents']:.1f}x",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare get_all_parents implementations on a synthetic category graph",
+    )
+    parser.add_argument("--n-categories", type=int, default=300_000)
+    parser.add_argument("--n-edges", type=int, default=1_000_000)
+    args = parser.parse_args()
+    main(args=args)
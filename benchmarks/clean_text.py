@@ -0,0 +1,83 @@
+import argparse
+import random
+import time
+from collections.abc import Callable
+
+from src.parse_articles import clean_text_generic, strip_constructs
+
+CONSTRUCTS = [("[[Fil:", "]]"), ("{{Infoboks", "}}")]
+
+
+def synthetic_article(n_paragraphs: int, seed: int = 0) -> str:
+    """Build wikitext with an infobox, file links and templates in most paragraphs."""
+    rng = random.Random(seed)
+    infobox = "{{Infoboks person\n" + "".join(
+        f"| felt{i} = {{{{nowrap|værdi {i}}}}} [[Link {i}]]\n" for i in range(40)
+    )
+    paragraphs = [infobox + "}}\n'''Emne''' er et [[emne]] med en lang indledning."]
+    for i in range(n_paragraphs):
+        sentences = [
+            f"Sætning {j} om [[Side {j}|emnet]] og {{{{cite web|url=x|title=y}}}}."
+            for j in range(rng.randint(3, 12))
+        ]
+        if rng.random() < 0.4:
+            sentences.insert(0, f"[[Fil:Billede{i}.jpg|thumb|Tekst med [[link]]]]")
+        paragraphs.append(" ".join(sentences))
+    categories = "".join(f"\n[[Kategori:Kategori {i}]]" for i in range(8))
+    return "\n\n".join(paragraphs) + categories
+
+
+def old_first_paragraph(text: str) -> str:
+    cleaned = clean_text_generic(text, "[[Fil:", "]]")
+    return clean_text_generic(cleaned, "{{Infoboks", "}}").split("\n\n")[0]
+
+
+def time_cleaner(
+    cleaner: Callable[[str], str],
+    articles: list[str],
+    repeats: int,
+) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for article in articles:
+            cleaner(article)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args: argparse.Namespace):
+    articles = [
+        synthetic_article(args.n_paragraphs, seed=seed)
+        for seed in range(args.n_articles)
+    ]
+    size = sum(map(len, articles)) / len(articles)
+    print(f"{len(articles)} articles of {size / 1000:.0f}k characters on average")
+    cleaners = {
+        "clean_text_generic x2": old_first_paragraph,
+        "strip_constructs": lambda text: strip_constructs(text, CONSTRUCTS),
+        "strip_constructs (first paragraph)": lambda text: strip_constructs(
+            text,
+            CONSTRUCTS,
+            first_paragraph=True,
+        ),
+    }
+    baseline = None
+    for name, cleaner in cleaners.items():
+        seconds = time_cleaner(cleaner, articles, args.repeats)
+        baseline = baseline or seconds
+        print(
+            f"{name:36} {len(articles) / seconds:10,.0f} articles/sec"
+            f" ({baseline / seconds:.1f}x)",
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the wikitext cleaners on synthetic articles",
+    )
+    parser.add_argument("--n-articles", type=int, default=50)
+    parser.add_argument("--n-paragraphs", type=int, default=60)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    main(args=args)
@@ -0,0 +1,53 @@
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import src.fileio as fileio
+
+
+def synthetic_categorylinks(n_links: int, n_categories: int, seed: int = 0) -> dict:
+    """Build the categorylinks intermediate in its old (titles) and new (ids) forms."""
+    rng = np.random.default_rng(seed)
+    titles = np.array([f"'Kategori_{i}_om_emner'" for i in range(n_categories)])
+    parent_ids = rng.integers(0, n_categories, n_links).astype(np.int32)
+    cl_from = rng.integers(1, 10_000_000, n_links)
+    return {
+        "titles": pd.DataFrame({"cl_from": cl_from, "cl_to": titles[parent_ids]}),
+        "ids": pd.DataFrame({"cl_from": cl_from, "cl_to_id": parent_ids}),
+    }
+
+
+def time_read(path: Path, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fileio.read_table(path)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args: argparse.Namespace):
+    tables = synthetic_categorylinks(args.n_links, args.n_categories)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for form, df in tables.items():
+            for suffix in [".csv", ".parquet"]:
+                path = Path(tmpdir) / f"categorylinks-{form}{suffix}"
+                fileio.write_table(df, path)
+                seconds = time_read(path, args.repeats)
+                size = path.stat().st_size / 1e6
+                print(f"{path.name:32} {size:8.1f} MB {seconds:8.3f}s to load")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare CSV and Parquet intermediates on a synthetic categorylinks table",
+    )
+    parser.add_argument("--n-links", type=int, default=2_000_000)
+    parser.add_argument("--n-categories", type=int, default=200_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    main(args=args)
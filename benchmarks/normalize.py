@@ -0,0 +1,108 @@
+import argparse
+import time
+from collections.abc import Callable
+
+import numpy as np
+import pandas as pd
+
+import src.normalize as normalize
+
+
+def synthetic_links(
+    n_links: int,
+    n_categories: int,
+    zipf: float,
+    seed: int = 0,
+) -> pd.Series:
+    """Draw category links with Zipf-distributed repeats, like the category links of real articles."""
+    rng = np.random.default_rng(seed)
+    titles = np.array(
+        [
+            f"Kategori_{i}_om_æøå_emner|{'*' if i % 3 == 0 else ''}"
+            for i in range(n_categories)
+        ],
+        dtype=object,
+    )
+    ranks = rng.zipf(zipf, n_links) - 1
+    return pd.Series(titles[ranks[ranks < n_categories]])
+
+
+def per_row(links: pd.Series) -> pd.Series:
+    # Every link is cleaned, like `misinterpret` applied row by row
+    return links.map(lambda link: normalize.misinterpret(link.replace("|", "").strip()))
+
+
+def vectorized(links: pd.Series) -> pd.Series:
+    # Every link is cleaned, with the `.str` methods
+    return (
+        links.str.replace("|", "").str.strip().str.encode("utf-8").str.decode("latin1")
+    )
+
+
+def lookup_chunks(
+    links: pd.Series,
+    chunk_size: int,
+) -> Callable[[pd.Series], pd.Series]:
+    """Look up the links in chunks with one `CategoryLookup`, like create_categories."""
+    titles = normalize.clean_category_links(pd.Series(links.unique()))
+
+    def run(links: pd.Series) -> np.ndarray:
+        lookup = normalize.CategoryLookup(titles)
+        chunks = (
+            links.iloc[start : start + chunk_size]
+            for start in range(0, len(links), chunk_size)
+        )
+        return np.concatenate([lookup(chunk) for chunk in chunks])
+
+    return run
+
+
+def best_time(
+    func: Callable[[pd.Series], object],
+    links: pd.Series,
+    repeats: int,
+) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func(links)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args: argparse.Namespace):
+    links = synthetic_links(args.n_links, args.n_categories, args.zipf)
+    n_unique = links.nunique()
+    print(
+        f"{len(links):,} links, {n_unique:,} distinct ({len(links) / n_unique:.1f} repeats per link)",
+    )
+    expected = per_row(links)
+    assert normalize.clean_category_links(links).equals(expected)
+    for name, func in {
+        "per row": per_row,
+        "vectorized": vectorized,
+        "clean_category_links": normalize.clean_category_links,
+        f"CategoryLookup ({args.chunk_size:,} per chunk)": lookup_chunks(
+            links,
+            args.chunk_size,
+        ),
+    }.items():
+        print(f"{name:36} {best_time(func, links, args.repeats):8.3f}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare cleaning every category link with cleaning each distinct link once",
+    )
+    parser.add_argument("--n-links", type=int, default=5_000_000)
+    parser.add_argument("--n-categories", type=int, default=500_000)
+    parser.add_argument(
+        "--zipf",
+        type=float,
+        default=1.3,
+        help="The Zipf exponent of the link frequencies. Defaults to 1.3.",
+    )
+    parser.add_argument("--chunk-size", type=int, default=500_000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    main(args=args)
@@ -0,0 +1,50 @@
+import argparse
+import random
+import time
+from collections.abc import Callable
+
+from src.parse_sql_gz import parse_sql_inserts, tokenize_sql_inserts
+
+
+def synthetic_categorylinks_line(n_rows: int, seed: int = 0) -> str:
+    """Build one categorylinks INSERT line with realistic quoting and escapes."""
+    rng = random.Random(seed)
+    words = ["Danmark", "Kunst", "Sport", "O\\'Brien", "a\\\\b", "1900-tallet", "Æbler"]
+    rows = []
+    for page_id in range(n_rows):
+        title = "_".join(rng.choices(words, k=rng.randint(1, 4)))
+        cl_type = rng.choice(["page", "subcat", "file"])
+        rows.append(
+            f"({page_id},'{title}','{title.upper()}\\n{page_id}',"
+            f"'2024-04-01 12:00:00','','uppercase','{cl_type}')",
+        )
+    return "INSERT INTO `categorylinks` VALUES " + ",".join(rows) + ";\n"
+
+
+def time_parser(parser: Callable[[str], list[tuple]], line: str, repeats: int) -> float:
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        parser(line)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(args: argparse.Namespace):
+    line = synthetic_categorylinks_line(args.n_rows)
+    assert parse_sql_inserts(line) == tokenize_sql_inserts(line)
+    reference = time_parser(parse_sql_inserts, line, args.repeats)
+    tokenizer = time_parser(tokenize_sql_inserts, line, args.repeats)
+    print(f"parse_sql_inserts:    {args.n_rows / reference:12,.0f} records/sec")
+    print(f"tokenize_sql_inserts: {args.n_rows / tokenizer:12,.0f} records/sec")
+    print(f"Speedup: {reference / tokenizer:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the SQL INSERT parsers on a synthetic categorylinks line",
+    )
+    parser.add_argument("--n-rows", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    main(args=args)
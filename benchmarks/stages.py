@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+from collections.abc import Callable
+from datetime import datetime
+from pathlib import Path
+
+import src.instrumentation as instrumentation
+from benchmarks.synthetic import generate_wiki
+from src import (
+    category_index,
+    create_categories,
+    join_categories,
+    parse_articles,
+    parse_sql_gz,
+)
+
+HISTORY_PATH = Path("local_data") / "benchmarks" / "history.jsonl"
+PREFIX = "xx"
+
+
+def stage_runs(config_path: Path, args: argparse.Namespace) -> dict[str, Callable]:
+    """The stage entry points, called the way the pipeline calls them."""
+    articles = Path("local_data") / f"{PREFIX}wiki-sample-{args.n_articles}.jsonl"
+
+    def parse(processes: int) -> Callable:
+        return lambda: parse_articles.main(
+            argparse.Namespace(
+                num_articles=args.n_articles,
+                config_path=config_path,
+                skip_if_exists=False,
+                processes=processes,
+                output_path=articles,
+                incremental=False,
+            ),
+        )
+
+    def parse_sql(threaded: bool = False, processes: int = 1) -> Callable:
+        return lambda: parse_sql_gz.main(
+            argparse.Namespace(
+                config_path=config_path,
+                chunk_size=100_000,
+                intermediate_format="parquet",
+                threaded=threaded,
+                processes=processes,
+                force=True,
+                incremental=False,
+            ),
+        )
+
+    return {
+        "parse_articles": parse(1),
+        f"parse_articles ({args.processes} processes)": parse(args.processes),
+        "index_articles": lambda: category_index.main(
+            argparse.Namespace(config_path=config_path, processes=1),
+        ),
+        "parse_sql_gz": parse_sql(),
+        "parse_sql_gz (threaded)": parse_sql(threaded=True),
+        f"parse_sql_gz ({args.processes} processes)": parse_sql(
+            processes=args.processes,
+        ),
+        "join_categories": lambda: join_categories.main(
+            argparse.Namespace(
+                config_path=config_path,
+                intermediate_format="parquet",
+                incremental=False,
+            ),
+        ),
+        "create_categories": lambda: create_categories.create_dataset(
+            PREFIX,
+            n_articles=args.sample_size,
+            n_turns=args.n_turns,
+            seed=0,
+            articles_path=articles,
+        ),
+        "create_categories (full index)": lambda: create_categories.create_dataset(
+            PREFIX,
+            n_articles=args.sample_size,
+            n_turns=args.n_turns,
+            seed=0,
+            full_index=True,
+        ),
+    }
+
+
+def result_key(metrics: instrumentation.StageMetrics) -> str:
+    path = metrics.details.get("path")
+    return f"{metrics.stage} [{path}]" if path else metrics.stage
+
+
+def run_benchmarks(args: argparse.Namespace) -> dict[str, dict]:
+    """
+    Generate a synthetic wiki in a temporary directory and time every stage on it.
+
+    Returns:
+        dict[str, dict]: The best wall time and the matching metrics of every stage and measured function.
+    """
+    cwd = Path.cwd()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        config_path = generate_wiki(
+            Path(tmpdir),
+            prefix=PREFIX,
+            n_articles=args.n_articles,
+            n_categories=args.n_categories,
+            max_depth=args.max_depth,
+        ).relative_to(tmpdir)
+        os.chdir(tmpdir)
+        try:
+            for _ in range(args.repeats):
+                n_before = len(instrumentation.records())
+                for name, run in stage_runs(config_path, args).items():
+                    with instrumentation.measure(name):
+                        run()
+                for metrics in instrumentation.records()[n_before:]:
+                    key = result_key(metrics)
+                    if (
+                        key not in results
+                        or metrics.wall_seconds < results[key]["wall_seconds"]
+                    ):
+                        results[key] = {
+                            "wall_seconds": metrics.wall_seconds,
+                            "cpu_seconds": metrics.cpu_seconds,
+                            "peak_rss_mb": metrics.peak_rss_mb,
+                            "items_per_second": metrics.items_per_second,
+                        }
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def previous_results(history_path: Path, params: dict) -> dict[str, dict] | None:
+    """The results of the last run in the history with the same parameters."""
+    if not history_path.exists():
+        return None
+    previous = None
+    for line in history_path.read_text().splitlines():
+        entry = json.loads(line)
+        if entry["params"] == params:
+            previous = entry["results"]
+    return previous
+
+
+def print_results(
+    results: dict[str, dict],
+    previous: dict[str, dict] | None,
+    threshold: float,
+) -> None:
+    width = max(map(len, results))
+    print(
+        f"{'':{width}} {'wall':>8} {'CPU':>8} {'RSS MB':>8} {'items/s':>12}  vs. last",
+    )
+    for key, result in results.items():
+        change = ""
+        if previous and key in previous:
+            ratio = result["wall_seconds"] / max(previous[key]["wall_seconds"], 1e-9)
+            change = f"{ratio - 1:+.0%}"
+            if ratio > 1 + threshold:
+                change += " REGRESSION"
+        throughput = (
+            f"{result['items_per_second']:12,.0f}" if result["items_per_second"] else ""
+        )
+        print(
+            f"{key:{width}} {result['wall_seconds']:8.2f} {result['cpu_seconds']:8.2f}"
+            f" {result['peak_rss_mb']:8.0f} {throughput:>12}  {change}",
+        )
+
+
+def main(args: argparse.Namespace):
+    params = {
+        "n_articles": args.n_articles,
+        "n_categories": args.n_categories,
+        "max_depth": args.max_depth,
+        "processes": args.processes,
+        "sample_size": args.sample_size,
+        "n_turns": args.n_turns,
+    }
+    results = run_benchmarks(args)
+    print_results(results, previous_results(args.history, params), args.threshold)
+    args.history.parent.mkdir(parents=True, exist_ok=True)
+    entry = {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "params": params,
+        "results": results,
+    }
+    with args.history.open("a") as file:
+        file.write(json.dumps(entry) + "\n")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time every pipeline stage on a synthetic wiki and keep a history of the results",
+    )
+    parser.add_argument("--n-articles", type=int, default=10_000)
+    parser.add_argument("--n-categories", type=int, default=20_000)
+    parser.add_argument("--max-depth", type=int, default=25)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--sample-size", type=int, default=512)
+    parser.add_argument("--n-turns", type=int, default=10)
+    parser.add_argument("--repeats", type=int, default=1)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="Flag stages that are this much slower than the last run. Defaults to 0.2.",
+    )
+    parser.add_argument("--history", type=Path, default=HISTORY_PATH)
+    args = parser.parse_args()
+    main(args=args)
@@ -0,0 +1,315 @@
+import bz2
+import gzip
+import json
+import random
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+MEDIAWIKI_NS = "http://www.mediawiki.org/xml/export-0.10/"
+ROOT_CATEGORY = "Topniveau_for_emner"
+CONFIG = {
+    "category": "Kategori",
+    "infobox": "Infoboks",
+    "file": "Fil",
+    "top_level": f"'{ROOT_CATEGORY}'",
+}
+# Title words that exercise the SQL escaping and the latin1 round trip
+TITLE_WORDS = [
+    "Danmark",
+    "Kunst",
+    "Sport",
+    "O'Brien",
+    "Back\\slash",
+    "Byer_(Jylland)",
+    "1900-tallet",
+    "a,b",
+    "Æbler_og_Ørred",
+    "Straße",
+]
+
+
+def sql_quote(text: str) -> str:
+    """Quote a string the way mysqldump does."""
+    escaped = text.replace("\\", "\\\\").replace("'", "\\'").replace("\n", "\\n")
+    return f"'{escaped}'"
+
+
+def category_graph(
+    n_categories: int,
+    n_top: int = 20,
+    max_depth: int = 25,
+    cycle_fraction: float = 0.03,
+    seed: int = 0,
+) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """
+    Build a deep category graph below a root category, with some cycles.
+
+    Category 0 is the root and categories 1..n_top are its children (the top-level
+    categories). Every other category has 1-3 parents one level up, there is at
+    least one category on every level down to `max_depth`, and `cycle_fraction`
+    of the edges point to a random category instead, which creates cycles.
+
+    Args:
+        n_categories (int): The number of categories, including the root.
+        n_top (int): The number of top-level categories. Defaults to 20.
+        max_depth (int): The depth of the deepest categories. Defaults to 25.
+        cycle_fraction (float): The fraction of edges to random categories. Defaults to 0.03.
+        seed (int): The random seed. Defaults to 0.
+
+    Returns:
+        tuple[list[str], np.ndarray, np.ndarray]: The titles and the aligned child and parent ids of the edges.
+    """
+    if n_categories < n_top + max_depth:
+        raise ValueError(
+            f"Need at least {n_top + max_depth} categories for depth {max_depth}",
+        )
+    rng = np.random.default_rng(seed)
+    titles = [ROOT_CATEGORY] + [
+        f"{TITLE_WORDS[i % len(TITLE_WORDS)]}_{i}" for i in range(1, n_categories)
+    ]
+    depth = np.minimum(rng.geometric(0.3, n_categories) + 1, max_depth)
+    depth[0] = 0
+    depth[1 : n_top + 1] = 1
+    chain = np.arange(2, max_depth + 1)
+    depth[n_top + 1 : n_top + 1 + len(chain)] = chain
+    order = np.argsort(depth, kind="stable")
+    level_bounds = np.searchsorted(depth[order], np.arange(max_depth + 2))
+
+    n_parents = np.where(depth > 1, rng.integers(1, 4, n_categories), depth)
+    child = np.repeat(np.arange(n_categories), n_parents)
+    level_start = level_bounds[depth[child] - 1]
+    level_size = level_bounds[depth[child]] - level_start
+    parent = order[level_start + (rng.random(len(child)) * level_size).astype(int)]
+    deep = depth[child] > 1
+    random_parent = deep & (rng.random(len(child)) < cycle_fraction)
+    parent[random_parent] = rng.integers(n_top + 1, n_categories, random_parent.sum())
+    keep = child != parent
+    return titles, child[keep], parent[keep]
+
+
+def write_sql_inserts(
+    path: Path,
+    table: str,
+    rows: list[str],
+    rows_per_insert: int = 1000,
+) -> None:
+    with gzip.open(path, "wt", encoding="utf-8") as file:
+        file.write(f"-- MySQL dump\nDROP TABLE IF EXISTS `{table}`;\n")
+        file.write(f"CREATE TABLE `{table}` (\n  `x` int\n);\n")
+        for start in range(0, len(rows), rows_per_insert):
+            batch = ",".join(rows[start : start + rows_per_insert])
+            file.write(f"INSERT INTO `{table}` VALUES {batch};\n")
+
+
+def article_categories(
+    n_articles: int,
+    n_categories: int,
+    seed: int = 0,
+) -> list[list[int]]:
+    """Pick 1-4 categories (never the root) for every article."""
+    rng = random.Random(seed)
+    return [
+        rng.sample(range(1, n_categories), k=min(rng.randint(1, 4), n_categories - 1))
+        for _ in range(n_articles)
+    ]
+
+
+def write_sql_dumps(
+    directory: Path,
+    prefix: str,
+    titles: list[str],
+    child: np.ndarray,
+    parent: np.ndarray,
+    categories: list[list[int]],
+) -> None:
+    """Write the `page` and `categorylinks` dumps of the categories and articles."""
+    category_page_id = 1_000_000
+    page_rows = [
+        f"({category_page_id + i},14,{sql_quote(title)},0,0,0.5,"
+        f"'20240401000000','20240401000000',{i},100,'wikitext',NULL)"
+        for i, title in enumerate(titles)
+    ]
+    page_rows += [
+        f"({page_id},0,{sql_quote(f'Artikel_{page_id}')},0,0,0.5,"
+        f"'20240401000000','20240401000000',{page_id},100,'wikitext',NULL)"
+        for page_id in range(1, len(categories) + 1)
+    ]
+    link_rows = [
+        f"({category_page_id + c},{sql_quote(titles[p])},"
+        f"{sql_quote(titles[c].upper() + chr(10) + titles[c])},"
+        f"'2024-04-01 12:00:00','','uppercase','subcat')"
+        for c, p in zip(child.tolist(), parent.tolist())
+    ]
+    link_rows += [
+        f"({page_id},{sql_quote(titles[c])},{sql_quote(f'ARTIKEL {page_id}')},"
+        f"'2024-04-01 12:00:00','','uppercase','page')"
+        for page_id, cats in enumerate(categories, start=1)
+        for c in cats
+    ]
+    random.Random(0).shuffle(link_rows)
+    write_sql_inserts(directory / f"{prefix}wiki-latest-page.sql.gz", "page", page_rows)
+    write_sql_inserts(
+        directory / f"{prefix}wiki-latest-categorylinks.sql.gz",
+        "categorylinks",
+        link_rows,
+    )
+
+
+def vocabulary(n_words: int = 5000, seed: int = 0) -> list[str]:
+    """Random words, so that the dumps compress about as well as real text."""
+    rng = random.Random(seed)
+    letters = "abcdefghijklmnoprstuvyæøå"
+    return ["".join(rng.choices(letters, k=rng.randint(2, 10))) for _ in range(n_words)]
+
+
+def article_text(
+    rng: random.Random,
+    page_id: int,
+    titles: list[str],
+    categories: list[int],
+    words: list[str],
+) -> str:
+    """Wikitext with a nested infobox, file links, templates and categories."""
+    infobox = "{{Infoboks person\n" + "".join(
+        f"| felt{i} = {{{{nowrap|{rng.choice(words)}}}}} [[{rng.choice(words)}]]\n"
+        for i in range(rng.randint(5, 30))
+    )
+    paragraphs = [
+        infobox
+        + "}}\n"
+        + f"[[Fil:Billede{page_id}.jpg|thumb|Tekst med [[link]]]]"
+        + f"'''Artikel {page_id}''' er en [[side]] om &, < og > med "
+        + " ".join(rng.choices(words, k=rng.randint(10, 80)))
+        + " {{cite web|url=x|title=y}}.",
+    ]
+    for i in range(rng.randint(2, 12)):
+        sentences = [
+            " ".join(rng.choices(words, k=rng.randint(4, 20)))
+            + f" [[{rng.choice(words)}|{rng.choice(words)}]]"
+            + f" {{{{citation|år={rng.randint(1000, 2024)}}}}}."
+            for _ in range(rng.randint(2, 8))
+        ]
+        if rng.random() < 0.3:
+            sentences.insert(0, f"[[Fil:Billede{page_id}_{i}.png|mini|[[x]]]]")
+        paragraphs.append(" ".join(sentences))
+    # Some links have a sort key, like [[Kategori:Danmark|*]]
+    links = "".join(
+        f"\n[[Kategori:{titles[c]}{'|*' if rng.random() < 0.2 else ''}]]"
+        for c in categories
+    )
+    return "\n\n".join(paragraphs) + links
+
+
+def page_xml(page_id: int, ns: int, title: str, text: str, redirect: str | None) -> str:
+    redirect_elem = f'    <redirect title="{escape(redirect)}" />\n' if redirect else ""
+    return (
+        f"  <page>\n    <title>{escape(title)}</title>\n    <ns>{ns}</ns>\n"
+        f"    <id>{page_id}</id>\n{redirect_elem}    <revision>\n"
+        f"      <id>{page_id * 10}</id>\n      <model>wikitext</model>\n"
+        f'      <text bytes="{len(text)}" xml:space="preserve">{escape(text)}</text>\n'
+        f"    </revision>\n  </page>\n"
+    )
+
+
+def write_articles_dump(
+    directory: Path,
+    prefix: str,
+    titles: list[str],
+    categories: list[list[int]],
+    seed: int = 0,
+    pages_per_stream: int = 100,
+) -> None:
+    """
+    Write the articles as a regular and a multistream XML dump (with its index).
+
+    Every 20th page is a redirect and every 25th a category page, which the
+    parser skips.
+    """
+    rng = random.Random(seed)
+    words = vocabulary(seed=seed)
+    pages = []
+    for page_id, cats in enumerate(categories, start=1):
+        title = f"Artikel {page_id}"
+        if page_id % 20 == 0:
+            target = f"Artikel {page_id + 1}"
+            text = f"#REDIRECT [[{target}]]"
+            pages.append((page_id, title, page_xml(page_id, 0, title, text, target)))
+        elif page_id % 25 == 0:
+            title = f"Kategori:{titles[cats[0]]}"
+            text = f"Kategorien for [[{titles[cats[0]]}]]."
+            pages.append((page_id, title, page_xml(page_id, 14, title, text, None)))
+        else:
+            text = article_text(rng, page_id, titles, cats, words)
+            pages.append((page_id, title, page_xml(page_id, 0, title, text, None)))
+
+    header = (
+        f'<mediawiki xmlns="{MEDIAWIKI_NS}" version="0.10" xml:lang="{prefix}">\n'
+        "  <siteinfo>\n    <sitename>Wikipedia</sitename>\n  </siteinfo>\n"
+    )
+    footer = "</mediawiki>\n"
+    dump_path = directory / f"{prefix}wiki-latest-pages-articles.xml.bz2"
+    with bz2.open(dump_path, "wt", encoding="utf-8") as file:
+        file.write(header)
+        for _, _, xml in pages:
+            file.write(xml)
+        file.write(footer)
+
+    index = []
+    multistream_path = (
+        directory / f"{prefix}wiki-latest-pages-articles-multistream.xml.bz2"
+    )
+    with multistream_path.open("wb") as file:
+        file.write(bz2.compress(header.encode("utf-8")))
+        for start in range(0, len(pages), pages_per_stream):
+            stream = pages[start : start + pages_per_stream]
+            offset = file.tell()
+            index += [f"{offset}:{page_id}:{title}" for page_id, title, _ in stream]
+            file.write(
+                bz2.compress("".join(xml for _, _, xml in stream).encode("utf-8")),
+            )
+        file.write(bz2.compress(footer.encode("utf-8")))
+    index_path = (
+        directory / f"{prefix}wiki-latest-pages-articles-multistream-index.txt.bz2"
+    )
+    index_path.write_bytes(bz2.compress(("\n".join(index) + "\n").encode("utf-8")))
+
+
+def generate_wiki(
+    root: Path,
+    prefix: str = "xx",
+    n_articles: int = 10_000,
+    n_categories: int = 5_000,
+    max_depth: int = 25,
+    seed: int = 0,
+) -> Path:
+    """
+    Write a synthetic wiki: a language config and the dumps the pipeline reads.
+
+    The files are laid out like a checkout, with the config in
+    `root/language_configs/` and the dumps in `root/local_data/`.
+
+    Args:
+        root (Path): The directory to write to.
+        prefix (str): The language prefix. Defaults to "xx".
+        n_articles (int): The number of pages in the articles dump. Defaults to 10,000.
+        n_categories (int): The number of categories. Defaults to 5,000.
+        max_depth (int): The depth of the category graph. Defaults to 25.
+        seed (int): The random seed. Defaults to 0.
+
+    Returns:
+        Path: The path of the language config.
+    """
+    config_dir = root / "language_configs"
+    data_dir = root / "local_data"
+    config_dir.mkdir(parents=True, exist_ok=True)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    config_path = config_dir / f"{prefix}-config.json"
+    config_path.write_text(json.dumps({"prefix": prefix, **CONFIG}, indent=4))
+
+    titles, child, parent = category_graph(n_categories, max_depth=max_depth, seed=seed)
+    categories = article_categories(n_articles, n_categories, seed=seed)
+    write_sql_dumps(data_dir, prefix, titles, child, parent, categories)
+    write_articles_dump(data_dir, prefix, titles, categories, seed=seed)
+    return config_path
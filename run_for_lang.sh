@@ -7,8 +7,8 @@ if [ "$#" -ne 1 ]; then
 fi
 
 config_path="$1"
+prefix=$(basename "$config_path" | cut -d- -f1)
 
-# Run each Python script using Poetry, with the config path as an argument
-poetry run python src/parse_articles.py --config-path "$config_path" --num-articles 300000 --skip-if-exists
-poetry run python src/parse_sql_gz.py --config-path "$config_path"
-poetry run python src/join_categories.py --config-path "$config_path"
+# Bring the parsed articles and category parents up to date; stages whose inputs
+# and parameters have not changed are skipped
+poetry run python src/pipeline.py --prefixes "$prefix" --targets parse_articles join_categories
@@ -0,0 +1,211 @@
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import src.fileio as fileio
+from src.category_graph import CategoryGraph, first_ancestor_levels, top_level_frontiers
+
+
+def ancestor_index_path(prefix: str) -> Path:
+    """The path of a language's ancestor index, a single memory-mappable file (see `fileio.write_arrays`)."""
+    return fileio.DATA_DIR / f"{prefix}wiki-ancestor-index.arrays"
+
+
+@dataclass
+class AncestorIndex:
+    """
+    A category graph with the top-level ancestors of every category precomputed.
+
+    The top-level ancestors of category `i` are
+    `ancestors.indices[ancestors.indptr[i] : ancestors.indptr[i + 1]]`, ordered by
+    depth, and `depths` holds the BFS level at which each was first reached (see
+    `top_level_frontiers`). A lookup is a slice, so it takes constant time per
+    category whatever the size of the graph.
+    """
+
+    # parent -> child edges
+    graph: CategoryGraph
+    # category -> top-level ancestor edges
+    ancestors: CategoryGraph
+    depths: np.ndarray
+    top_ids: np.ndarray
+    num_levels: int | None
+    metadata: dict = field(default_factory=dict)
+    _positions: pd.Index | None = field(default=None, init=False, repr=False)
+
+    @classmethod
+    def from_frontiers(
+        cls: "AncestorIndex",
+        graph: CategoryGraph,
+        top_ids: np.ndarray,
+        frontiers: tuple[np.ndarray, np.ndarray, np.ndarray],
+        num_levels: int | None = 20,
+        metadata: dict | None = None,
+    ) -> "AncestorIndex":
+        """Build the index from the (category, top-level id, level) triples of `top_level_frontiers`."""
+        categories, ancestors, levels = first_ancestor_levels(*frontiers, graph.n_nodes)
+        # Grouped by category like `from_codes` does, so the depths stay aligned
+        order = np.argsort(categories, kind="stable")
+        return cls(
+            graph=graph,
+            ancestors=CategoryGraph.from_codes(
+                ancestors.astype(np.int32),
+                categories,
+                graph.names,
+            ),
+            depths=levels[order].astype(np.int16),
+            top_ids=np.unique(np.asarray(top_ids, dtype=np.int32)),
+            num_levels=num_levels,
+            metadata=metadata or {},
+        )
+
+    @classmethod
+    def build(
+        cls: "AncestorIndex",
+        graph: CategoryGraph,
+        top_ids: np.ndarray,
+        num_levels: int | None = 20,
+    ) -> "AncestorIndex":
+        """Compute the top-level ancestors of every category in `graph`."""
+        frontiers = top_level_frontiers(graph, top_ids, num_levels=num_levels)
+        return cls.from_frontiers(graph, top_ids, frontiers, num_levels=num_levels)
+
+    def save(self, path: Path) -> None:
+        fileio.write_arrays(
+            {
+                "graph_indptr": self.graph.indptr,
+                "graph_indices": self.graph.indices,
+                "ancestor_indptr": self.ancestors.indptr,
+                "ancestor_ids": self.ancestors.indices,
+                "depths": self.depths,
+                "top_ids": self.top_ids,
+            },
+            path,
+            metadata={
+                **self.metadata,
+                "n_categories": self.n_categories,
+                "num_levels": self.num_levels,
+            },
+        )
+
+    @classmethod
+    def load(
+        cls: "AncestorIndex",
+        path: Path,
+        names: np.ndarray,
+        mmap: bool = True,
+    ) -> "AncestorIndex":
+        """
+        Load an ancestor index written by `save`.
+
+        Args:
+            path (Path): The path of the index, see `ancestor_index_path`.
+            names (np.ndarray): The category titles by id, i.e. the vocabulary the index was built with.
+            mmap (bool): Memory-map the arrays instead of reading them. Defaults to True.
+
+        Returns:
+            AncestorIndex: The index.
+        """
+        arrays, metadata = fileio.read_arrays(path, mmap=mmap)
+        if len(names) != metadata["n_categories"]:
+            raise ValueError(
+                f"{path} was built for {metadata['n_categories']} categories, not {len(names)}. "
+                "Run join_categories again.",
+            )
+        names = np.asarray(names, dtype=object)
+        return cls(
+            graph=CategoryGraph(names, arrays["graph_indptr"], arrays["graph_indices"]),
+            ancestors=CategoryGraph(
+                names,
+                arrays["ancestor_indptr"],
+                arrays["ancestor_ids"],
+            ),
+            depths=arrays["depths"],
+            top_ids=arrays["top_ids"],
+            num_levels=metadata.pop("num_levels"),
+            metadata=metadata,
+        )
+
+    @property
+    def n_categories(self) -> int:
+        return self.graph.n_nodes
+
+    def ids(self, titles: Iterable[str]) -> np.ndarray:
+        """Look up the ids of category titles. Unknown titles get -1."""
+        if self._positions is None:
+            self._positions = pd.Index(self.graph.names)
+        return self._positions.get_indexer(list(titles))
+
+    def top_level(self, category: int, max_depth: int | None = None) -> np.ndarray:
+        """
+        The top-level ancestor ids of one category.
+
+        Args:
+            category (int): The category id.
+            max_depth (int | None): Only the ancestors at most this many levels up, where 1 means a direct parent. Defaults to None (all, up to `num_levels`).
+
+        Returns:
+            np.ndarray: The ancestor ids, ordered by depth.
+        """
+        start, end = (
+            self.ancestors.indptr[category],
+            self.ancestors.indptr[category + 1],
+        )
+        ancestors = np.asarray(self.ancestors.indices[start:end])
+        if max_depth is not None:
+            ancestors = ancestors[self.depths[start:end] <= max_depth]
+        return ancestors
+
+    def lookup(
+        self,
+        categories: np.ndarray,
+        max_depth: int | None = None,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Look up the top-level ancestors of many categories at once.
+
+        Args:
+            categories (np.ndarray): The category ids.
+            max_depth (int | None): Only the ancestors at most this many levels up, where 1 means a direct parent. Defaults to None (all, up to `num_levels`).
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: For every (category, ancestor) pair, the position of the category in `categories` and the ancestor id.
+        """
+        source, positions = self.ancestors.edge_positions(
+            np.asarray(categories, dtype=np.int64),
+        )
+        if max_depth is not None:
+            keep = self.depths[positions] <= max_depth
+            source, positions = source[keep], positions[keep]
+        return source, np.asarray(self.ancestors.indices[positions])
+
+    def lookup_titles(
+        self,
+        titles: Iterable[str],
+        max_depth: int | None = None,
+    ) -> dict[str, list[str]]:
+        """Look up the top-level ancestor titles of category titles. Unknown titles have no ancestors."""
+        titles = list(titles)
+        ids = self.ids(titles)
+        known = np.flatnonzero(ids >= 0)
+        source, ancestors = self.lookup(ids[known], max_depth=max_depth)
+        result = {title: [] for title in titles}
+        for position, ancestor in zip(known[source], self.graph.names[ancestors]):
+            result[titles[position]].append(ancestor)
+        return result
+
+    def with_top_level(
+        self,
+        top_ids: np.ndarray,
+        num_levels: int | None = 20,
+    ) -> "AncestorIndex":
+        """Recompute the index for other top-level categories from the stored graph, without the SQL dumps."""
+        return AncestorIndex.build(self.graph, top_ids, num_levels=num_levels)
+
+    def reroot(self, root_id: int, num_levels: int | None = 20) -> "AncestorIndex":
+        """Recompute the index with the children of another root category as the top level."""
+        _, top_ids = self.graph.expand(np.array([root_id]))
+        return self.with_top_level(top_ids, num_levels=num_levels)
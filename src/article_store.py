@@ -0,0 +1,161 @@
+import json
+import mmap
+from array import array
+from collections.abc import Generator, Iterable
+from pathlib import Path
+
+import numpy as np
+
+import src.fileio as fileio
+from src.article_table import ArticleTable, ArticleTableBuilder
+
+
+def index_path(path: Path) -> Path:
+    """The path of the title index that belongs to an article store."""
+    return path.with_name(path.stem + ".index.parquet")
+
+
+def write_articles(
+    articles: Iterable[tuple[str, str, list[str], int, int]],
+    path: Path,
+) -> int:
+    """
+    Write articles as JSON Lines, one record per line, plus a title index.
+
+    The index holds the title, byte offset, byte length, categories, page id and
+    revision id of every record, so readers can look up categories without
+    touching the texts and read single records by seeking. Both files are written
+    under temporary names and renamed once complete, so the files of a store that
+    is still being read (e.g. the previous run in incremental mode) are never
+    overwritten in place.
+
+    Args:
+        articles (Iterable[tuple[str, str, list[str], int, int]]): The (title, text, categories, page id, revision id) records.
+        path (Path): The path of the `.jsonl` file.
+
+    Returns:
+        int: The number of articles written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    # Titles and categories are kept as an ArticleTable, the rest as compact arrays
+    articles_table = ArticleTableBuilder(texts=False)
+    offsets, lengths, page_ids, revision_ids = (
+        array("q"),
+        array("i"),
+        array("q"),
+        array("q"),
+    )
+    offset = 0
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as file:
+        for title, text, cats, page_id, revision_id in articles:
+            line = json.dumps(
+                {"title": title, "text": text, "categories": cats},
+                ensure_ascii=False,
+            ).encode("utf-8")
+            file.write(line + b"\n")
+            articles_table.append(title, None, cats)
+            offsets.append(offset)
+            lengths.append(len(line))
+            page_ids.append(page_id)
+            revision_ids.append(revision_id)
+            offset += len(line) + 1
+    table = articles_table.build()
+    # Like a dict, a repeated title keeps its last record
+    rows = table.last_rows()
+    index = table.take(rows).to_arrow()
+    for name, values, dtype in [
+        ("offset", offsets, np.int64),
+        ("length", lengths, np.int32),
+        ("page_id", page_ids, np.int64),
+        ("revision_id", revision_ids, np.int64),
+    ]:
+        index = index.append_column(
+            name,
+            pa.array(np.frombuffer(values, dtype=dtype)[rows]),
+        )
+    tmp_index_path = index_path(path).with_name(index_path(path).name + ".tmp")
+    pq.write_table(index, tmp_index_path, compression=fileio.PARQUET_COMPRESSION)
+    tmp_path.replace(path)
+    tmp_index_path.replace(index_path(path))
+    return len(index)
+
+
+class ArticleStore:
+    """
+    Read access to an article store written by `write_articles`.
+
+    The record file is memory-mapped, so looking up the texts of a sample only
+    reads the pages that hold those records. The titles and categories of the
+    index are loaded as an `ArticleTable` (`articles`), and the byte offsets and
+    ids as a DataFrame (`index`).
+    """
+
+    def __init__(self, path: Path) -> None:
+        import pyarrow.parquet as pq
+
+        self.path = path
+        table = pq.read_table(index_path(path), memory_map=True)
+        self.articles = ArticleTable.from_arrow(table)
+        self.index = table.drop_columns(["title", "categories"]).to_pandas()
+        self._pages: dict[int, int] | None = None
+        self._file = path.open("rb")
+        size = path.stat().st_size
+        self._data = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        )
+
+    def __enter__(self) -> "ArticleStore":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def records(self, titles: Iterable[str]) -> list[dict]:
+        """Read the records of `titles`. Raises a KeyError for unknown titles."""
+        positions = self.articles.positions(titles)
+        if (positions == -1).any():
+            raise KeyError("Some titles are not in the article store")
+        offsets = self.index["offset"].to_numpy()[positions]
+        lengths = self.index["length"].to_numpy()[positions]
+        return [
+            json.loads(self._data[offset : offset + length])
+            for offset, length in zip(offsets, lengths)
+        ]
+
+    def texts(self, titles: Iterable[str]) -> list[str]:
+        return [record["text"] for record in self.records(titles)]
+
+    def revisions(self) -> dict[int, int]:
+        """The revision id of every page id, empty for stores written without ids."""
+        if "page_id" not in self.index:
+            return {}
+        return dict(
+            zip(self.index["page_id"].tolist(), self.index["revision_id"].tolist()),
+        )
+
+    def page_record(self, page_id: int) -> dict:
+        """Read the record of a page id. Raises a KeyError for unknown page ids."""
+        if self._pages is None:
+            self._pages = dict(
+                zip(self.index["page_id"].tolist(), range(len(self.index))),
+            )
+        position = self._pages[page_id]
+        offset = self.index["offset"].iat[position]
+        return json.loads(
+            self._data[offset : offset + self.index["length"].iat[position]],
+        )
+
+    def __iter__(self) -> Generator[dict]:
+        for offset, length in zip(self.index["offset"], self.index["length"]):
+            yield json.loads(self._data[offset : offset + length])
@@ -0,0 +1,214 @@
+from array import array
+from collections.abc import Iterable
+from dataclasses import dataclass
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+import pandas as pd
+
+import src.fileio as fileio
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+
+def _string_array(data: bytes | bytearray, offsets: array) -> "pa.LargeStringArray":
+    import pyarrow as pa
+
+    return pa.LargeStringArray.from_buffers(
+        len(offsets) - 1,
+        pa.py_buffer(np.frombuffer(offsets, dtype=np.int64)),
+        pa.py_buffer(data),
+    )
+
+
+@dataclass
+class ArticleTable:
+    """
+    Articles as columns: titles and texts in contiguous UTF-8 buffers with offsets
+    (Arrow large strings), and categories as CSR arrays of int32 ids.
+
+    The categories of article `i` are `names[category_ids[indptr[i] : indptr[i + 1]]]`.
+    `texts` is None for tables that only hold titles and categories, like the
+    index of an article store.
+    """
+
+    titles: "pa.LargeStringArray"
+    texts: "pa.LargeStringArray | None"
+    indptr: np.ndarray
+    category_ids: np.ndarray
+    names: np.ndarray
+
+    @classmethod
+    def from_articles(
+        cls: "ArticleTable",
+        articles: Iterable[tuple[str, str | None, list[str]]],
+        texts: bool = True,
+    ) -> "ArticleTable":
+        """Build a table from (title, text, categories) records. With `texts=False` the texts are dropped."""
+        builder = ArticleTableBuilder(texts=texts)
+        for title, text, categories in articles:
+            builder.append(title, text, categories)
+        return builder.build()
+
+    @classmethod
+    def from_arrow(cls: "ArticleTable", table: "pa.Table") -> "ArticleTable":
+        """Read the title, (text) and categories columns of an Arrow table, without per-article Python objects."""
+        import pyarrow as pa
+
+        categories = table.column("categories").combine_chunks()
+        offsets = categories.offsets.to_numpy().astype(np.int64)
+        encoded = categories.flatten().dictionary_encode()
+        texts = (
+            table.column("text").combine_chunks().cast(pa.large_string())
+            if "text" in table.column_names
+            else None
+        )
+        return cls(
+            titles=table.column("title").combine_chunks().cast(pa.large_string()),
+            texts=texts,
+            indptr=offsets - offsets[0],
+            category_ids=encoded.indices.to_numpy(zero_copy_only=False).astype(
+                np.int32,
+            ),
+            names=encoded.dictionary.to_numpy(zero_copy_only=False),
+        )
+
+    @classmethod
+    def load(cls: "ArticleTable", path: Path) -> "ArticleTable":
+        import pyarrow.parquet as pq
+
+        return cls.from_arrow(pq.read_table(path, memory_map=True))
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    @property
+    def nbytes(self) -> int:
+        """The memory held by the columns, excluding the category names."""
+        return (
+            self.titles.nbytes
+            + (self.texts.nbytes if self.texts is not None else 0)
+            + self.indptr.nbytes
+            + self.category_ids.nbytes
+        )
+
+    def positions(self, titles: Iterable[str]) -> np.ndarray:
+        """Look up the positions of `titles` in one vectorized pass. Unknown titles get -1."""
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        found = pc.index_in(
+            pa.array(list(titles), type=pa.large_string()),
+            value_set=self.titles,
+        )
+        return found.fill_null(-1).to_numpy().astype(np.int64)
+
+    def lookup_texts(self, titles: Iterable[str]) -> list[str]:
+        """Read the texts of `titles`. Raises a KeyError for unknown titles."""
+        if self.texts is None:
+            raise ValueError("The table has no texts")
+        positions = self.positions(titles)
+        if (positions == -1).any():
+            raise KeyError("Some titles are not in the article table")
+        return self.texts.take(positions).to_pylist()
+
+    def categories(self, position: int) -> list[str]:
+        """The category names of the article at `position`."""
+        ids = self.category_ids[self.indptr[position] : self.indptr[position + 1]]
+        return self.names[ids].tolist()
+
+    def edges(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Explode the table into (article, category) pairs.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The article positions and category ids of all pairs, in table order.
+        """
+        articles = np.repeat(np.arange(len(self)), np.diff(self.indptr))
+        return articles, self.category_ids
+
+    def last_rows(self) -> np.ndarray:
+        """The positions of the last article of every title, like a dict that is updated in table order."""
+        import pyarrow.compute as pc
+
+        if pc.count_distinct(self.titles).as_py() == len(self):
+            return np.arange(len(self))
+        titles = pd.Series(self.titles.to_numpy(zero_copy_only=False))
+        return np.flatnonzero(~titles.duplicated(keep="last").to_numpy())
+
+    def take(self, rows: np.ndarray) -> "ArticleTable":
+        """Select articles by position. The category names are kept as they are."""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        ids = np.arange(indptr[-1]) - np.repeat(indptr[:-1] - starts, counts)
+        return ArticleTable(
+            titles=self.titles.take(rows),
+            texts=self.texts.take(rows) if self.texts is not None else None,
+            indptr=indptr,
+            category_ids=self.category_ids[ids],
+            names=self.names,
+        )
+
+    def to_arrow(self) -> "pa.Table":
+        """The table as Arrow, with the categories as a list<string> column."""
+        import pyarrow as pa
+
+        categories = pa.ListArray.from_arrays(
+            pa.array(self.indptr, type=pa.int32()),
+            pa.array(self.names, type=pa.string()).take(pa.array(self.category_ids)),
+        )
+        columns = {"title": self.titles, "categories": categories}
+        if self.texts is not None:
+            columns["text"] = self.texts
+        return pa.table(columns)
+
+    def write(self, path: Path) -> None:
+        import pyarrow.parquet as pq
+
+        pq.write_table(self.to_arrow(), path, compression=fileio.PARQUET_COMPRESSION)
+
+
+class ArticleTableBuilder:
+    """Appends articles one at a time to the buffers of an `ArticleTable`."""
+
+    def __init__(self, texts: bool = True) -> None:
+        self._titles = bytearray()
+        self._title_offsets = array("q", [0])
+        self._texts = bytearray() if texts else None
+        self._text_offsets = array("q", [0])
+        self._indptr = array("q", [0])
+        self._category_ids = array("i")
+        self._ids: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._indptr) - 1
+
+    def append(self, title: str, text: str | None, categories: list[str]) -> None:
+        self._titles += title.encode("utf-8")
+        self._title_offsets.append(len(self._titles))
+        if self._texts is not None:
+            self._texts += text.encode("utf-8")
+            self._text_offsets.append(len(self._texts))
+        ids = self._ids
+        self._category_ids.extend(
+            [ids.setdefault(category, len(ids)) for category in categories],
+        )
+        self._indptr.append(len(self._category_ids))
+
+    def build(self) -> ArticleTable:
+        return ArticleTable(
+            titles=_string_array(self._titles, self._title_offsets),
+            texts=(
+                _string_array(self._texts, self._text_offsets)
+                if self._texts is not None
+                else None
+            ),
+            indptr=np.frombuffer(self._indptr, dtype=np.int64),
+            category_ids=np.frombuffer(self._category_ids, dtype=np.int32),
+            names=np.array(list(self._ids), dtype=object),
+        )
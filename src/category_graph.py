@@ -0,0 +1,337 @@
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+
+@dataclass
+class CategoryGraph:
+    """
+    A category graph with titles interned as dense int ids.
+
+    The edges are stored parent -> child in CSR form: the children of category `i`
+    are `indices[indptr[i] : indptr[i + 1]]`.
+    """
+
+    names: np.ndarray
+    indptr: np.ndarray
+    indices: np.ndarray
+
+    @classmethod
+    def from_codes(
+        cls: "CategoryGraph",
+        child_ids: np.ndarray,
+        parent_ids: np.ndarray,
+        names: np.ndarray,
+    ) -> "CategoryGraph":
+        order = np.argsort(parent_ids, kind="stable")
+        counts = np.bincount(parent_ids, minlength=len(names))
+        indptr = np.zeros(len(names) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(
+            names=np.asarray(names, dtype=object),
+            indptr=indptr,
+            indices=np.asarray(child_ids)[order],
+        )
+
+    @classmethod
+    def from_edges(
+        cls: "CategoryGraph",
+        child: pd.Series,
+        parent: pd.Series,
+    ) -> "CategoryGraph":
+        """Build the graph from aligned child and parent title columns."""
+        codes, names = pd.factorize(
+            pd.concat([child, parent], ignore_index=True),
+            use_na_sentinel=False,
+        )
+        return cls.from_codes(codes[: len(child)], codes[len(child) :], names)
+
+    @property
+    def n_nodes(self) -> int:
+        return len(self.names)
+
+    def ids(self, titles: np.ndarray | pd.Series | list) -> np.ndarray:
+        """Look up the ids of `titles`, dropping titles that are not in the graph."""
+        ids = pd.Index(self.names).get_indexer(pd.unique(np.asarray(titles)))
+        return ids[ids >= 0]
+
+    def expand(self, nodes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Expand nodes to all of their children.
+
+        Args:
+            nodes (np.ndarray): The parent ids to expand.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: For every edge, the position of its parent in `nodes` and the child id.
+        """
+        source, positions = self.edge_positions(nodes)
+        return source, self.indices[positions]
+
+    def edge_positions(self, nodes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Like `expand`, but return the positions of the edges in `indices` instead of the children."""
+        starts = self.indptr[nodes]
+        counts = self.indptr[nodes + 1] - starts
+        source = np.repeat(np.arange(len(nodes)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(
+            np.cumsum(counts) - counts,
+            counts,
+        )
+        return source, starts[source] + offsets
+
+    def edges(self) -> tuple[np.ndarray, np.ndarray]:
+        """The (child id, parent id) of every edge, grouped by parent."""
+        parents = np.repeat(np.arange(self.n_nodes), np.diff(self.indptr))
+        return self.indices, parents
+
+    def reversed(self) -> "CategoryGraph":
+        """The same graph with child -> parent edges, so `expand` lists the parents of nodes."""
+        child_ids, parent_ids = self.edges()
+        return CategoryGraph.from_codes(parent_ids, child_ids, self.names)
+
+    def descendants(self, nodes: np.ndarray) -> np.ndarray:
+        """Find the sorted ids of `nodes` and every node below them."""
+        seen = np.zeros(self.n_nodes, dtype=bool)
+        frontier = np.unique(np.asarray(nodes, dtype=np.int64))
+        seen[frontier] = True
+        while len(frontier):
+            _, children = self.expand(frontier)
+            frontier = np.unique(children[~seen[children]])
+            seen[frontier] = True
+        return np.flatnonzero(seen)
+
+
+def _first_occurrences(keys: np.ndarray) -> np.ndarray:
+    """Return the sorted positions of the first occurrence of every distinct key."""
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    is_first = np.ones(len(keys), dtype=bool)
+    is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    return np.sort(order[is_first])
+
+
+def _unique_pairs(
+    first: np.ndarray,
+    second: np.ndarray,
+    n_nodes: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    keys = np.sort(first.astype(np.int64) * n_nodes + second)
+    keys = keys[np.r_[True, keys[1:] != keys[:-1]]] if len(keys) else keys
+    return keys // n_nodes, keys % n_nodes
+
+
+def top_level_frontiers(
+    graph: CategoryGraph,
+    top_ids: np.ndarray,
+    num_levels: int | None = 20,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Find the BFS frontiers of a multi-source BFS from the top-level categories.
+
+    Level 1 is every edge into a top-level category. A category first reached at
+    level k > 1 inherits the top-level ancestors of its parents at level k - 1 and
+    is never expanded into again, which is what stops cycles. Edges into or out of
+    top-level categories are only followed at level 1.
+
+    Args:
+        graph (CategoryGraph): The category graph.
+        top_ids (np.ndarray): The ids of the top-level categories.
+        num_levels (int | None): The maximum depth to assign. Defaults to 20, None means no limit.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: Aligned (category id, top-level id, level) triples, sorted by level, category and top-level id.
+    """
+    top_ids = np.unique(np.asarray(top_ids, dtype=np.int64))
+    is_top = np.zeros(graph.n_nodes, dtype=bool)
+    is_top[top_ids] = True
+    seen = np.zeros(graph.n_nodes, dtype=bool)
+
+    source, child = graph.expand(top_ids)
+    frontier, tops = _unique_pairs(child, top_ids[source], graph.n_nodes)
+    levels = [(frontier, tops)]
+    level = 1
+    while len(frontier) and (num_levels is None or level < num_levels):
+        keep = ~is_top[frontier]
+        source, child = graph.expand(frontier[keep])
+        parent_tops = tops[keep][source]
+        new = ~is_top[child] & ~seen[child]
+        frontier, tops = _unique_pairs(child[new], parent_tops[new], graph.n_nodes)
+        seen[frontier] = True
+        levels.append((frontier, tops))
+        level += 1
+
+    return (
+        np.concatenate([categories for categories, _ in levels]),
+        np.concatenate([ancestors for _, ancestors in levels]),
+        np.concatenate(
+            [
+                np.full(len(categories), i, dtype=np.int16)
+                for i, (categories, _) in enumerate(levels, 1)
+            ],
+        ),
+    )
+
+
+def first_ancestors(
+    categories: np.ndarray,
+    ancestors: np.ndarray,
+    n_nodes: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Drop the repeated (category, top-level id) pairs of frontiers sorted by level, keeping the first."""
+    first = _first_occurrences(categories.astype(np.int64) * n_nodes + ancestors)
+    return categories[first], ancestors[first]
+
+
+def first_ancestor_levels(
+    categories: np.ndarray,
+    ancestors: np.ndarray,
+    levels: np.ndarray,
+    n_nodes: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Like `first_ancestors`, but also keep the level at which each pair was first reached."""
+    first = _first_occurrences(categories.astype(np.int64) * n_nodes + ancestors)
+    return categories[first], ancestors[first], levels[first]
+
+
+def top_level_ancestors(
+    graph: CategoryGraph,
+    top_ids: np.ndarray,
+    num_levels: int | None = 20,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Assign categories to their top-level ancestors with a multi-source BFS.
+
+    See `top_level_frontiers` for how the levels are assigned.
+
+    Args:
+        graph (CategoryGraph): The category graph.
+        top_ids (np.ndarray): The ids of the top-level categories.
+        num_levels (int | None): The maximum depth to assign. Defaults to 20, None means no limit.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: Aligned (category id, top-level id) pairs, without duplicates.
+    """
+    categories, ancestors, _ = top_level_frontiers(
+        graph,
+        top_ids,
+        num_levels=num_levels,
+    )
+    return first_ancestors(categories, ancestors, graph.n_nodes)
+
+
+def changed_categories(
+    graph: CategoryGraph,
+    previous_child_ids: np.ndarray,
+    previous_parent_ids: np.ndarray,
+) -> np.ndarray:
+    """Find the categories with an edge to a parent that was added or removed since the previous edges."""
+    child_ids, parent_ids = graph.edges()
+    n = graph.n_nodes
+    keys = np.unique(child_ids.astype(np.int64) * n + parent_ids)
+    previous_keys = np.unique(
+        previous_child_ids.astype(np.int64) * n + previous_parent_ids,
+    )
+    return np.unique(np.setxor1d(keys, previous_keys, assume_unique=True) // n)
+
+
+def update_top_level_frontiers(
+    graph: CategoryGraph,
+    top_ids: np.ndarray,
+    previous_graph: CategoryGraph,
+    previous: tuple[np.ndarray, np.ndarray, np.ndarray],
+    num_levels: int | None = 20,
+) -> tuple[tuple[np.ndarray, np.ndarray, np.ndarray], int]:
+    """
+    Update the frontiers of `top_level_frontiers` after the category graph changed.
+
+    The frontiers of a category only depend on the edges above it. So only the
+    categories below a changed edge, in the previous or the new graph, are
+    recomputed. Their BFS starts from the levels the other categories kept. A
+    category that became or stopped being top-level has a changed edge to the
+    root, so `previous` must have been computed with the same root and
+    `num_levels`.
+
+    Args:
+        graph (CategoryGraph): The new category graph.
+        top_ids (np.ndarray): The ids of the top-level categories in the new graph.
+        previous_graph (CategoryGraph): The graph `previous` was computed on, with the same ids and number of nodes.
+        previous (tuple[np.ndarray, np.ndarray, np.ndarray]): The (category, top-level id, level) triples of `previous_graph`.
+        num_levels (int | None): The maximum depth to assign. Defaults to 20, None means no limit.
+
+    Returns:
+        tuple[tuple[np.ndarray, np.ndarray, np.ndarray], int]: The triples of the new graph, sorted like those of `top_level_frontiers`, and the number of recomputed categories.
+    """
+    n = graph.n_nodes
+    changed = changed_categories(graph, *previous_graph.edges())
+    affected = np.zeros(n, dtype=bool)
+    affected[graph.descendants(changed)] = True
+    affected[previous_graph.descendants(changed)] = True
+    nodes = np.flatnonzero(affected)
+    is_top = np.zeros(n, dtype=bool)
+    is_top[np.asarray(top_ids, dtype=np.int64)] = True
+
+    categories, ancestors, levels = previous
+    kept = ~affected[categories]
+    kept_categories, kept_ancestors, kept_levels = (
+        categories[kept],
+        ancestors[kept],
+        levels[kept],
+    )
+
+    source, parent = graph.reversed().expand(nodes)
+    child = nodes[source]
+    # Level 1: the edges into top-level categories
+    first = is_top[parent]
+    frontier, tops = _unique_pairs(child[first], parent[first], n)
+    new = [(frontier, tops, 1)]
+    # After level 1, top-level categories are neither expanded nor reached
+    follow = ~is_top[parent] & ~is_top[child]
+    child, parent = child[follow], parent[follow]
+    # The frontiers that the parents of the recomputed categories were kept in
+    known = pd.DataFrame(
+        {"parent": kept_categories, "ancestor": kept_ancestors, "level": kept_levels},
+    )
+    known = known[np.isin(kept_categories, parent)]
+    max_known = int(kept_levels.max()) if len(kept_levels) else 0
+    edges = pd.DataFrame({"child": child, "parent": parent})
+    seen = np.zeros(n, dtype=bool)
+    level = 2
+    while num_levels is None or level <= num_levels:
+        parent_frontier = pd.concat(
+            [
+                known.loc[known["level"] == level - 1, ["parent", "ancestor"]],
+                pd.DataFrame({"parent": frontier, "ancestor": tops}),
+            ],
+        )
+        reached = edges[~seen[edges["child"].to_numpy()]].merge(
+            parent_frontier,
+            on="parent",
+        )
+        frontier, tops = _unique_pairs(
+            reached["child"].to_numpy(),
+            reached["ancestor"].to_numpy(),
+            n,
+        )
+        # Nothing later can be reached once neither side has a frontier left
+        if not len(frontier) and level > max_known:
+            break
+        seen[frontier] = True
+        new.append((frontier, tops, level))
+        level += 1
+
+    categories = np.concatenate(
+        [kept_categories, *(frontier for frontier, _, _ in new)],
+    )
+    ancestors = np.concatenate([kept_ancestors, *(tops for _, tops, _ in new)])
+    levels = np.concatenate(
+        [
+            kept_levels,
+            *(
+                np.full(len(frontier), level, dtype=np.int16)
+                for frontier, _, level in new
+            ),
+        ],
+    )
+    order = np.lexsort((ancestors, categories, levels))
+    return (categories[order], ancestors[order], levels[order]), len(nodes)
@@ -0,0 +1,375 @@
+import argparse
+import contextlib
+import json
+import mmap
+import multiprocessing
+from collections.abc import Generator, Iterable
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from loguru import logger
+from tqdm import tqdm
+
+import src.fileio as fileio
+import src.instrumentation as instrumentation
+from src.config import Config
+from src.parse_articles import extract_stream, read_stream_offsets
+
+# The number of articles per Parquet row group
+BATCH_SIZE = 100_000
+
+
+def article_index_path(prefix: str) -> Path:
+    """The path of the article -> category index, always Parquet as it has a list column."""
+    return fileio.intermediate_path(prefix, "article-index", "parquet")
+
+
+def index_categories_path(prefix: str) -> Path:
+    """The path of the category names that the ids in the article index refer to."""
+    return fileio.intermediate_path(prefix, "article-index-categories", "parquet")
+
+
+def index_texts_path(prefix: str) -> Path:
+    """The path of the cleaned texts of the article index, addressed by its byte offsets."""
+    return fileio.DATA_DIR / f"{prefix}wiki-article-index-texts.txt"
+
+
+def _extract_stream_articles_task(
+    task: tuple[Path, int, int, Config | None],
+) -> list[tuple[str, str, list[str]]]:
+    return [
+        (title, text, categories)
+        for title, text, categories, *_ in extract_stream(*task)
+    ]
+
+
+def iter_stream_articles(
+    file_path: Path,
+    index_path: Path,
+    config: Config | None = None,
+    processes: int = 1,
+) -> Generator[tuple[str, str, list[str]]]:
+    """
+    Streams the cleaned first paragraph and categories of every article in a multistream dump, one bz2 stream at a time.
+
+    Only a few streams are decompressed at once, so memory does not grow with the
+    size of the dump.
+
+    Args:
+        file_path (Path): The path to the multistream XML dump.
+        index_path (Path): The path to the dump's multistream index.
+        config (Config): The language config. Defaults to None.
+        processes (int): The number of worker processes. Defaults to 1 (parse in this process).
+
+    Yields:
+        tuple[str, str, list[str]]: The title, cleaned text and categories of each article.
+    """
+    offsets = read_stream_offsets(index_path)
+    bounds = [*offsets, file_path.stat().st_size]
+    streams = list(zip(bounds, bounds[1:]))
+    tasks = ((file_path, start, end, config) for start, end in streams)
+    with instrumentation.measure(
+        "index_articles",
+        path=file_path.name,
+        processes=processes,
+    ) as metrics, (
+        multiprocessing.Pool(processes) if processes > 1 else contextlib.nullcontext()
+    ) as pool:
+        results = (
+            pool.imap(_extract_stream_articles_task, tasks)
+            if pool is not None
+            else map(_extract_stream_articles_task, tasks)
+        )
+        for articles, (start, end) in tqdm(
+            zip(results, streams),
+            total=len(streams),
+            desc="Indexing streams",
+        ):
+            metrics.add(items=len(articles), nbytes=end - start)
+            yield from articles
+
+
+def write_category_index(
+    articles: Iterable[tuple[str, str, list[str]]],
+    path: Path,
+    names_path: Path,
+    texts_path: Path,
+    metadata: dict[str, object] | None = None,
+    batch_size: int = BATCH_SIZE,
+) -> int:
+    """
+    Write the article -> category index as Parquet, one row group per `batch_size` articles.
+
+    Category names are interned as dense int32 ids in order of first appearance,
+    and the names are written to `names_path`. The texts are concatenated as UTF-8
+    in `texts_path`, and the index holds the byte offset and length of each, so
+    reading a sample's texts only touches those bytes. The files are written under
+    temporary names and renamed when complete.
+
+    Args:
+        articles (Iterable[tuple[str, str, list[str]]]): The title, cleaned text and categories of each article.
+        path (Path): The path of the index.
+        names_path (Path): The path of the category names.
+        texts_path (Path): The path of the texts.
+        metadata (dict[str, object] | None): JSON-serialisable values to keep in the index's schema, e.g. the dump it was built from.
+        batch_size (int): The number of articles per row group. Defaults to 100,000.
+
+    Returns:
+        int: The number of articles written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("title", pa.string()),
+            ("text_offset", pa.int64()),
+            ("text_length", pa.int32()),
+            ("category_ids", pa.list_(pa.int32())),
+        ],
+        metadata={key: json.dumps(value) for key, value in (metadata or {}).items()},
+    )
+    ids: dict[str, int] = {}
+    titles, offsets, lengths, counts, values = [], [], [], [], []
+    n_articles, offset = 0, 0
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_texts_path = texts_path.with_name(texts_path.name + ".tmp")
+
+    def flush(writer: pq.ParquetWriter) -> None:
+        indptr = np.zeros(len(counts) + 1, dtype=np.int32)
+        np.cumsum(counts, out=indptr[1:])
+        writer.write_batch(
+            pa.record_batch(
+                [
+                    pa.array(titles, type=pa.string()),
+                    pa.array(offsets, type=pa.int64()),
+                    pa.array(lengths, type=pa.int32()),
+                    pa.ListArray.from_arrays(
+                        pa.array(indptr),
+                        pa.array(values, type=pa.int32()),
+                    ),
+                ],
+                schema=schema,
+            ),
+        )
+        for column in (titles, offsets, lengths, counts, values):
+            column.clear()
+
+    with pq.ParquetWriter(
+        tmp_path,
+        schema,
+        compression=fileio.PARQUET_COMPRESSION,
+    ) as writer, tmp_texts_path.open("wb") as texts:
+        for title, text, categories in articles:
+            encoded = text.encode("utf-8")
+            texts.write(encoded)
+            titles.append(title)
+            offsets.append(offset)
+            lengths.append(len(encoded))
+            offset += len(encoded)
+            counts.append(len(categories))
+            values.extend(ids.setdefault(category, len(ids)) for category in categories)
+            n_articles += 1
+            if len(titles) >= batch_size:
+                flush(writer)
+        if titles:
+            flush(writer)
+    fileio.write_table(
+        pd.DataFrame(
+            {
+                "id": np.arange(len(ids), dtype=np.int32),
+                "name": pd.Series(list(ids), dtype=object),
+            },
+        ),
+        names_path,
+    )
+    tmp_texts_path.replace(texts_path)
+    tmp_path.replace(path)
+    return n_articles
+
+
+@dataclass
+class CategoryIndex:
+    """
+    The categories of every article in a dump, as CSR arrays of int32 category ids.
+
+    The categories of article `i` are `names[category_ids[indptr[i] : indptr[i + 1]]]`,
+    and its cleaned text is the `text_lengths[i]` bytes at `text_offsets[i]` of the
+    index's texts (see `index_texts_path`).
+    """
+
+    titles: np.ndarray
+    text_offsets: np.ndarray
+    text_lengths: np.ndarray
+    indptr: np.ndarray
+    category_ids: np.ndarray
+    names: np.ndarray
+    metadata: dict
+
+    @classmethod
+    def load(cls: "CategoryIndex", prefix: str) -> "CategoryIndex":
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(article_index_path(prefix), memory_map=True)
+        categories = table.column("category_ids").combine_chunks()
+        offsets = categories.offsets.to_numpy().astype(np.int64)
+        names = fileio.read_table(index_categories_path(prefix)).sort_values("id")
+        return cls(
+            titles=table.column("title").to_numpy(),
+            text_offsets=table.column("text_offset").to_numpy(),
+            text_lengths=table.column("text_length").to_numpy(),
+            indptr=offsets - offsets[0],
+            category_ids=categories.flatten().to_numpy(),
+            names=names["name"].to_numpy(dtype=object),
+            metadata={
+                key.decode(): json.loads(value)
+                for key, value in (table.schema.metadata or {}).items()
+                if not key.startswith(b"ARROW:")
+            },
+        )
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def pairs(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        List every (article, category) pair.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The article positions and category ids of all pairs, in index order.
+        """
+        articles = np.repeat(np.arange(len(self.titles)), np.diff(self.indptr))
+        return articles, self.category_ids
+
+
+class DumpArticles:
+    """
+    Read access to the article texts of a `CategoryIndex`.
+
+    The texts were cleaned when the index was built, and the texts file is
+    memory-mapped, so sampling from the whole dump only reads the bytes of the
+    sampled articles and never touches the XML again.
+    """
+
+    def __init__(self, index: CategoryIndex, texts_path: Path) -> None:
+        self.index = index
+        self.texts_path = texts_path
+        titles = pd.Series(index.titles)
+        # Like the article store, a repeated title keeps its last article
+        unique = ~titles.duplicated(keep="last")
+        self._positions = pd.Index(titles[unique])
+        self._rows = np.flatnonzero(unique)
+        self._file = texts_path.open("rb")
+        # An empty file cannot be memory-mapped
+        self._data = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if texts_path.stat().st_size
+            else b""
+        )
+
+    def __enter__(self) -> "DumpArticles":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def close(self) -> None:
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+        self._file.close()
+
+    def texts(self, titles: Iterable[str]) -> list[str]:
+        """Read the cleaned texts of `titles`. Raises a KeyError for unknown titles."""
+        titles = list(titles)
+        positions = self._positions.get_indexer(titles)
+        if (positions == -1).any():
+            raise KeyError("Some titles are not in the category index")
+        rows = self._rows[positions]
+        return [
+            self._data[offset : offset + length].decode("utf-8")
+            for offset, length in zip(
+                self.index.text_offsets[rows].tolist(),
+                self.index.text_lengths[rows].tolist(),
+            )
+        ]
+
+
+def find_multistream(prefix: str) -> tuple[Path | None, Path | None]:
+    """The latest multistream dump of a language and its index, or None where missing."""
+    return (
+        fileio.find_latest_file(
+            fileio.DATA_DIR,
+            f"{prefix}wiki-*-pages-articles-multistream.xml.bz2",
+        ),
+        fileio.find_latest_file(
+            fileio.DATA_DIR,
+            f"{prefix}wiki-*-pages-articles-multistream-index.txt.bz2",
+        ),
+    )
+
+
+def build_category_index(config: Config, processes: int = 1) -> int:
+    """
+    Index the categories of every article in a language's multistream dump.
+
+    Args:
+        config (Config): The language config.
+        processes (int): The number of worker processes. Defaults to 1.
+
+    Returns:
+        int: The number of articles indexed.
+    """
+    dump_path, index_path = find_multistream(config.prefix)
+    if dump_path is None or index_path is None:
+        raise FileNotFoundError(
+            f"The category index needs the multistream dump and index of {config.prefix} "
+            "(download_wikidump.py --multistream)",
+        )
+    logger.info(f"Indexing the categories of all articles in {dump_path}")
+    return write_category_index(
+        iter_stream_articles(
+            dump_path,
+            index_path,
+            config=config,
+            processes=processes,
+        ),
+        article_index_path(config.prefix),
+        index_categories_path(config.prefix),
+        index_texts_path(config.prefix),
+        metadata={"dump": dump_path.name, "dump_size": dump_path.stat().st_size},
+    )
+
+
+def main(args: argparse.Namespace):
+    assert args.config_path.exists(), f"Config file not found at {args.config_path}"
+    config = Config.from_json(args.config_path)
+    instrumentation.set_language(config.prefix)
+    n_articles = build_category_index(config, processes=args.processes)
+    logger.info(
+        f"Indexed {n_articles} articles to {article_index_path(config.prefix)}",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Index the categories of every article in a multistream Wikimedia dump.",
+    )
+    parser.add_argument(
+        "--config-path",
+        type=Path,
+        default=Path("da-config.json"),
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Parse the bz2 streams with this many processes. Defaults to 1 (serial).",
+    )
+    args = parser.parse_args()
+    main(args)
+    instrumentation.write_report()
@@ -1,50 +1,331 @@
+import argparse
+import contextlib
+import json
+import multiprocessing
+from collections import Counter
+from collections.abc import Iterable, Mapping
+from dataclasses import dataclass, field
+from pathlib import Path
+
 import numpy as np
-import pandas as pd
+from loguru import logger
+from tqdm import tqdm
 
 import src.fileio as fileio
 
+STATS_DIR = fileio.DATA_DIR / ".stats"
+# Bump when the statistics change, so cached results are computed again
+STATS_VERSION = 1
+QUANTILES = (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+
+
+def histogram_quantiles(
+    counts: Mapping[int, int],
+    quantiles: Iterable[float] = QUANTILES,
+) -> list[int]:
+    """
+    Exact quantiles of the values in a histogram.
 
-def calculate_n_samples(df: pd.DataFrame) -> int:
+    Args:
+        counts (Mapping[int, int]): The number of occurrences of every value.
+        quantiles (Iterable[float]): The quantiles, between 0 and 1. Defaults to QUANTILES.
+
+    Returns:
+        list[int]: The smallest value with at least that fraction of the occurrences at or below it, like `np.quantile(..., method="inverted_cdf")`.
+    """
+    values = np.array(sorted(counts), dtype=np.int64)
+    cumulative = np.cumsum([counts[value] for value in values])
+    ranks = np.maximum(np.ceil(np.asarray(list(quantiles)) * cumulative[-1]), 1)
+    return values[np.searchsorted(cumulative, ranks)].tolist()
+
+
+@dataclass
+class DatasetStats:
+    """
+    Exact statistics of the clustering tasks of a dataset.
+
+    Every record is one task: sentences and a label per sentence, and the
+    sentences with the same label form a cluster. The distributions are kept as
+    value -> count histograms, so statistics of separate files merge by adding the
+    counts, and their quantiles stay exact.
+    """
+
+    n_records: int = 0
+    n_samples: int = 0
+    n_characters: int = 0
+    # Records whose number of labels differs from their number of sentences
+    n_mismatched: int = 0
+    # character length -> samples
+    lengths: Counter = field(default_factory=Counter)
+    # label -> samples
+    labels: Counter = field(default_factory=Counter)
+    # number of distinct labels -> records
+    labels_per_record: Counter = field(default_factory=Counter)
+    # samples with one label in one record -> clusters
+    cluster_sizes: Counter = field(default_factory=Counter)
+
+    def add(self, record: dict) -> None:
+        sentences, labels = record["sentences"], record["labels"]
+        lengths = list(map(len, sentences))
+        clusters = Counter(labels)
+        self.n_records += 1
+        self.n_samples += len(sentences)
+        self.n_characters += sum(lengths)
+        self.n_mismatched += len(labels) != len(sentences)
+        self.lengths.update(lengths)
+        self.labels.update(clusters)
+        self.labels_per_record[len(clusters)] += 1
+        self.cluster_sizes.update(clusters.values())
+
+    def merge(self, other: "DatasetStats") -> "DatasetStats":
+        """Add the statistics of `other` to these, in place."""
+        self.n_records += other.n_records
+        self.n_samples += other.n_samples
+        self.n_characters += other.n_characters
+        self.n_mismatched += other.n_mismatched
+        self.lengths.update(other.lengths)
+        self.labels.update(other.labels)
+        self.labels_per_record.update(other.labels_per_record)
+        self.cluster_sizes.update(other.cluster_sizes)
+        return self
+
+    @property
+    def mean_length(self) -> float:
+        """The mean character length of the samples, weighted by sample."""
+        return self.n_characters / self.n_samples
+
+    def length_quantiles(
+        self,
+        quantiles: Iterable[float] = QUANTILES,
+    ) -> dict[float, int]:
+        quantiles = list(quantiles)
+        return dict(zip(quantiles, histogram_quantiles(self.lengths, quantiles)))
+
+    def to_dict(self) -> dict:
+        return {
+            "n_records": self.n_records,
+            "n_samples": self.n_samples,
+            "n_characters": self.n_characters,
+            "n_mismatched": self.n_mismatched,
+            "lengths": dict(self.lengths),
+            "labels": dict(self.labels),
+            "labels_per_record": dict(self.labels_per_record),
+            "cluster_sizes": dict(self.cluster_sizes),
+        }
+
+    @classmethod
+    def from_dict(cls: "DatasetStats", data: dict) -> "DatasetStats":
+        def int_keys(counts: dict) -> Counter:
+            # JSON object keys are strings
+            return Counter({int(value): count for value, count in counts.items()})
+
+        return cls(
+            n_records=data["n_records"],
+            n_samples=data["n_samples"],
+            n_characters=data["n_characters"],
+            n_mismatched=data["n_mismatched"],
+            lengths=int_keys(data["lengths"]),
+            labels=Counter(data["labels"]),
+            labels_per_record=int_keys(data["labels_per_record"]),
+            cluster_sizes=int_keys(data["cluster_sizes"]),
+        )
+
+
+def records_stats(records: Iterable[dict]) -> DatasetStats:
+    """Compute the statistics of dataset records in one pass."""
+    stats = DatasetStats()
+    for record in records:
+        stats.add(record)
+    return stats
+
+
+def file_stats(path: Path) -> DatasetStats:
+    """Compute the statistics of a gzipped JSON Lines dataset in one streaming pass."""
+    return records_stats(fileio.iter_gzipped_jsonl(path))
+
+
+def calculate_n_samples(records: Iterable[dict]) -> int:
     """
     Calculate the number of samples in the dataset.
 
     Args:
-        df (pd.DataFrame): The DataFrame containing the dataset.
+        records (Iterable[dict]): The records of the dataset, e.g. streamed with `fileio.iter_gzipped_jsonl`.
 
     Returns:
         int: The number of samples in the dataset.
     """
-    return sum(len(dat) for dat in df["sentences"])
+    return records_stats(records).n_samples
 
 
-def calculate_avg_character_length(df: pd.DataFrame) -> float:
+def calculate_avg_character_length(records: Iterable[dict]) -> float:
     """
     Calculate the average character length of the articles.
 
     Args:
-        df (pd.DataFrame): The DataFrame containing the dataset.
+        records (Iterable[dict]): The records of the dataset, e.g. streamed with `fileio.iter_gzipped_jsonl`.
 
     Returns:
         float: The average character length of the articles.
     """
-    sentence_lenghts = [
-        len(sentence) for sentences in df["sentences"] for sentence in sentences
-    ]
-    return np.mean(sentence_lenghts)
+    return records_stats(records).mean_length
+
+
+def _prefix_stats(task: tuple[str, Path]) -> tuple[str, DatasetStats]:
+    prefix, path = task
+    return prefix, file_stats(path)
+
+
+def stats_cache_path(prefix: str) -> Path:
+    return STATS_DIR / f"{prefix}.json"
+
+
+def load_cached_stats(prefix: str, digest: str) -> DatasetStats | None:
+    """The cached statistics of a language's dataset, if they were computed from a file with this hash."""
+    path = stats_cache_path(prefix)
+    if not path.exists():
+        return None
+    cached = json.loads(path.read_text())
+    if cached["version"] != STATS_VERSION or cached["digest"] != digest:
+        return None
+    return DatasetStats.from_dict(cached["stats"])
+
+
+def save_cached_stats(prefix: str, digest: str, stats: DatasetStats) -> None:
+    path = stats_cache_path(prefix)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(
+        json.dumps(
+            {"version": STATS_VERSION, "digest": digest, "stats": stats.to_dict()},
+        ),
+    )
+    tmp_path.replace(path)
+
+
+def collect_stats(
+    prefixes: list[str],
+    processes: int | None = None,
+    force: bool = False,
+) -> dict[str, DatasetStats]:
+    """
+    Compute the statistics of the datasets of several languages.
+
+    The statistics are cached by the content hash of each dataset, so only new or
+    regenerated datasets are read. Those are streamed in parallel, one per process.
+
+    Args:
+        prefixes (list[str]): The languages.
+        processes (int | None): The number of worker processes. Defaults to None (one per core).
+        force (bool): Read every dataset, even if its statistics are cached. Defaults to False.
+
+    Returns:
+        dict[str, DatasetStats]: The statistics of every language that has a dataset.
+    """
+    hasher = fileio.FileHasher(STATS_DIR / "hashes.json")
+    results, digests = {}, {}
+    for prefix in prefixes:
+        digest = hasher(fileio.dataset_path(prefix))
+        if digest is None:
+            logger.warning(f"No dataset for {prefix} at {fileio.dataset_path(prefix)}")
+            continue
+        cached = None if force else load_cached_stats(prefix, digest)
+        if cached is not None:
+            results[prefix] = cached
+        else:
+            digests[prefix] = digest
+    STATS_DIR.mkdir(parents=True, exist_ok=True)
+    hasher.save()
+    logger.info(f"{len(results)} cached, {len(digests)} to read")
+
+    tasks = [(prefix, fileio.dataset_path(prefix)) for prefix in digests]
+    processes = min(processes or multiprocessing.cpu_count(), max(len(tasks), 1))
+    with (
+        multiprocessing.Pool(processes) if processes > 1 else contextlib.nullcontext()
+    ) as pool:
+        computed = (
+            pool.imap_unordered(_prefix_stats, tasks)
+            if pool
+            else map(_prefix_stats, tasks)
+        )
+        for prefix, stats in tqdm(computed, total=len(tasks), desc="Datasets"):
+            save_cached_stats(prefix, digests[prefix], stats)
+            results[prefix] = stats
+    return {prefix: results[prefix] for prefix in prefixes if prefix in results}
+
+
+def print_examples(prefixes: Iterable[str]) -> None:
+    """Print the first sentence of every dataset, which only reads its first record."""
+    for prefix in prefixes:
+        record = next(fileio.iter_gzipped_jsonl(fileio.dataset_path(prefix)), None)
+        if record is not None and record["sentences"]:
+            print(f"{prefix}: {record['sentences'][0]}")
+
+
+def print_stats(results: dict[str, DatasetStats]) -> None:
+    print(
+        f"{'':6} {'records':>8} {'samples':>10} {'mean len':>9} {'p1':>6} {'p50':>7} {'p99':>8}"
+        f" {'labels':>7} {'per task':>9} {'cluster p50':>12}",
+    )
+    total = DatasetStats()
+    for prefix, stats in [*results.items(), ("total", total)]:
+        if prefix != "total":
+            total.merge(stats)
+            if stats.n_mismatched:
+                logger.warning(
+                    f"{prefix}: {stats.n_mismatched} records with more or fewer labels than sentences",
+                )
+        if not stats.n_samples:
+            print(f"{prefix:6} {stats.n_records:8,} {0:10,}")
+            continue
+        p1, p50, p99 = histogram_quantiles(stats.lengths, (0.01, 0.5, 0.99))
+        (labels_per_record,) = histogram_quantiles(stats.labels_per_record, (0.5,))
+        (cluster_size,) = histogram_quantiles(stats.cluster_sizes, (0.5,))
+        print(
+            f"{prefix:6} {stats.n_records:8,} {stats.n_samples:10,} {stats.mean_length:9.1f}"
+            f" {p1:6,} {p50:7,} {p99:8,} {len(stats.labels):7,} {labels_per_record:9,} {cluster_size:12,}",
+        )
+
+
+def main(args: argparse.Namespace):
+    prefixes = args.prefixes or fileio.get_all_prefixes()
+    results = collect_stats(prefixes, processes=args.processes, force=args.force)
+    print_examples(results)
+    print_stats(results)
+    if args.output is not None:
+        args.output.write_text(
+            json.dumps(
+                {prefix: stats.to_dict() for prefix, stats in results.items()},
+                indent=1,
+            ),
+        )
 
 
 if __name__ == "__main__":
-    total_samples = 0
-    character_lens = []
-    for prefix in fileio.get_all_prefixes():
-        print(f"Reading {prefix}")
-        df = fileio.read_gzipped_jsonl(prefix)
-        print(df["sentences"][0][0])
-        n_samples = calculate_n_samples(df)
-        total_samples += n_samples
-        print(f"Number of samples: {n_samples}")
-        avg_char_len = calculate_avg_character_length(df)
-        character_lens.append(avg_char_len)
-        print(f"Average character length: {avg_char_len}")
-    print(f"Total number of samples: {total_samples}")
-    print(f"Total average character length: {np.mean(character_lens)}")
+    parser = argparse.ArgumentParser(
+        description="Check the final datasets: sample counts, length distributions, labels and cluster sizes",
+    )
+    parser.add_argument(
+        "--prefixes",
+        nargs="+",
+        default=None,
+        help="The languages to check. Defaults to all configured languages.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="Read this many datasets at once. Defaults to one per core.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Read every dataset again, even if its statistics are cached.",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=None,
+        help="Also write the full statistics of every language as JSON.",
+    )
+    args = parser.parse_args()
+    main(args=args)
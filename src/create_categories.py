@@ -1,116 +1,442 @@
 import argparse
-import gzip
+from collections.abc import Generator, Iterable
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from loguru import logger
 from tqdm import tqdm
 
 import src.fileio as fileio
+import src.instrumentation as instrumentation
+import src.normalize as normalize
+from src.ancestor_index import AncestorIndex, ancestor_index_path
+from src.article_store import ArticleStore
+from src.category_index import CategoryIndex, DumpArticles, index_texts_path
+from src.vocabulary import CategoryVocabulary, vocabulary_path
 
 DATA_DIR = Path("local_data")
+# The number of articles whose categories are joined at a time
+CHUNK_SIZE = 100_000
 
 
-def misinterpret(text: str, false_encoding: str = "latin1") -> str:
-    return text.encode("utf-8").decode(false_encoding)
+def clean_titles(vocab: CategoryVocabulary) -> pd.Series:
+    """Remove the quotes from the vocabulary titles, indexed by id."""
+    return normalize.strip_quotes(pd.Series(vocab.titles, dtype=object))
 
 
-def clean_dawiki_cats(cats: pd.Series) -> pd.Series:
-    return cats.str.replace("|", "").str.strip().apply(misinterpret)
+def save_as_gzipped_jsonl(
+    df: pd.DataFrame,
+    prefix: str,
+    compresslevel: int = fileio.GZIP_COMPRESSLEVEL,
+    threads: int = 1,
+) -> None:
+    """Write the dataset to `local_data/{prefix}/test.jsonl.gz`, encoding and compressing one row at a time."""
+    path = fileio.dataset_path(prefix)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    columns = list(df.columns)
+    records = (
+        dict(zip(columns, row)) for row in zip(*(df[column] for column in columns))
+    )
+    fileio.write_gzipped_jsonl(
+        records,
+        path,
+        compresslevel=compresslevel,
+        threads=threads,
+    )
+
+
+def sample_rows(
+    rng: np.random.Generator,
+    n_rows: int,
+    n_turns: int,
+    n_samples: int,
+    block_elements: int = 2**24,
+) -> np.ndarray:
+    """
+    Draw `n_samples` distinct rows for each of `n_turns` turns in random order.
+
+    Every turn takes the rows with the smallest of a batch of random keys, and the
+    keys are drawn for a block of turns at a time to bound memory.
+
+    Args:
+        rng (np.random.Generator): The random generator.
+        n_rows (int): The number of rows to sample from.
+        n_turns (int): The number of turns.
+        n_samples (int): The number of rows per turn.
+        block_elements (int): The maximum number of random keys drawn at once. Defaults to 2**24.
+
+    Returns:
+        np.ndarray: The (n_turns, n_samples) row positions.
+    """
+    if n_samples > n_rows:
+        raise ValueError(f"Cannot take {n_samples} samples from {n_rows} rows")
+    positions = np.empty((n_turns, n_samples), dtype=np.int64)
+    if n_samples == 0:
+        return positions
+    block = max(1, block_elements // n_rows)
+    for start in range(0, n_turns, block):
+        keys = rng.random((min(block, n_turns - start), n_rows))
+        smallest = np.argpartition(keys, n_samples - 1, axis=1)[:, :n_samples]
+        order = np.argsort(np.take_along_axis(keys, smallest, axis=1), axis=1)
+        positions[start : start + len(keys)] = np.take_along_axis(
+            smallest,
+            order,
+            axis=1,
+        )
+    return positions
+
+
+def stratified_quotas(
+    rng: np.random.Generator,
+    sizes: np.ndarray,
+    n_samples: int,
+) -> np.ndarray:
+    """
+    Split `n_samples` as evenly as possible over labels with `sizes` rows each.
+
+    Labels with fewer rows than their even share give all their rows, and the rest
+    is split evenly over the larger labels. What does not divide evenly goes to
+    randomly chosen larger labels, one sample each.
+
+    Args:
+        rng (np.random.Generator): The random generator.
+        sizes (np.ndarray): The number of rows of every label.
+        n_samples (int): The total number of samples.
+
+    Returns:
+        np.ndarray: The number of samples to take from every label.
+    """
+    if n_samples > sizes.sum():
+        raise ValueError(f"Cannot take {n_samples} samples from {sizes.sum()} rows")
+    # The largest even share that the labels can give, with the small labels capped
+    sorted_sizes = np.sort(sizes)
+    below = np.concatenate([[0], np.cumsum(sorted_sizes)[:-1]])
+    n_above = len(sizes) - np.arange(len(sizes))
+    capped = np.flatnonzero(below + sorted_sizes * n_above >= n_samples)
+    if len(capped):
+        first = capped[0]
+        share = (n_samples - below[first]) // n_above[first]
+    else:
+        share = 0
+    quotas = np.minimum(sizes, share)
+    larger = np.flatnonzero(sizes > share)
+    quotas[rng.choice(larger, n_samples - quotas.sum(), replace=False)] += 1
+    return quotas
+
+
+class ArticleSampler:
+    """
+    Draws batches of (article, label) samples from the article/category pairs.
 
+    Titles and labels are held as aligned code arrays, numbered in order of first
+    appearance, and every turn is drawn in a single batch from a seeded generator.
+    """
 
-def clean_parents(df: pd.DataFrame) -> pd.DataFrame:
-    """Remove the quotes from the parent and child columns."""
-    dfcopy = df.copy()
-    dfcopy["parent"] = dfcopy["parent"].str.replace("'", "")
-    dfcopy["child"] = dfcopy["child"].str.replace("'", "")
-    return dfcopy
+    def __init__(
+        self,
+        title_codes: np.ndarray,
+        titles: np.ndarray,
+        label_codes: np.ndarray,
+        labels: np.ndarray,
+        seed: int | None = None,
+    ) -> None:
+        self.title_codes, self.titles = title_codes, titles
+        self.label_codes, self.labels = label_codes, labels
+        self.rng = np.random.default_rng(seed)
 
+    @classmethod
+    def from_frame(
+        cls: "ArticleSampler",
+        clean_cats: pd.DataFrame,
+        seed: int | None = None,
+    ) -> "ArticleSampler":
+        """Sample from the pairs of a DataFrame with `title` and `category` columns."""
+        title_codes, titles = pd.factorize(clean_cats["title"])
+        label_codes, labels = pd.factorize(clean_cats["category"])
+        return cls(title_codes, titles, label_codes, labels, seed=seed)
 
-def save_as_gzipped_jsonl(df: pd.DataFrame, prefix: str):
-    # Create a subfolder in local_data with the name {prefix}
-    path = DATA_DIR / prefix
-    path.mkdir(parents=True, exist_ok=True)
+    @classmethod
+    def from_pairs(
+        cls: "ArticleSampler",
+        article_titles: np.ndarray,
+        articles: np.ndarray,
+        label_names: np.ndarray,
+        label_ids: np.ndarray,
+        seed: int | None = None,
+    ) -> "ArticleSampler":
+        """
+        Sample from (article, label) pairs given as positions, without a string per pair.
 
-    # Save DataFrame as JSON Lines
-    df.to_json(path / "test.jsonl", orient="records", lines=True)
+        The codes are the same as `from_frame` gives for the pairs' titles and
+        label names, but the strings are factorized once per article or label, and
+        the pairs only as int codes.
 
-    # Gzip the JSON Lines file
-    with (path / "test.jsonl").open("rb") as f_in, gzip.open(
-        path / "test.jsonl.gz",
-        "wb",
-    ) as f_out:
-        f_out.writelines(f_in)
+        Args:
+            article_titles (np.ndarray): The title of every article position.
+            articles (np.ndarray): The article position of every pair.
+            label_names (np.ndarray): The name of every label id.
+            label_ids (np.ndarray): The label id of every pair.
+            seed (int | None): The seed of the generator. Defaults to None.
 
-    # Remove the original JSON Lines file
-    (path / "test.jsonl").unlink()
+        Returns:
+            ArticleSampler: The sampler.
+        """
+
+        def factorize_through(
+            names: np.ndarray,
+            ids: np.ndarray,
+        ) -> tuple[np.ndarray, np.ndarray]:
+            name_codes, unique_names = pd.factorize(names)
+            codes, uniques = pd.factorize(name_codes[ids])
+            return codes, np.asarray(unique_names, dtype=object)[uniques]
+
+        title_codes, titles = factorize_through(article_titles, articles)
+        label_codes, labels = factorize_through(label_names, label_ids)
+        return cls(title_codes, titles, label_codes, labels, seed=seed)
+
+    def sample(
+        self,
+        n_turns: int,
+        n_articles: int,
+        stratify: bool = False,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Draw `n_articles` distinct pairs for each of `n_turns` turns.
+
+        Args:
+            n_turns (int): The number of turns.
+            n_articles (int): The number of pairs per turn.
+            stratify (bool): Draw (almost) the same number of pairs from every label, see `stratified_quotas`. Defaults to False.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: The (n_turns, n_articles) title and label codes.
+        """
+        if stratify:
+            rows = self._stratified_rows(n_turns, n_articles)
+        else:
+            rows = sample_rows(self.rng, len(self.title_codes), n_turns, n_articles)
+        return self.title_codes[rows], self.label_codes[rows]
+
+    def _stratified_rows(self, n_turns: int, n_articles: int) -> np.ndarray:
+        n_labels = len(self.labels)
+        rows_by_label = np.argsort(self.label_codes, kind="stable")
+        bounds = np.searchsorted(
+            self.label_codes[rows_by_label],
+            np.arange(n_labels + 1),
+        )
+        quotas = stratified_quotas(self.rng, np.diff(bounds), n_articles)
+        rows = np.hstack(
+            [
+                rows_by_label[bounds[label] : bounds[label + 1]][
+                    sample_rows(
+                        self.rng,
+                        bounds[label + 1] - bounds[label],
+                        n_turns,
+                        quotas[label],
+                    )
+                ]
+                for label in range(n_labels)
+            ],
+        )
+        shuffle = np.argsort(self.rng.random(rows.shape), axis=1)
+        return np.take_along_axis(rows, shuffle, axis=1)
 
 
 def generate_samples(
-    dawiki: dict[str, tuple[str, list]],
-    clean_cats: pd.DataFrame,
+    dawiki: ArticleStore | DumpArticles,
+    sampler: ArticleSampler,
     n_turns: int = 30,
     n_articles: int = 5000,
+    stratify: bool = False,
 ) -> pd.DataFrame:
-    all_sentences = []
-    all_labels = []
-    for _ in tqdm(range(n_turns)):
-        sampled_articles = clean_cats.sample(n=n_articles, replace=False)
-        texts = [dawiki[title][0] for title in sampled_articles["title"]]
-        categories = sampled_articles["category"].tolist()
-        all_sentences.append(texts)
-        all_labels.append(categories)
-    sample_df = pd.DataFrame({"sentences": all_sentences, "labels": all_labels})
+    with instrumentation.measure("generate_samples", stratify=stratify) as metrics:
+        title_codes, label_codes = sampler.sample(
+            n_turns,
+            n_articles,
+            stratify=stratify,
+        )
+        # Only read the texts of the sampled titles, once each
+        sampled, inverse = np.unique(title_codes, return_inverse=True)
+        texts = np.array(dawiki.texts(sampler.titles[sampled]), dtype=object)
+        sample_df = pd.DataFrame(
+            {
+                "sentences": texts[inverse.reshape(title_codes.shape)].tolist(),
+                "labels": np.asarray(sampler.labels, dtype=object)[
+                    label_codes
+                ].tolist(),
+            },
+        )
+        metrics.add(items=title_codes.size, nbytes=sum(map(len, texts)))
     assert (
         sample_df.shape[0] == n_turns
     ), f"Expected {n_turns} but got {sample_df.shape[0]}"
     return sample_df
 
 
-def get_categories(dawiki: dict[str, tuple[str, list]]) -> pd.DataFrame:
-    catdf = (
-        pd.DataFrame.from_dict(dawiki, orient="index", columns=["text", "categories"])
-        .reset_index()[["index", "categories"]]
-        .explode("categories")
-        .dropna()
-    )
-    catdf["categories"] = clean_dawiki_cats(catdf["categories"])
-    return catdf
+def iter_categories(
+    dawiki: ArticleStore,
+    lookup: normalize.CategoryLookup,
+    chunk_size: int = CHUNK_SIZE,
+) -> Generator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Stream the (article, category id) pairs of an article store, `chunk_size` articles at a time.
 
+    The store's categories are interned in its `ArticleTable`, so each distinct
+    name is mapped to a vocabulary id once.
 
-# filter to have value counts of 1 or 2
-def filter_cats(clean_cats: pd.DataFrame, max_cats: int = 1) -> pd.DataFrame:
-    value_counts = clean_cats["title"].value_counts()
-    return clean_cats[
-        clean_cats["title"].isin(value_counts[value_counts == max_cats].index)
-    ]
+    Args:
+        dawiki (ArticleStore): The article store.
+        lookup (normalize.CategoryLookup): The vocabulary ids of category links.
+        chunk_size (int): The number of articles per chunk. Defaults to 100,000.
 
+    Yields:
+        tuple[np.ndarray, np.ndarray]: The article positions and category ids of the pairs with a known category.
+    """
+    table = dawiki.articles
+    name_ids = lookup(pd.Series(table.names, dtype=object))
+    for start in range(0, len(table), chunk_size):
+        end = min(start + chunk_size, len(table))
+        indptr = table.indptr[start : end + 1]
+        articles = np.repeat(np.arange(start, end, dtype=np.int32), np.diff(indptr))
+        child_ids = name_ids[table.category_ids[indptr[0] : indptr[-1]]]
+        known = child_ids >= 0
+        yield articles[known], child_ids[known]
 
-def create_dataset(prefix: str, n_articles: int = 5000, n_turns: int = 30):
-    parents = clean_parents(pd.read_csv(f"local_data/{prefix}wiki-all-parents.csv"))
-    wiki = fileio.read_json(
-        fileio.find_latest_file(Path("local_data"), f"{prefix}wiki-sample-*.json"),
-    )
-    catdf = get_categories(wiki)
-    clean_cats = catdf.merge(parents, left_on="categories", right_on="child")[
-        ["index", "parent"]
-    ].rename(columns={"index": "title", "parent": "category"})
-    sample_df = generate_samples(
-        wiki,
-        clean_cats,
-        n_turns=n_turns,
-        n_articles=n_articles,
-    )
 
-    save_as_gzipped_jsonl(sample_df, prefix)
+def iter_index_categories(
+    index: CategoryIndex,
+    lookup: normalize.CategoryLookup,
+    chunk_size: int = CHUNK_SIZE,
+) -> Generator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Stream the (article, category id) pairs of a category index, `chunk_size` articles at a time.
+
+    The index already interns the category names, so they are mapped to vocabulary
+    ids once and the pairs are translated through the int32 index ids.
+
+    Args:
+        index (CategoryIndex): The category index.
+        lookup (normalize.CategoryLookup): The vocabulary ids of category links.
+        chunk_size (int): The number of articles per chunk. Defaults to 100,000.
+
+    Yields:
+        tuple[np.ndarray, np.ndarray]: The article positions and category ids of the pairs with a known category.
+    """
+    name_ids = lookup(pd.Series(index.names, dtype=object))
+    for start in range(0, len(index), chunk_size):
+        end = min(start + chunk_size, len(index))
+        indptr = index.indptr[start : end + 1]
+        articles = np.repeat(np.arange(start, end, dtype=np.int32), np.diff(indptr))
+        child_ids = name_ids[index.category_ids[indptr[0] : indptr[-1]]]
+        known = child_ids >= 0
+        yield articles[known], child_ids[known]
+
+
+def join_parents(
+    pairs: Iterable[tuple[np.ndarray, np.ndarray]],
+    ancestors: AncestorIndex,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Join (article, category id) chunks with the top-level parents of the categories.
+
+    The parents of every category are a slice of the ancestor index, so every
+    chunk is joined by indexing instead of a merge. Only the joined pairs are
+    kept, as two int32 arrays (8 bytes per pair), while the per-chunk
+    intermediates are bounded by the chunk size. The pairs keep their order, and
+    the parents of a category are ordered by depth.
+
+    Args:
+        pairs (Iterable[tuple[np.ndarray, np.ndarray]]): The article positions and category ids, in chunks.
+        ancestors (AncestorIndex): The ancestor index of the vocabulary.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: The article position and parent id of every joined pair.
+    """
+    articles, parent_ids = [], []
+    for chunk_articles, child_ids in pairs:
+        source, parent = ancestors.lookup(child_ids)
+        articles.append(chunk_articles[source])
+        parent_ids.append(parent.astype(np.int32))
+    if not articles:
+        return np.array([], dtype=np.int32), np.array([], dtype=np.int32)
+    return np.concatenate(articles), np.concatenate(parent_ids)
+
+
+def create_dataset(
+    prefix: str,
+    n_articles: int = 5000,
+    n_turns: int = 30,
+    fmt: str = "parquet",
+    seed: int | None = None,
+    stratify: bool = False,
+    articles_path: Path | None = None,
+    full_index: bool = False,
+    compresslevel: int = fileio.GZIP_COMPRESSLEVEL,
+    compress_threads: int = 1,
+):
+    vocab = CategoryVocabulary.load(vocabulary_path(prefix, fmt))
+    titles = clean_titles(vocab)
+    ancestors = AncestorIndex.load(ancestor_index_path(prefix), vocab.titles)
+    lookup = normalize.CategoryLookup(titles)
+    if full_index:
+        # Sample from every article in the dump instead of the parsed prefix
+        index = CategoryIndex.load(prefix)
+        wiki = DumpArticles(index, index_texts_path(prefix))
+        article_titles = index.titles
+        pairs = iter_index_categories(index, lookup)
+    else:
+        wiki = ArticleStore(
+            articles_path
+            or fileio.find_latest_file(
+                fileio.DATA_DIR,
+                f"{prefix}wiki-sample-*.jsonl",
+            ),
+        )
+        article_titles = wiki.articles.titles.to_numpy(zero_copy_only=False)
+        pairs = iter_categories(wiki, lookup)
+    with wiki:
+        articles, parent_ids = join_parents(pairs, ancestors)
+        sampler = ArticleSampler.from_pairs(
+            article_titles,
+            articles,
+            titles.to_numpy(),
+            parent_ids,
+            seed=seed,
+        )
+        sample_df = generate_samples(
+            wiki,
+            sampler,
+            n_turns=n_turns,
+            n_articles=n_articles,
+            stratify=stratify,
+        )
+
+    save_as_gzipped_jsonl(
+        sample_df,
+        prefix,
+        compresslevel=compresslevel,
+        threads=compress_threads,
+    )
 
 
 def main(args: argparse.Namespace):
     for prefix in tqdm(args.prefixes, desc="Languages"):
-        if args.skip_if_exists and (DATA_DIR / prefix / "test.jsonl.gz").exists():
+        instrumentation.set_language(prefix)
+        if args.skip_if_exists and fileio.dataset_path(prefix).exists():
             logger.info(f"Skipping {prefix} as it already exists")
             continue
-        create_dataset(prefix, n_articles=args.n_articles, n_turns=args.n_turns)
+        create_dataset(
+            prefix,
+            n_articles=args.n_articles,
+            n_turns=args.n_turns,
+            fmt=args.intermediate_format,
+            seed=args.seed,
+            stratify=args.stratify,
+            full_index=args.full_index,
+            compresslevel=args.compresslevel,
+            compress_threads=args.compress_threads,
+        )
 
 
 if __name__ == "__main__":
@@ -136,5 +462,39 @@ if __name__ == "__main__":
         "--skip-if-exists",
         action="store_true",
     )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="The seed for sampling articles. Defaults to 0.",
+    )
+    parser.add_argument(
+        "--stratify",
+        action="store_true",
+        help="Sample the same number of articles from every category.",
+    )
+    parser.add_argument(
+        "--full-index",
+        action="store_true",
+        help="Sample from all articles in the category index (category_index.py) instead of the parsed sample.",
+    )
+    parser.add_argument(
+        "--compresslevel",
+        type=int,
+        default=fileio.GZIP_COMPRESSLEVEL,
+        help="The gzip compression level of the dataset, 1-9. Defaults to 6.",
+    )
+    parser.add_argument(
+        "--compress-threads",
+        type=int,
+        default=1,
+        help="Compress the dataset with this many threads. Defaults to 1.",
+    )
+    parser.add_argument(
+        "--intermediate-format",
+        choices=fileio.INTERMEDIATE_FORMATS,
+        default="parquet",
+    )
     args = parser.parse_args()
     main(args=args)
+    instrumentation.write_report()
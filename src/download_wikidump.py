@@ -1,3 +1,7 @@
+import argparse
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import requests
@@ -5,6 +9,7 @@ from loguru import logger
 from tqdm import tqdm
 
 import src.fileio as fileio
+import src.instrumentation as instrumentation
 
 DOWNLOAD_URL = "https://dumps.wikimedia.org/{prefix}wiki/latest/"
 SAVE_DIR = Path("local_data")
@@ -13,47 +18,302 @@ DOWNLOAD_PATTERNS = [
     "{prefix}wiki-latest-page.sql.gz",
     "{prefix}wiki-latest-pages-articles.xml.bz2",
 ]
+# Only needed for parsing articles in parallel (parse_articles.py --processes)
+MULTISTREAM_PATTERNS = [
+    "{prefix}wiki-latest-pages-articles-multistream.xml.bz2",
+    "{prefix}wiki-latest-pages-articles-multistream-index.txt.bz2",
+]
+# The published checksums list the dated file names, e.g. dawiki-20240401-page.sql.gz
+CHECKSUM_PATTERN = "{prefix}wiki-latest-{algorithm}sums.txt"
+CHUNK_SIZE = 1 << 20
+TIMEOUT = 60
+
 
+def fetch_checksums(prefix: str, algorithm: str = "md5") -> dict[str, str]:
+    """
+    Fetch the published checksums of a language's dump files.
 
-def download_file(url: str, path: Path) -> None:
+    Args:
+        prefix (str): The language prefix.
+        algorithm (str): "md5" or "sha1". Defaults to "md5".
+
+    Returns:
+        dict[str, str]: The checksums keyed by the `latest` file names, empty if they are unavailable.
+    """
+    url = DOWNLOAD_URL.format(prefix=prefix) + CHECKSUM_PATTERN.format(
+        prefix=prefix,
+        algorithm=algorithm,
+    )
     try:
-        with requests.get(url, stream=True) as response:
-            response.raise_for_status()
-            total_size = int(response.headers.get("content-length", 0))
-            with path.open("wb") as file, tqdm(
-                total=total_size,
-                unit="B",
-                unit_scale=True,
-                desc=f"Downloading {path.name}",
-            ) as progress:
-                for chunk in response.iter_content(chunk_size=32768):
-                    progress.update(len(chunk))
-                    file.write(chunk)
-    except Exception as e:
-        logger.error(f"Failed to download {url}: {e}")
-        raise
-    finally:
-        if not path.is_file() or path.stat().st_size != total_size:
-            logger.error(f"Downloaded file {path.name} is incomplete. Deleting.")
-            path.unlink(missing_ok=True)
-
-
-def download_wikidump(prefix: str) -> None:
-    for pattern in DOWNLOAD_PATTERNS:
-        logger.info(f"Downloading {pattern.format(prefix=prefix)}")
-        path = SAVE_DIR / pattern.format(prefix=prefix)
-        if path.exists():
-            logger.info(f"File {path.name} already exists. Skipping download.")
+        response = requests.get(url, timeout=TIMEOUT)
+        response.raise_for_status()
+    except requests.RequestException as e:
+        logger.warning(f"Could not fetch checksums from {url}: {e}")
+        return {}
+    checksums = {}
+    for line in response.text.splitlines():
+        if not line.strip():
             continue
-        url = DOWNLOAD_URL.format(prefix=prefix) + pattern.format(prefix=prefix)
-        download_file(url, path)
-        logger.info(f"Downloaded {path.name}")
+        checksum, name = line.split()
+        checksums[re.sub(r"-\d{8}-", "-latest-", name, count=1)] = checksum
+    return checksums
+
+
+def get_remote_size(url: str) -> tuple[int, bool]:
+    """Return the size of a remote file and whether the server accepts byte ranges."""
+    response = requests.head(url, allow_redirects=True, timeout=TIMEOUT)
+    response.raise_for_status()
+    size = int(response.headers.get("content-length", 0))
+    return size, response.headers.get("accept-ranges", "").lower() == "bytes"
+
+
+def download_range(
+    url: str,
+    part_path: Path,
+    start: int,
+    end: int | None,
+    progress: tqdm,
+    retries: int = 5,
+) -> None:
+    """
+    Download the bytes `start`..`end` (inclusive) of `url` into `part_path`.
+
+    Bytes already in `part_path` are kept and the request resumes after them, also
+    when retrying after a dropped connection. With `end=None` the whole file is
+    downloaded in one stream without resuming.
+
+    Args:
+        url (str): The URL to download.
+        part_path (Path): The file the range is written to.
+        start (int): The first byte of the range.
+        end (int | None): The last byte of the range, or None to download the whole file.
+        progress (tqdm): The progress bar to update.
+        retries (int): The number of attempts. Defaults to 5.
+    """
+    for attempt in range(1, retries + 1):
+        have = part_path.stat().st_size if part_path.exists() and end is not None else 0
+        if end is not None and start + have > end:
+            return
+        headers = {} if end is None else {"Range": f"bytes={start + have}-{end}"}
+        try:
+            with requests.get(
+                url,
+                headers=headers,
+                stream=True,
+                timeout=TIMEOUT,
+            ) as response:
+                response.raise_for_status()
+                if end is not None and response.status_code != 206:
+                    raise requests.HTTPError(
+                        f"Range request got {response.status_code}",
+                    )
+                with part_path.open("ab" if end is not None else "wb") as file:
+                    for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                        file.write(chunk)
+                        progress.update(len(chunk))
+            if end is None or part_path.stat().st_size == end - start + 1:
+                return
+        except requests.RequestException as e:
+            if attempt == retries:
+                raise
+            logger.warning(f"Retrying {part_path.name} ({attempt}/{retries}): {e}")
+    raise OSError(f"Could not complete {part_path.name} after {retries} attempts")
+
+
+def download_file(
+    url: str,
+    path: Path,
+    n_parts: int = 4,
+    checksum: str | None = None,
+    algorithm: str = "md5",
+) -> None:
+    """
+    Download a file as `n_parts` byte ranges in parallel, resuming earlier partial downloads.
+
+    The ranges are kept as `.part` files until all of them are complete. They are
+    then joined into `path` while the checksum is computed. On a checksum mismatch
+    the download is deleted and an error is raised.
+
+    Args:
+        url (str): The URL to download.
+        path (Path): The destination path.
+        n_parts (int): The number of ranges to download at once. Defaults to 4.
+        checksum (str | None): The expected hex digest. Defaults to None (not verified).
+        algorithm (str): The hash algorithm of `checksum`. Defaults to "md5".
+    """
+    size, accepts_ranges = get_remote_size(url)
+    if accepts_ranges and size:
+        part_size = -(-size // n_parts)
+        ranges = [
+            (start, min(start + part_size, size) - 1)
+            for start in range(0, size, part_size)
+        ]
+    else:
+        ranges = [(0, None)]
+    # The size is part of the name, so parts of an older dump are never resumed
+    part_paths = [
+        path.with_name(f"{path.name}.{size}.part{i}of{len(ranges)}")
+        for i in range(len(ranges))
+    ]
+    done = (
+        sum(p.stat().st_size for p in part_paths if p.exists()) if accepts_ranges else 0
+    )
+    with instrumentation.measure(
+        "download",
+        path=path.name,
+        n_parts=len(ranges),
+    ) as metrics, tqdm(
+        total=size,
+        initial=done,
+        unit="B",
+        unit_scale=True,
+        desc=f"Downloading {path.name}",
+    ) as progress, ThreadPoolExecutor(len(ranges)) as pool:
+        futures = [
+            pool.submit(download_range, url, part_path, start, end, progress)
+            for part_path, (start, end) in zip(part_paths, ranges)
+        ]
+        for future in futures:
+            future.result()
+        # Only the bytes downloaded now, not those resumed from earlier runs
+        metrics.add(items=1, nbytes=progress.n - done)
+
+    digest = hashlib.new(algorithm)
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as file:
+        for part_path in part_paths:
+            with part_path.open("rb") as part:
+                while chunk := part.read(CHUNK_SIZE):
+                    digest.update(chunk)
+                    file.write(chunk)
+    for part_path in part_paths:
+        part_path.unlink()
+    if checksum is not None and digest.hexdigest() != checksum:
+        tmp_path.unlink()
+        raise ValueError(
+            f"{algorithm} mismatch for {path.name}: expected {checksum}, got {digest.hexdigest()}",
+        )
+    tmp_path.replace(path)
+
+
+def wikidump_files(prefix: str, multistream: bool = False) -> list[str]:
+    patterns = DOWNLOAD_PATTERNS + (MULTISTREAM_PATTERNS if multistream else [])
+    return [pattern.format(prefix=prefix) for pattern in patterns]
+
+
+def download_dump_file(
+    prefix: str,
+    name: str,
+    checksum: str | None,
+    n_parts: int = 4,
+    algorithm: str = "md5",
+) -> None:
+    instrumentation.set_language(prefix)
+    path = SAVE_DIR / name
+    if path.exists():
+        logger.info(f"File {path.name} already exists. Skipping download.")
+        return
+    if checksum is None:
+        logger.warning(f"No published {algorithm} checksum for {name}")
+    logger.info(f"Downloading {name}")
+    url = DOWNLOAD_URL.format(prefix=prefix) + name
+    download_file(url, path, n_parts=n_parts, checksum=checksum, algorithm=algorithm)
+    logger.info(f"Downloaded {path.name}")
+
+
+def download_wikidumps(
+    prefixes: list[str],
+    multistream: bool = False,
+    n_parts: int = 4,
+    max_files: int = 3,
+    algorithm: str = "md5",
+) -> None:
+    """
+    Download the dump files of several languages, `max_files` files at a time.
+
+    Failed files keep their `.part` files, so running again resumes them.
+
+    Args:
+        prefixes (list[str]): The language prefixes.
+        multistream (bool): Also download the multistream dump and index. Defaults to False.
+        n_parts (int): The number of ranges to download at once per file. Defaults to 4.
+        max_files (int): The number of files to download at once. Defaults to 3.
+        algorithm (str): The published checksums to verify against. Defaults to "md5".
+    """
+    checksums = {
+        prefix: fetch_checksums(prefix, algorithm=algorithm) for prefix in prefixes
+    }
+    with ThreadPoolExecutor(max_files) as pool:
+        futures = {
+            name: pool.submit(
+                download_dump_file,
+                prefix,
+                name,
+                checksums[prefix].get(name),
+                n_parts=n_parts,
+                algorithm=algorithm,
+            )
+            for prefix in prefixes
+            for name in wikidump_files(prefix, multistream=multistream)
+        }
+        failed = []
+        for name, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Failed to download {name}: {e}")
+                failed.append(name)
+    if failed:
+        raise RuntimeError(f"Failed to download {', '.join(failed)}")
+
+
+def download_wikidump(prefix: str, multistream: bool = False) -> None:
+    download_wikidumps([prefix], multistream=multistream)
 
 
-def main() -> None:
-    for prefix in tqdm(fileio.get_all_prefixes(), desc="Downloading dumps"):
-        download_wikidump(prefix)
+def main(args: argparse.Namespace) -> None:
+    download_wikidumps(
+        args.prefixes or fileio.get_all_prefixes(),
+        multistream=args.multistream,
+        n_parts=args.n_parts,
+        max_files=args.max_files,
+        algorithm=args.checksum,
+    )
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Download the wikipedia dumps for all configured languages",
+    )
+    parser.add_argument(
+        "--prefixes",
+        nargs="+",
+        default=None,
+        help="The languages to download. Defaults to all configured languages.",
+    )
+    parser.add_argument(
+        "--multistream",
+        action="store_true",
+        help="Also download the multistream articles dump and its index.",
+    )
+    parser.add_argument(
+        "--n-parts",
+        type=int,
+        default=4,
+        help="The number of byte ranges to download in parallel per file. Defaults to 4.",
+    )
+    parser.add_argument(
+        "--max-files",
+        type=int,
+        default=3,
+        help="The number of files to download at once, across languages. Defaults to 3.",
+    )
+    parser.add_argument(
+        "--checksum",
+        choices=["md5", "sha1"],
+        default="md5",
+        help="The published checksums to verify downloads against. Defaults to md5.",
+    )
+    args = parser.parse_args()
+    main(args=args)
+    instrumentation.write_report()
@@ -1,21 +1,141 @@
+import collections
+import contextlib
 import gzip
+import hashlib
 import json
+import threading
+import zlib
+from collections.abc import Generator, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import BinaryIO
 
+import numpy as np
 import pandas as pd
 
 CONFIG_DIR = Path("language_configs")
+DATA_DIR = Path("local_data")
+INTERMEDIATE_FORMATS = ["parquet", "csv"]
+PARQUET_COMPRESSION = "zstd"
+GZIP_COMPRESSLEVEL = 6
+# The uncompressed bytes compressed at a time, as one gzip member when threaded
+GZIP_BLOCK_SIZE = 1 << 22
+GZIP_WBITS = 31
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def dataset_path(prefix: str) -> Path:
+    """The path of a language's final dataset, e.g. `local_data/da/test.jsonl.gz`."""
+    return DATA_DIR / prefix / "test.jsonl.gz"
 
 
 def read_gzipped_jsonl(prefix: str) -> pd.DataFrame:
-    # Define the path to the gzipped JSON Lines file
-    path = Path("local_data") / prefix / "test.jsonl.gz"
+    """Read a language's final dataset into a DataFrame. Use `iter_gzipped_jsonl` to stream it instead."""
+    return pd.DataFrame(list(iter_gzipped_jsonl(dataset_path(prefix))))
+
+
+@contextlib.contextmanager
+def replace_when_done(path: Path) -> Generator[Path]:
+    """
+    Yield a temporary path to write `path` to, and rename it to `path` on success.
+
+    If the write fails, the temporary file is removed, so an interrupted write
+    leaves neither a partial file that looks finished nor a stray `.tmp` file.
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    try:
+        yield tmp_path
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    tmp_path.replace(path)
+
+
+def iter_gzipped_jsonl(path: Path) -> Generator[dict]:
+    """Stream the records of a gzipped JSON Lines file, one line at a time."""
+    with gzip.open(path, "rb") as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _compress_member(block: bytes, compresslevel: int) -> bytes:
+    # A complete gzip member (with mtime 0); zlib releases the GIL while compressing
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(block) + compressor.flush()
+
+
+def _encoded_blocks(records: Iterable[dict], block_size: int) -> Generator[bytes]:
+    lines, size = [], 0
+    for record in records:
+        line = json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+        lines.append(line)
+        size += len(line)
+        if size >= block_size:
+            yield b"".join(lines)
+            lines, size = [], 0
+    if lines:
+        yield b"".join(lines)
+
 
-    # Open the gzipped JSON Lines file and read it into a DataFrame
-    with gzip.open(path, "rb") as f:
-        df = pd.read_json(f, lines=True)
+def write_gzipped_jsonl(
+    records: Iterable[dict],
+    path: Path,
+    compresslevel: int = GZIP_COMPRESSLEVEL,
+    threads: int = 1,
+    block_size: int = GZIP_BLOCK_SIZE,
+) -> int:
+    """
+    Encode records as JSON Lines straight into a gzip file, without an uncompressed copy.
 
-    return df
+    With `threads > 1`, blocks of `block_size` bytes are compressed concurrently as
+    separate gzip members, which any gzip reader reads back as one stream. The file
+    is written under a temporary name and renamed when complete (see
+    `replace_when_done`), and the output does not depend on the time it was written.
+
+    Args:
+        records (Iterable[dict]): The JSON-serialisable records.
+        path (Path): The output path.
+        compresslevel (int): The gzip compression level, 1 (fastest) to 9 (smallest). Defaults to 6.
+        threads (int): The number of compression threads. Defaults to 1.
+        block_size (int): The uncompressed bytes per block. Defaults to 4 MiB.
+
+    Returns:
+        int: The number of records written.
+    """
+    n_records = 0
+
+    def counted(records: Iterable[dict]) -> Generator[dict]:
+        nonlocal n_records
+        for record in records:
+            n_records += 1
+            yield record
+
+    blocks = _encoded_blocks(counted(records), block_size)
+    with replace_when_done(path) as tmp_path, tmp_path.open("wb") as file:
+        if threads > 1:
+            with ThreadPoolExecutor(threads) as executor:
+                pending = collections.deque()
+                for block in blocks:
+                    pending.append(
+                        executor.submit(_compress_member, block, compresslevel),
+                    )
+                    # Only hold a few blocks in memory
+                    if len(pending) >= 2 * threads:
+                        file.write(pending.popleft().result())
+                while pending:
+                    file.write(pending.popleft().result())
+        else:
+            with gzip.GzipFile(
+                filename="",
+                mode="wb",
+                compresslevel=compresslevel,
+                fileobj=file,
+                mtime=0,
+            ) as gz:
+                for block in blocks:
+                    gz.write(block)
+    return n_records
 
 
 def read_json(path: Path | str) -> dict:
@@ -39,3 +159,204 @@ def get_prefix(file: Path) -> str:
 
 def get_all_prefixes() -> list[str]:
     return [get_prefix(conffile) for conffile in CONFIG_DIR.glob("*.json")]
+
+
+def intermediate_path(prefix: str, name: str, fmt: str = "parquet") -> Path:
+    """The path of a pipeline intermediate, e.g. `local_data/dawiki-all-parents.parquet`."""
+    if fmt not in INTERMEDIATE_FORMATS:
+        raise ValueError(f"Unknown intermediate format {fmt}")
+    return DATA_DIR / f"{prefix}wiki-{name}.{fmt}"
+
+
+def write_table(df: pd.DataFrame, path: Path) -> None:
+    """Write a DataFrame as Parquet or CSV, depending on the suffix of `path`."""
+    if path.suffix == ".parquet":
+        df.to_parquet(path, index=False, compression=PARQUET_COMPRESSION)
+    else:
+        df.to_csv(path, index=False)
+
+
+def read_table(path: Path, columns: list[str] | None = None) -> pd.DataFrame:
+    """
+    Read a Parquet or CSV table, depending on the suffix of `path`.
+
+    Parquet files are memory-mapped and only the requested columns are decoded.
+
+    Args:
+        path (Path): The path to the table.
+        columns (list[str] | None): The columns to load. Defaults to None (all).
+
+    Returns:
+        pd.DataFrame: The table.
+    """
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    return pd.read_csv(path, usecols=columns)
+
+
+def write_chunks(chunks: Iterable[pd.DataFrame], path: Path, columns: list[str]) -> int:
+    """
+    Write DataFrame chunks to a single CSV or Parquet file (chosen by suffix).
+
+    The file is written under a temporary name and renamed when complete, so an
+    interrupted run never leaves a partial file that looks finished (see
+    `replace_when_done`).
+
+    Args:
+        chunks (Iterable[pd.DataFrame]): The chunks to write.
+        path (Path): The output path, ending in `.csv` or `.parquet`.
+        columns (list[str]): The output columns, used when there are no chunks.
+
+    Returns:
+        int: The number of rows written.
+    """
+    n_rows = 0
+    with replace_when_done(path) as tmp_path:
+        if path.suffix == ".parquet":
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            writer = None
+            try:
+                for chunk in chunks:
+                    table = pa.Table.from_pandas(chunk, preserve_index=False)
+                    if writer is None:
+                        writer = pq.ParquetWriter(
+                            tmp_path,
+                            table.schema,
+                            compression=PARQUET_COMPRESSION,
+                        )
+                    writer.write_table(table)
+                    n_rows += len(chunk)
+            finally:
+                if writer is not None:
+                    writer.close()
+            if writer is None:
+                pd.DataFrame(columns=columns).to_parquet(tmp_path, index=False)
+        else:
+            pd.DataFrame(columns=columns).to_csv(tmp_path, index=False)
+            for chunk in chunks:
+                chunk.to_csv(tmp_path, mode="a", header=False, index=False)
+                n_rows += len(chunk)
+    return n_rows
+
+
+def write_arrays(
+    arrays: dict[str, np.ndarray],
+    path: Path,
+    metadata: dict | None = None,
+) -> None:
+    """
+    Write named arrays to one file that `read_arrays` can memory-map.
+
+    The file is a sequence of `.npy` records: a JSON header with the names and
+    `metadata`, then the arrays in order. It is not itself a `.npy` file, as
+    `np.load` would only read the header, so give it another suffix like `.arrays`.
+    It is written under a temporary name and renamed when complete.
+
+    Args:
+        arrays (dict[str, np.ndarray]): The arrays by name. Object arrays are not supported.
+        path (Path): The output path.
+        metadata (dict | None): JSON-serialisable values to keep with the arrays. Defaults to None.
+    """
+    header = json.dumps({"names": list(arrays), "metadata": metadata or {}}).encode(
+        "utf-8",
+    )
+    tmp_path = path.with_name(path.name + ".tmp")
+    with tmp_path.open("wb") as file:
+        np.save(file, np.frombuffer(header, dtype=np.uint8))
+        for array in arrays.values():
+            np.save(file, np.ascontiguousarray(array), allow_pickle=False)
+    tmp_path.replace(path)
+
+
+def read_arrays(path: Path, mmap: bool = True) -> tuple[dict[str, np.ndarray], dict]:
+    """
+    Read the arrays and metadata written by `write_arrays`.
+
+    Args:
+        path (Path): The path of the file.
+        mmap (bool): Memory-map the arrays instead of reading them. Defaults to True.
+
+    Returns:
+        tuple[dict[str, np.ndarray], dict]: The arrays by name and the metadata.
+    """
+
+    def read_record(file: BinaryIO) -> np.ndarray:
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(file)
+        offset = file.tell()
+        count = int(np.prod(shape))
+        order = "F" if fortran_order else "C"
+        if mmap and count:
+            array = np.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=offset,
+                shape=shape,
+                order=order,
+            )
+        else:
+            array = np.fromfile(file, dtype=dtype, count=count).reshape(
+                shape,
+                order=order,
+            )
+        file.seek(offset + count * dtype.itemsize)
+        return array
+
+    with path.open("rb") as file:
+        header = json.loads(bytes(read_record(file)))
+        arrays = {name: read_record(file) for name in header["names"]}
+    return arrays, header["metadata"]
+
+
+class FileHasher:
+    """
+    Content hashes of files, memoised by size and modification time.
+
+    The memo is saved between runs, so unchanged multi-GB dumps are only read once.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._memo = json.loads(path.read_text()) if path.exists() else {}
+
+    def __call__(self, path: Path) -> str | None:
+        """Return the sha256 of the contents of `path`, or None if it does not exist."""
+        if not path.exists():
+            return None
+        stat = path.stat()
+        key = str(path.resolve())
+        with self._lock:
+            memo = self._memo.get(key)
+        if (
+            memo
+            and memo["size"] == stat.st_size
+            and memo["mtime_ns"] == stat.st_mtime_ns
+        ):
+            return memo["digest"]
+        digest = hashlib.sha256()
+        with path.open("rb") as file:
+            while chunk := file.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+        with self._lock:
+            self._memo[key] = {
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "digest": digest.hexdigest(),
+            }
+        return digest.hexdigest()
+
+    def save(self) -> None:
+        with self._lock:
+            text = json.dumps(self._memo, indent=1, sort_keys=True)
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        tmp_path.write_text(text)
+        tmp_path.replace(self.path)
@@ -0,0 +1,227 @@
+import contextlib
+import contextvars
+import cProfile
+import json
+import os
+import resource
+import sys
+import threading
+import time
+from collections.abc import Generator
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+from loguru import logger
+
+import src.fileio as fileio
+
+REPORT_DIR = fileio.DATA_DIR / "reports"
+# Comma-separated stage names to profile, e.g. PROFILE_STAGES=read_inserts,extract_articles
+PROFILE_ENV = "PROFILE_STAGES"
+RSS_INTERVAL = 0.05
+
+_language: contextvars.ContextVar[str | None] = contextvars.ContextVar(
+    "language",
+    default=None,
+)
+_lock = threading.Lock()
+_records: list["StageMetrics"] = []
+_profiled = {name for name in os.environ.get(PROFILE_ENV, "").split(",") if name}
+
+
+@dataclass
+class StageMetrics:
+    """
+    The measurements of one run of a stage.
+
+    CPU time is that of the whole process plus its finished child processes, so it
+    includes other stages running concurrently in other threads.
+    """
+
+    stage: str
+    prefix: str | None
+    started: str
+    details: dict = field(default_factory=dict)
+    items: int = 0
+    nbytes: int = 0
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    peak_rss_mb: float = 0.0
+    items_per_second: float = 0.0
+    nbytes_per_second: float = 0.0
+    profile: str | None = None
+
+    def add(self, items: int = 0, nbytes: int = 0) -> None:
+        """Count processed items and bytes."""
+        self.items += items
+        self.nbytes += nbytes
+
+
+def _cpu_seconds() -> float:
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+def _current_rss() -> int:
+    """The resident set size of this process in bytes, or 0 where /proc is unavailable."""
+    try:
+        pages = int(Path("/proc/self/statm").read_text().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def _max_rss() -> int:
+    """The highest resident set size of this process so far, in bytes."""
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class _RssSampler(threading.Thread):
+    """Samples the resident set size in the background to find the peak of a stage."""
+
+    def __init__(self) -> None:
+        super().__init__(daemon=True)
+        self.peak = _current_rss()
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(RSS_INTERVAL):
+            self.peak = max(self.peak, _current_rss())
+
+    def stop(self) -> int:
+        self._stop_event.set()
+        self.join()
+        return max(self.peak, _current_rss())
+
+
+def set_language(prefix: str) -> None:
+    """Attribute the stages measured from now on (in this thread) to the language `prefix`."""
+    _language.set(prefix)
+
+
+@contextlib.contextmanager
+def language(prefix: str) -> Generator[None]:
+    """Attribute the stages measured inside the block to the language `prefix`."""
+    token = _language.set(prefix)
+    try:
+        yield
+    finally:
+        _language.reset(token)
+
+
+def enable_profiling(*stages: str) -> None:
+    """Capture a cProfile of every later run of the named stages."""
+    _profiled.update(stages)
+
+
+def _start_profile(stage: str) -> cProfile.Profile | None:
+    if stage not in _profiled:
+        return None
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError as e:
+        # Only one profiler can be active at a time, e.g. with concurrent stages
+        logger.warning(f"Not profiling {stage}: {e}")
+        return None
+    return profile
+
+
+@contextlib.contextmanager
+def measure(stage: str, **details: object) -> Generator[StageMetrics]:
+    """
+    Measure a stage and add it to the run report.
+
+    The block can count its work with `metrics.add(items=..., nbytes=...)` to get
+    throughputs. The stage is profiled when it was named in `enable_profiling` or
+    the PROFILE_STAGES environment variable. Worker processes are not included
+    in the profile.
+
+    Args:
+        stage (str): The name of the stage, e.g. "read_inserts".
+        **details (object): Extra JSON-serialisable fields, e.g. the input path.
+
+    Yields:
+        StageMetrics: The metrics of this run, filled in when the block exits.
+    """
+    metrics = StageMetrics(
+        stage=stage,
+        prefix=_language.get(),
+        started=datetime.now().isoformat(timespec="seconds"),
+        details={key: str(value) for key, value in details.items()},
+    )
+    sampler = _RssSampler()
+    sampler.start()
+    profile = _start_profile(stage)
+    wall_start = time.perf_counter()
+    cpu_start = _cpu_seconds()
+    try:
+        yield metrics
+    finally:
+        metrics.wall_seconds = time.perf_counter() - wall_start
+        metrics.cpu_seconds = _cpu_seconds() - cpu_start
+        peak_rss = sampler.stop() or _max_rss()
+        metrics.peak_rss_mb = peak_rss / 2**20
+        if metrics.wall_seconds > 0:
+            metrics.items_per_second = metrics.items / metrics.wall_seconds
+            metrics.nbytes_per_second = metrics.nbytes / metrics.wall_seconds
+        if profile is not None:
+            profile.disable()
+            metrics.profile = str(_save_profile(profile, metrics))
+        with _lock:
+            _records.append(metrics)
+        logger.debug(
+            f"{stage} ({metrics.prefix}): {metrics.wall_seconds:.2f}s wall, "
+            f"{metrics.cpu_seconds:.2f}s CPU, {metrics.peak_rss_mb:.0f}MB peak RSS, "
+            f"{metrics.items_per_second:.0f} items/s",
+        )
+
+
+def _save_profile(profile: cProfile.Profile, metrics: StageMetrics) -> Path:
+    path = (
+        REPORT_DIR
+        / "profiles"
+        / (
+            f"{metrics.prefix or 'all'}-{metrics.stage}-"
+            f"{datetime.now().strftime('%Y%m%d%H%M%S%f')}.prof"
+        )
+    )
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profile.dump_stats(path)
+    logger.info(f"Saved profile of {metrics.stage} to {path}")
+    return path
+
+
+def records() -> list[StageMetrics]:
+    """The stages measured so far in this process."""
+    with _lock:
+        return list(_records)
+
+
+def write_report(path: Path | None = None) -> Path | None:
+    """
+    Write the stages measured so far as a JSON run report.
+
+    Args:
+        path (Path | None): Where to write the report. Defaults to a file in local_data/reports/ named after the script and time.
+
+    Returns:
+        Path | None: The path of the report, or None if nothing was measured.
+    """
+    stages = records()
+    if not stages:
+        return None
+    if path is None:
+        script = Path(sys.argv[0]).stem
+        path = REPORT_DIR / f"{script}-{datetime.now().strftime('%Y%m%d%H%M%S')}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    report = {
+        "command": sys.argv,
+        "python": sys.version.split()[0],
+        "stages": [asdict(stage) for stage in stages],
+    }
+    path.write_text(json.dumps(report, indent=2))
+    logger.info(f"Saved run report to {path}")
+    return path
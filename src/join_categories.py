@@ -1,21 +1,35 @@
 import argparse
+import json
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+from loguru import logger
 from tqdm import tqdm
 
+import src.fileio as fileio
+import src.instrumentation as instrumentation
+from src.ancestor_index import AncestorIndex, ancestor_index_path
+from src.category_graph import (
+    CategoryGraph,
+    first_ancestors,
+    top_level_ancestors,
+    top_level_frontiers,
+    update_top_level_frontiers,
+)
 from src.config import Config
+from src.normalize import misinterpret
+from src.vocabulary import CategoryVocabulary, vocabulary_path
 
+NUM_LEVELS = 20
 
-def misinterpret(text: str, false_encoding: str = "latin1") -> str:
-    return text.encode("utf-8").decode(false_encoding)
 
-
-def get_all_parents(
+def get_all_parents_merge(
     joined: pd.DataFrame,
     top_level: pd.Series,
     num_levels: int = 20,
 ) -> pd.DataFrame:
+    """Reference implementation of `get_all_parents` with repeated DataFrame merges."""
     parent_list = []
     new_parents = joined[joined["parent"].isin(top_level)]
     orphans = joined[
@@ -35,21 +49,184 @@ def get_all_parents(
     return all_parents
 
 
+def get_all_parents(
+    joined: pd.DataFrame,
+    top_level: pd.Series,
+    num_levels: int | None = 20,
+) -> pd.DataFrame:
+    """
+    Map every category to its top-level ancestors.
+
+    Args:
+        joined (pd.DataFrame): The category edges with `child` and `parent` columns.
+        top_level (pd.Series): The titles of the top-level categories.
+        num_levels (int | None): The maximum depth to follow. Defaults to 20, None means no limit.
+
+    Returns:
+        pd.DataFrame: The unique (child, parent) pairs, where parent is a top-level category.
+    """
+    with instrumentation.measure("get_all_parents") as metrics:
+        graph = CategoryGraph.from_edges(joined["child"], joined["parent"])
+        children, parents = top_level_ancestors(
+            graph,
+            graph.ids(top_level),
+            num_levels=num_levels,
+        )
+        metrics.add(items=len(joined))
+    return pd.DataFrame(
+        {"child": graph.names[children], "parent": graph.names[parents]},
+    )
+
+
+def state_path(prefix: str) -> Path:
+    """The path of the parameters that the saved edges and frontiers of a language were computed with."""
+    return fileio.DATA_DIR / f"{prefix}wiki-join-state.json"
+
+
+def save_state(
+    prefix: str,
+    fmt: str,
+    child_ids: np.ndarray,
+    parent_ids: np.ndarray,
+    frontiers: tuple[np.ndarray, np.ndarray, np.ndarray],
+    state: dict,
+) -> None:
+    """Keep the edges and BFS frontiers of this run, so the next run can update them incrementally."""
+    fileio.write_table(
+        pd.DataFrame({"child_id": child_ids, "parent_id": parent_ids}),
+        fileio.intermediate_path(prefix, "category-edges", fmt),
+    )
+    categories, ancestors, levels = frontiers
+    fileio.write_table(
+        pd.DataFrame(
+            {
+                "category_id": categories.astype(np.int32),
+                "ancestor_id": ancestors.astype(np.int32),
+                "level": levels,
+            },
+        ),
+        fileio.intermediate_path(prefix, "category-frontiers", fmt),
+    )
+    state_path(prefix).write_text(json.dumps(state))
+
+
+def load_state(
+    prefix: str,
+    fmt: str,
+    vocab: CategoryVocabulary,
+    state: dict,
+) -> tuple[CategoryGraph, tuple[np.ndarray, np.ndarray, np.ndarray]] | None:
+    """
+    Load the previous run's graph and frontiers, if they are still valid for this run.
+
+    They are valid when they were computed with the same root and number of
+    levels, and the vocabulary has only been extended since (parse_sql_gz without
+    --force), so that the ids still mean the same categories.
+
+    Args:
+        prefix (str): The language prefix.
+        fmt (str): The intermediate format.
+        vocab (CategoryVocabulary): The current vocabulary.
+        state (dict): The parameters of this run.
+
+    Returns:
+        tuple[CategoryGraph, tuple[np.ndarray, np.ndarray, np.ndarray]] | None: The previous graph and frontiers, or None.
+    """
+    edges_path = fileio.intermediate_path(prefix, "category-edges", fmt)
+    frontiers_path = fileio.intermediate_path(prefix, "category-frontiers", fmt)
+    if not (
+        state_path(prefix).exists() and edges_path.exists() and frontiers_path.exists()
+    ):
+        logger.info("No previous state to update. Computing all ancestors.")
+        return None
+    previous = fileio.read_json(state_path(prefix))
+    if (
+        previous["root_id"] != state["root_id"]
+        or previous["num_levels"] != state["num_levels"]
+        or previous["vocab_size"] > state["vocab_size"]
+        or previous["vocab_digest"] != vocab.digest(previous["vocab_size"])
+    ):
+        logger.warning(
+            "The previous state does not match this run. Computing all ancestors.",
+        )
+        return None
+    edges = fileio.read_table(edges_path)
+    frontiers = fileio.read_table(frontiers_path)
+    graph = CategoryGraph.from_codes(
+        edges["child_id"].to_numpy(dtype=np.int32),
+        edges["parent_id"].to_numpy(dtype=np.int32),
+        vocab.titles,
+    )
+    return graph, (
+        frontiers["category_id"].to_numpy(dtype=np.int64),
+        frontiers["ancestor_id"].to_numpy(dtype=np.int64),
+        frontiers["level"].to_numpy(dtype=np.int16),
+    )
+
+
 def main(args: argparse.Namespace):
     config: Config = Config.from_json(args.config_path)
     prefix = config.prefix
-    ids = pd.read_csv(f"local_data/{prefix}wiki-category-ids.csv")
-    links = pd.read_csv(f"local_data/{prefix}wiki-latest-categorylinks.csv")
-    joined = links.merge(ids, left_on="cl_from", right_on="cat_id").rename(
-        columns={"cat_title": "child", "cl_to": "parent"},
-    )[["child", "parent"]]
-    top_level = joined.loc[
-        joined["parent"] == misinterpret(config.top_level),
-        "child",
-    ].values
+    instrumentation.set_language(prefix)
+    fmt = args.intermediate_format
+    vocab = CategoryVocabulary.load(vocabulary_path(prefix, fmt))
+    ids = fileio.read_table(
+        fileio.intermediate_path(prefix, "category-ids", fmt),
+        columns=["cat_id", "cat_title_id"],
+    )
+    links = fileio.read_table(
+        fileio.intermediate_path(prefix, "latest-categorylinks", fmt),
+        columns=["cl_from", "cl_to_id"],
+    )
+    joined = links.merge(ids, left_on="cl_from", right_on="cat_id")
+    child_ids = joined["cat_title_id"].to_numpy(dtype=np.int32)
+    parent_ids = joined["cl_to_id"].to_numpy(dtype=np.int32)
+    root_id = vocab.lookup([misinterpret(config.top_level)])[0]
+    top_level = child_ids[parent_ids == root_id]
+    state = {
+        "root_id": int(root_id),
+        "num_levels": NUM_LEVELS,
+        "vocab_size": len(vocab),
+        "vocab_digest": vocab.digest(),
+    }
+    previous = load_state(prefix, fmt, vocab, state) if args.incremental else None
 
-    all_parents = get_all_parents(joined, top_level)
-    all_parents.to_csv(f"local_data/{prefix}wiki-all-parents.csv", index=False)
+    with instrumentation.measure(
+        "get_all_parents",
+        incremental=previous is not None,
+    ) as metrics:
+        graph = CategoryGraph.from_codes(child_ids, parent_ids, vocab.titles)
+        if previous is None:
+            frontiers = top_level_frontiers(graph, top_level, num_levels=NUM_LEVELS)
+        else:
+            frontiers, n_updated = update_top_level_frontiers(
+                graph,
+                top_level,
+                *previous,
+                num_levels=NUM_LEVELS,
+            )
+            logger.info(
+                f"Updated the ancestors of {n_updated} of {len(vocab)} categories",
+            )
+        children, parents = first_ancestors(frontiers[0], frontiers[1], graph.n_nodes)
+        metrics.add(items=len(child_ids))
+    save_state(prefix, fmt, child_ids, parent_ids, frontiers, state)
+    AncestorIndex.from_frontiers(
+        graph,
+        top_level,
+        frontiers,
+        num_levels=NUM_LEVELS,
+        metadata=state,
+    ).save(ancestor_index_path(prefix))
+    fileio.write_table(
+        pd.DataFrame(
+            {
+                "child_id": children.astype(np.int32),
+                "parent_id": parents.astype(np.int32),
+            },
+        ),
+        fileio.intermediate_path(prefix, "all-parents", fmt),
+    )
 
 
 if __name__ == "__main__":
@@ -61,5 +238,16 @@ if __name__ == "__main__":
         type=Path,
         default=Path("da-config.json"),
     )
+    parser.add_argument(
+        "--intermediate-format",
+        choices=fileio.INTERMEDIATE_FORMATS,
+        default="parquet",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only recompute the ancestors of the categories below edges that changed since the last run.",
+    )
     args = parser.parse_args()
     main(args=args)
+    instrumentation.write_report()
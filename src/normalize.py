@@ -0,0 +1,102 @@
+from collections.abc import Callable
+
+import numpy as np
+import pandas as pd
+
+# More than the distinct category titles of the largest wikis
+CACHE_SIZE = 1 << 22
+
+
+def misinterpret(text: str, false_encoding: str = "latin1") -> str:
+    """Read UTF-8 text as `false_encoding`, the way the SQL dumps are decoded, so titles from both sources match."""
+    return text.encode("utf-8").decode(false_encoding)
+
+
+def map_unique(values: pd.Series, func: Callable[[pd.Series], pd.Series]) -> pd.Series:
+    """
+    Apply a vectorized function to the distinct values only and broadcast the results back.
+
+    Args:
+        values (pd.Series): The values, typically with many repeats.
+        func (Callable[[pd.Series], pd.Series]): The element-wise function, e.g. a chain of `.str` methods.
+
+    Returns:
+        pd.Series: The results, aligned with `values`.
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    results = func(pd.Series(uniques, dtype=object)).to_numpy(dtype=object)
+    return pd.Series(results[codes], index=values.index, dtype=object)
+
+
+def _clean_links(links: pd.Series) -> pd.Series:
+    return (
+        links.str.replace("|", "").str.strip().str.encode("utf-8").str.decode("latin1")
+    )
+
+
+def clean_category_links(links: pd.Series) -> pd.Series:
+    """
+    Normalize category links from the article texts to titles as they are decoded from the SQL dumps.
+
+    Each distinct link is cleaned once.
+
+    Args:
+        links (pd.Series): The link targets, e.g. "Byer|*".
+
+    Returns:
+        pd.Series: The cleaned titles.
+    """
+    return map_unique(links, _clean_links)
+
+
+def strip_quotes(titles: pd.Series) -> pd.Series:
+    """Remove the quotes from titles as they appear in the SQL dumps, e.g. "'Byer'". Each distinct title is cleaned once."""
+    return map_unique(titles, lambda titles: titles.str.replace("'", ""))
+
+
+def title_ids(titles: pd.Series) -> pd.Series:
+    """Invert the cleaned titles into a title -> id mapping (first id wins)."""
+    unique = titles[~titles.duplicated()]
+    return pd.Series(unique.index.to_numpy(dtype=np.int32), index=unique.to_numpy())
+
+
+class CategoryLookup:
+    """
+    Maps category links from the article texts to vocabulary ids.
+
+    Each distinct link is cleaned and looked up once per run. The ids of the links
+    seen so far are cached across calls, until the cache holds `max_size` links,
+    when it starts over.
+    """
+
+    def __init__(self, titles: pd.Series, max_size: int = CACHE_SIZE) -> None:
+        self.ids = title_ids(titles)
+        self.max_size = max_size
+        self._cache: dict[str, int] = {}
+
+    def __call__(self, links: pd.Series) -> np.ndarray:
+        """
+        Look up the vocabulary ids of category links.
+
+        Args:
+            links (pd.Series): The link targets, e.g. "Byer|*".
+
+        Returns:
+            np.ndarray: The int32 ids, -1 for categories that are not in the vocabulary.
+        """
+        codes, uniques = pd.factorize(links)
+        new = [link for link in uniques if link not in self._cache]
+        if len(self._cache) + len(new) > self.max_size:
+            self._cache.clear()
+            new = list(uniques)
+        if new:
+            cleaned = clean_category_links(pd.Series(new, dtype=object))
+            self._cache.update(
+                zip(new, cleaned.map(self.ids).fillna(-1).astype(int).tolist()),
+            )
+        lookup = np.fromiter(
+            (self._cache[link] for link in uniques),
+            dtype=np.int32,
+            count=len(uniques),
+        )
+        return lookup[codes]
@@ -1,16 +1,38 @@
 import argparse
 import bz2
-import json
+import functools
+import itertools
+import multiprocessing
 import re
+from collections.abc import Generator, Iterable, Mapping
+from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
+from typing import BinaryIO
 
 from loguru import logger
 from lxml import etree
 
 import src.fileio as fileio
+import src.instrumentation as instrumentation
+from src.article_store import ArticleStore, write_articles
+from src.article_table import ArticleTable
 from src.config import Config
 
+MEDIAWIKI_NS = "{http://www.mediawiki.org/xml/export-0.10/}"
+# The main namespace; talk, user, template, category etc. pages are skipped
+ARTICLE_NAMESPACES = frozenset({0})
+_PAGE = f"{MEDIAWIKI_NS}page"
+_TITLE = f"{MEDIAWIKI_NS}title"
+_NS = f"{MEDIAWIKI_NS}ns"
+_ID = f"{MEDIAWIKI_NS}id"
+_REDIRECT = f"{MEDIAWIKI_NS}redirect"
+_REVISION = f"{MEDIAWIKI_NS}revision"
+_TEXT = f"{MEDIAWIKI_NS}text"
+
+# The state of pool workers, e.g. the revisions of the previous run set by `_set_revisions`
+_worker_state: dict = {"revisions": None}
+
 
 def clean_text_generic(text: str, start_str: str, end_str: str) -> str:
     """
@@ -57,35 +79,274 @@ def clean_text_generic(text: str, start_str: str, end_str: str) -> str:
     return cleaned_text.strip()
 
 
-def clean_text(text: str, config: Config | None = None) -> str:
+@functools.lru_cache(maxsize=32)
+def _compile_alternatives(*strings: str) -> re.Pattern:
+    return re.compile("|".join(re.escape(string) for string in strings))
+
+
+def _skip_construct(text: str, start: int, opener: str, end_str: str) -> int:
+    """Return the index just after the `end_str` that closes the construct at `start`."""
+    depth = 1
+    for match in _compile_alternatives(opener, end_str).finditer(text, start):
+        depth += 1 if match.group() == opener else -1
+        if depth == 0:
+            return match.end()
+    return len(text)
+
+
+def strip_constructs(
+    text: str,
+    constructs: list[tuple[str, str]],
+    first_paragraph: bool = False,
+) -> str:
     """
-    Cleans the article text by removing bracketed file references that start with 'Fil:'.
+    Cleans the article text by removing nested constructs such as file links and infoboxes in one pass.
+
+    A construct starts at its start string and ends at the matching end string.
+    Brackets opened inside it (the first `len(end_str)` characters of the start
+    string, e.g. `[[` for `[[Fil:`) must be closed before the construct ends.
+
+    Args:
+        text (str): The raw text from the Wikimedia article.
+        constructs (list[tuple[str, str]]): The (start string, end string) pairs to remove.
+        first_paragraph (bool): Only return the text before the first blank line, and stop scanning once it is complete. Defaults to False.
+
+    Returns:
+        str: The cleaned text.
+    """
+    openers = {start: start[: len(end_str)] for start, end_str in constructs}
+    ends = dict(constructs)
+    starts_pattern = _compile_alternatives(*ends)
+    segments = []
+    started = False  # Whether any non-whitespace text has been kept
+    broken = False  # Whether the kept text contains a paragraph break
+    last_char = ""
+    i = 0
+    while i < len(text):
+        match = starts_pattern.search(text, i)
+        end = match.start() if match else len(text)
+        segment = text[i:end]
+        segments.append(segment)
+
+        if first_paragraph:
+            kept = segment if started else segment.lstrip()
+            if kept:
+                started = True
+                if broken and not kept.isspace():
+                    break
+                joined = last_char + kept
+                if not broken and "\n\n" in joined:
+                    broken = True
+                    if not joined[joined.index("\n\n") :].isspace():
+                        break
+                last_char = kept[-1]
+
+        if match is None:
+            break
+        start_str = match.group()
+        i = _skip_construct(text, match.end(), openers[start_str], ends[start_str])
+
+    cleaned = "".join(segments).strip()
+    if first_paragraph:
+        return cleaned.split("\n\n")[0]
+    return cleaned
+
+
+def clean_text(
+    text: str,
+    config: Config | None = None,
+    first_paragraph: bool = False,
+) -> str:
+    """
+    Cleans the article text by removing bracketed file references and infoboxes.
 
     Args:
         text (str): The raw text from the Wikimedia article.
         config (dict): A dictionary with file and infobox strings. Defaults to None.
+        first_paragraph (bool): Only clean and return the first paragraph. Defaults to False.
 
     Returns:
         str: The cleaned text.
     """
     file = config.file if config else "Fil"
     infobox = config.infobox if config else "Infoboks"
-    cleaned = clean_text_generic(text, f"[[{file}:", "]]")
-    cleaned = clean_text_generic(
-        cleaned,
-        "{{Infoboks".replace("Infoboks", infobox),
-        "}}",
+    return strip_constructs(
+        text,
+        [(f"[[{file}:", "]]"), ("{{" + infobox, "}}")],
+        first_paragraph=first_paragraph,
     )
-    return cleaned
+
+
+@functools.lru_cache(maxsize=8)
+def _compile_category_pattern(category: str) -> re.Pattern:
+    return re.compile(rf"\[\[{re.escape(category)}:(.*?)\]\]")
+
+
+def extract_categories(raw_text: str, category: str = "Kategori") -> list[str]:
+    """
+    Extracts the `[[Category:...]]` link targets from the raw article text.
+
+    Categories usually sit at the end of the article, so the regex only runs from
+    the first occurrence of the link prefix, which is found with a plain `str.find`.
+
+    Args:
+        raw_text (str): The raw text from the Wikimedia article.
+        category (str): The language's name for the category namespace. Defaults to "Kategori".
+
+    Returns:
+        list[str]: The category link targets in order of appearance.
+    """
+    first = raw_text.find(f"[[{category}:")
+    if first == -1:
+        return []
+    return _compile_category_pattern(category).findall(raw_text, first)
+
+
+@dataclass(frozen=True, slots=True)
+class Page:
+    """The fields of a <page> element that the pipeline uses."""
+
+    title: str
+    page_id: int
+    revision_id: int
+    text: str
+
+
+def read_page(
+    elem: etree._Element,
+    namespaces: frozenset[int] = ARTICLE_NAMESPACES,
+) -> Page | None:
+    """
+    Reads a <page> element into a `Page`.
+
+    Only the direct children of the page and its revision are visited. Pages
+    outside `namespaces` and redirects are recognised from their <ns> and
+    <redirect> fields and skipped before their text is read.
+
+    Args:
+        elem (etree._Element): The <page> element.
+        namespaces (frozenset[int]): The namespaces to keep. Defaults to the main (article) namespace.
+
+    Returns:
+        Page | None: The page, or None for skipped pages and pages without text.
+    """
+    title = page_id = revision = None
+    for child in elem:
+        tag = child.tag
+        if tag == _TITLE:
+            title = child.text
+        elif tag == _NS:
+            if int(child.text) not in namespaces:
+                return None
+        elif tag == _ID:
+            page_id = int(child.text)
+        elif tag == _REDIRECT:
+            return None
+        elif tag == _REVISION:
+            revision = child
+    if title is None or revision is None:
+        return None
+    revision_id, text = None, None
+    for child in revision:
+        if child.tag == _ID:
+            revision_id = int(child.text)
+        elif child.tag == _TEXT:
+            text = child.text
+    if text is None:
+        return None
+    return Page(title, page_id, revision_id, text)
+
+
+def iter_pages(
+    file: BinaryIO,
+    namespaces: frozenset[int] = ARTICLE_NAMESPACES,
+) -> Generator[Page]:
+    """
+    Streams the pages of an uncompressed Wikimedia XML dump in constant memory.
+
+    Every <page> element is dropped from the tree once it is read, so memory does
+    not grow with the number of pages.
+
+    Args:
+        file (BinaryIO): The XML dump.
+        namespaces (frozenset[int]): The namespaces to keep, see `read_page`. Defaults to the main (article) namespace.
+
+    Yields:
+        Page: The kept pages in dump order.
+    """
+    for _, elem in etree.iterparse(file, events=("end",), tag=_PAGE):
+        page = read_page(elem, namespaces=namespaces)
+        # Clearing the page leaves an empty element behind, so also remove it
+        # (and the <siteinfo> before the first page) from the root
+        elem.clear(keep_tail=False)
+        parent = elem.getparent()
+        while elem.getprevious() is not None:
+            del parent[0]
+        if page is not None:
+            yield page
+
+
+def parse_page(
+    page: Page,
+    config: Config | None = None,
+    revisions: Mapping[int, int] | None = None,
+) -> tuple[str, str | None, list[str] | None, int, int]:
+    """
+    Extracts the title, cleaned first paragraph, categories and ids of a page.
+
+    Args:
+        page (Page): The page.
+        config (Config): The language config. Defaults to None.
+        revisions (Mapping[int, int] | None): The revision ids of the pages that are already parsed, by page id. The text of a page whose revision is unchanged is not cleaned and its text and categories are None. Defaults to None.
+
+    Returns:
+        tuple[str, str | None, list[str] | None, int, int]: The title, cleaned text, categories, page id and revision id.
+    """
+    if revisions is not None and revisions.get(page.page_id) == page.revision_id:
+        return page.title, None, None, page.page_id, page.revision_id
+
+    # Only clean until the first "\n\n", which is all that is kept
+    cleaned_text = clean_text(page.text, config=config, first_paragraph=True)
+    categories = extract_categories(page.text, config.category)
+    return page.title, cleaned_text, categories, page.page_id, page.revision_id
+
+
+def iter_articles(
+    file_path: Path,
+    num_articles: int = 1,
+    config: Config | None = None,
+    revisions: Mapping[int, int] | None = None,
+) -> Generator[tuple[str, str | None, list[str] | None, int, int]]:
+    """
+    Streams the first articles of a bz2-compressed Wikimedia XML dump.
+
+    Args:
+        file_path (Path): The path to the bz2-compressed XML file.
+        num_articles (int): The number of articles to extract. Defaults to 1.
+        config (Config): The language config. Defaults to None.
+        revisions (Mapping[int, int] | None): The revisions that are already parsed, see `parse_page`. Defaults to None.
+
+    Yields:
+        tuple[str, str | None, list[str] | None, int, int]: The title, cleaned text, categories, page id and revision id of each article.
+    """
+    with instrumentation.measure(
+        "extract_articles",
+        path=file_path.name,
+    ) as metrics, file_path.open("rb") as raw, bz2.open(raw, "rb") as file:
+        for page in itertools.islice(iter_pages(file), num_articles):
+            yield parse_page(page, config=config, revisions=revisions)
+            metrics.add(items=1)
+        # The compressed bytes read, like the other stages
+        metrics.add(nbytes=raw.tell())
 
 
 def extract_articles(
     file_path: Path,
     num_articles: int = 1,
     config: Config | None = None,
-) -> dict[str, tuple[str, list[str]]]:
+) -> ArticleTable:
     """
-    Extracts articles from a bz2-compressed Wikimedia XML dump.
+    Extracts articles from a bz2-compressed Wikimedia XML dump into a columnar `ArticleTable`.
 
     Args:
         file_path (Path): The path to the bz2-compressed XML file.
@@ -93,51 +354,209 @@ def extract_articles(
         config (dict[str, str]): A dictionary with start and end strings for unwanted sections. Defaults to None.
 
     Returns:
-        dict[str, tuple[str, list[str]]]: A dictionary with titles as keys and a tuple of cleaned text and categories.
-    """
-    articles = {}
-    with bz2.open(file_path, "rb") as file:
-        context = etree.iterparse(
-            file,
-            events=("end",),
-            tag="{http://www.mediawiki.org/xml/export-0.10/}page",
+        ArticleTable: The articles. Like a dict, a repeated title keeps its last article.
+    """
+    table = ArticleTable.from_articles(
+        (title, cleaned_text, categories)
+        for title, cleaned_text, categories, *_ in iter_articles(
+            file_path,
+            num_articles=num_articles,
+            config=config,
         )
-        article_count = 0
+    )
+    return table.take(table.last_rows())
 
-        for event, elem in context:
-            if article_count >= num_articles:
-                break
 
-            title_elem = elem.find(
-                ".//{http://www.mediawiki.org/xml/export-0.10/}title",
-            )
-            if title_elem.text is None or title_elem.text.startswith(config.category):
-                continue
-            text_elem = elem.find(".//{http://www.mediawiki.org/xml/export-0.10/}text")
-            if text_elem.text is None or "#REDIRECT" in text_elem.text:
-                continue
-            categories = []
-
-            if title_elem is not None and text_elem is not None:
-                title = title_elem.text
-                raw_text = text_elem.text or ""
-
-                # Clean the text
-                cleaned_text = clean_text(raw_text, config=config)
-                # only save until the first "\n\n"
-                cleaned_text = cleaned_text.split("\n\n")[0]
-
-                # Extract categories, assuming categories are mentioned as links or in a specific section
-                categories = re.findall(
-                    rf"\[\[{config.category}:(.*?)\]\]",
-                    raw_text,
-                )
-
-                articles[title] = (cleaned_text, categories)
+def read_stream_offsets(index_path: Path) -> list[int]:
+    """
+    Reads the start offsets of the bz2 streams from a multistream index.
+
+    Args:
+        index_path (Path): The path to the bz2-compressed `offset:page_id:title` index.
+
+    Returns:
+        list[int]: The sorted, unique stream offsets.
+    """
+    offsets = set()
+    with bz2.open(index_path, "rt", encoding="utf-8") as file:
+        for line in file:
+            offsets.add(int(line.split(":", 1)[0]))
+    return sorted(offsets)
+
+
+def stream_pages(file_path: Path, start: int, end: int) -> list[Page]:
+    """
+    Decompresses one bz2 stream of a multistream dump and reads its article pages.
+
+    Args:
+        file_path (Path): The path to the multistream XML dump.
+        start (int): The byte offset where the stream starts.
+        end (int): The byte offset where the stream ends.
+
+    Returns:
+        list[Page]: The pages in the main namespace that are not redirects, in dump order.
+    """
+    with file_path.open("rb") as file:
+        file.seek(start)
+        data = bz2.decompress(file.read(end - start))
+    first_page = data.find(b"<page>")
+    if first_page == -1:
+        return []
+    last_page = data.rindex(b"</page>") + len(b"</page>")
+    root = etree.fromstring(
+        b'<mediawiki xmlns="'
+        + MEDIAWIKI_NS.strip("{}").encode()
+        + b'">'
+        + data[first_page:last_page]
+        + b"</mediawiki>",
+    )
+    pages = (read_page(elem) for elem in root.iterchildren(_PAGE))
+    return [page for page in pages if page is not None]
+
+
+def extract_stream(
+    file_path: Path,
+    start: int,
+    end: int,
+    config: Config | None = None,
+    revisions: Mapping[int, int] | None = None,
+) -> list[tuple[str, str | None, list[str] | None, int, int]]:
+    """
+    Decompresses and parses the pages of one bz2 stream of a multistream dump.
+
+    Args:
+        file_path (Path): The path to the multistream XML dump.
+        start (int): The byte offset where the stream starts.
+        end (int): The byte offset where the stream ends.
+        config (Config): The language config. Defaults to None.
+        revisions (Mapping[int, int] | None): The revisions that are already parsed, see `parse_page`. Defaults to None.
+
+    Returns:
+        list[tuple[str, str | None, list[str] | None, int, int]]: The parsed pages in dump order.
+    """
+    return [
+        parse_page(page, config=config, revisions=revisions)
+        for page in stream_pages(file_path, start, end)
+    ]
+
+
+def _set_revisions(revisions: Mapping[int, int] | None) -> None:
+    _worker_state["revisions"] = revisions
+
+
+def _extract_stream_task(
+    task: tuple[Path, int, int, Config | None],
+) -> list[tuple[str, str | None, list[str] | None, int, int]]:
+    return extract_stream(*task, revisions=_worker_state["revisions"])
+
+
+def iter_articles_parallel(
+    file_path: Path,
+    index_path: Path,
+    num_articles: int = 1,
+    config: Config | None = None,
+    processes: int | None = None,
+    revisions: Mapping[int, int] | None = None,
+) -> Generator[tuple[str, str | None, list[str] | None, int, int]]:
+    """
+    Streams the first articles of a multistream dump, parsing its bz2 streams in a process pool.
+
+    Streams are handed out and collected in dump order, so this yields the same
+    first `num_articles` articles as `iter_articles`.
+
+    Args:
+        file_path (Path): The path to the multistream XML dump.
+        index_path (Path): The path to the dump's multistream index.
+        num_articles (int): The number of articles to extract. Defaults to 1.
+        config (Config): The language config. Defaults to None.
+        processes (int): The number of worker processes. Defaults to None (one per core).
+        revisions (Mapping[int, int] | None): The revisions that are already parsed, see `parse_page`. They are sent to each worker once. Defaults to None.
+
+    Yields:
+        tuple[str, str | None, list[str] | None, int, int]: The title, cleaned text, categories, page id and revision id of each article.
+    """
+    offsets = read_stream_offsets(index_path)
+    bounds = [*offsets, file_path.stat().st_size]
+    tasks = ((file_path, start, end, config) for start, end in zip(bounds, bounds[1:]))
+    article_count = 0
+    with instrumentation.measure(
+        "extract_articles",
+        path=file_path.name,
+        processes=processes,
+    ) as metrics, multiprocessing.Pool(
+        processes,
+        initializer=_set_revisions,
+        initargs=(revisions,),
+    ) as pool:
+        for pages, (start, end) in zip(
+            pool.imap(_extract_stream_task, tasks),
+            zip(bounds, bounds[1:]),
+        ):
+            metrics.add(nbytes=end - start)
+            for page in pages:
+                if article_count >= num_articles:
+                    return
+                yield page
                 article_count += 1
+                metrics.add(items=1)
 
-            elem.clear()  # Free memory by clearing the element
-    return articles
+
+def extract_articles_parallel(
+    file_path: Path,
+    index_path: Path,
+    num_articles: int = 1,
+    config: Config | None = None,
+    processes: int | None = None,
+) -> ArticleTable:
+    """
+    Extracts articles from a multistream dump into an `ArticleTable`, parsing its bz2 streams in a process pool.
+
+    Args:
+        file_path (Path): The path to the multistream XML dump.
+        index_path (Path): The path to the dump's multistream index.
+        num_articles (int): The number of articles to extract. Defaults to 1.
+        config (Config): The language config. Defaults to None.
+        processes (int): The number of worker processes. Defaults to None (one per core).
+
+    Returns:
+        ArticleTable: The articles. Like a dict, a repeated title keeps its last article.
+    """
+    table = ArticleTable.from_articles(
+        (title, cleaned_text, categories)
+        for title, cleaned_text, categories, *_ in iter_articles_parallel(
+            file_path,
+            index_path,
+            num_articles=num_articles,
+            config=config,
+            processes=processes,
+        )
+    )
+    return table.take(table.last_rows())
+
+
+def reuse_unchanged(
+    pages: Iterable[tuple[str, str | None, list[str] | None, int, int]],
+    previous: ArticleStore,
+) -> Generator[tuple[str, str, list[str], int, int]]:
+    """
+    Fill in the text and categories of the unchanged pages from the previous article store.
+
+    Args:
+        pages (Iterable[tuple[str, str | None, list[str] | None, int, int]]): Pages parsed with the revisions of `previous`.
+        previous (ArticleStore): The article store of the previous run.
+
+    Yields:
+        tuple[str, str, list[str], int, int]: The title, cleaned text, categories, page id and revision id of each article.
+    """
+    n_reused = 0
+    for title, text, categories, page_id, revision_id in pages:
+        if text is not None:
+            yield title, text, categories, page_id, revision_id
+            continue
+        record = previous.page_record(page_id)
+        n_reused += 1
+        yield title, record["text"], record["categories"], page_id, revision_id
+    logger.info(f"Reused {n_reused} articles with unchanged revisions")
 
 
 def main(args: argparse.Namespace):
@@ -145,29 +564,76 @@ def main(args: argparse.Namespace):
     CONFIG_PATH = args.config_path
     assert CONFIG_PATH.exists(), f"Config file not found at {CONFIG_PATH}"
     config: Config = Config.from_json(CONFIG_PATH)
+    instrumentation.set_language(config.prefix)
     if args.skip_if_exists:
         path_to_file = fileio.find_latest_file(
             Path("local_data"),
-            f"{config.prefix}wiki-sample-{N}-*.json",
+            f"{config.prefix}wiki-sample-{N}-*.jsonl",
         )
         if path_to_file is not None:
             logger.info(f"File {path_to_file} already exists. Skipping extraction.")
             return
+    SAVE_PATH = args.output_path or Path(
+        f"local_data/{config.prefix}wiki-sample-{N}-{datetime.now().strftime('%Y%m%d%H%M%S')}.jsonl",
+    )
+    previous = None
+    if args.incremental:
+        previous_path = (
+            SAVE_PATH
+            if SAVE_PATH.exists()
+            else fileio.find_latest_file(
+                Path("local_data"),
+                f"{config.prefix}wiki-sample-{N}-*.jsonl",
+            )
+        )
+        if previous_path is not None:
+            previous = ArticleStore(previous_path)
+            logger.info(f"Reusing the unchanged articles of {previous_path}")
+        else:
+            logger.info("No previous article store. Parsing all articles.")
+    revisions = previous.revisions() if previous is not None else None
 
-    path_to_file = fileio.find_latest_file(
+    multistream_path = fileio.find_latest_file(
         Path("local_data"),
-        f"{config.prefix}wiki-*-pages-articles.xml.bz2",
+        f"{config.prefix}wiki-*-pages-articles-multistream.xml.bz2",
     )
-    logger.info(f"Extracting {N} articles from {path_to_file}")
-    articles = extract_articles(path_to_file, num_articles=N, config=config)
-    SAVE_PATH = Path(
-        f"local_data/{config.prefix}wiki-sample-{N}-{datetime.now().strftime('%Y%m%d%H%M%S')}.json",
+    index_path = fileio.find_latest_file(
+        Path("local_data"),
+        f"{config.prefix}wiki-*-pages-articles-multistream-index.txt.bz2",
     )
+    if args.processes > 1 and multistream_path and index_path:
+        logger.info(
+            f"Extracting {N} articles from {multistream_path} with {args.processes} processes",
+        )
+        articles = iter_articles_parallel(
+            multistream_path,
+            index_path,
+            num_articles=N,
+            config=config,
+            processes=args.processes,
+            revisions=revisions,
+        )
+    else:
+        if args.processes > 1:
+            logger.warning("No multistream dump and index found. Parsing serially.")
+        path_to_file = fileio.find_latest_file(
+            Path("local_data"),
+            f"{config.prefix}wiki-*-pages-articles.xml.bz2",
+        )
+        logger.info(f"Extracting {N} articles from {path_to_file}")
+        articles = iter_articles(
+            path_to_file,
+            num_articles=N,
+            config=config,
+            revisions=revisions,
+        )
+    if previous is not None:
+        articles = reuse_unchanged(articles, previous)
     logger.info(f"Saving articles to {SAVE_PATH}")
-    SAVE_PATH.write_text(
-        json.dumps(articles, ensure_ascii=False, indent=2),
-        encoding="utf-8",
-    )
+    n_saved = write_articles(articles, SAVE_PATH)
+    if previous is not None:
+        previous.close()
+    logger.info(f"Saved {n_saved} articles")
     logger.info("Done parsing articles!")
 
 
@@ -191,5 +657,23 @@ if __name__ == "__main__":
         action="store_true",
         help="Skip extraction if a file with the same name already exists.",
     )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Parse a multistream dump with this many processes. Defaults to 1 (serial).",
+    )
+    parser.add_argument(
+        "--output-path",
+        type=Path,
+        default=None,
+        help="Where to save the articles. Defaults to a timestamped file in local_data/.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only clean the articles whose revision changed since the previous article store (--output-path or the latest sample).",
+    )
     args = parser.parse_args()
     main(args)
+    instrumentation.write_report()
@@ -1,13 +1,36 @@
 import argparse
+import collections
+import functools
 import gzip
-from collections.abc import Generator
+import multiprocessing
+import queue
+import re
+import threading
+from collections.abc import Callable, Generator, Iterable
+from dataclasses import dataclass
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import pandas as pd
 from loguru import logger
 from tqdm import tqdm
 
+import src.fileio as fileio
+import src.instrumentation as instrumentation
 from src.config import Config
+from src.vocabulary import CategoryVocabulary, vocabulary_path
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+# Decompress with a faster zlib-compatible library when one is installed
+try:
+    from isal import isal_zlib as gzip_backend
+except ImportError:
+    try:
+        from zlib_ng import zlib_ng as gzip_backend
+    except ImportError:
+        import zlib as gzip_backend
 
 CATEGORYLINKS_COLS = [
     "cl_from",
@@ -18,6 +41,21 @@ CATEGORYLINKS_COLS = [
     "cl_collation",
     "cl_type",
 ]
+PAGE_COLS = ["page_id", "page_namespace", "page_title"]
+CATEGORYSPACE = b"14"
+GZIP_WBITS = 31
+READ_BLOCK_SIZE = 1 << 20
+# The decompressed INSERT lines sent to a worker at a time
+PARALLEL_BATCH_SIZE = 1 << 22
+
+# A quoted SQL string with backslash escapes (and the rarely used '' escape)
+_SQL_QUOTED = r"'[^'\\]*(?:\\.[^'\\]*)*'(?:'[^'\\]*(?:\\.[^'\\]*)*')*"
+# An unquoted SQL value such as a number or NULL
+_SQL_UNQUOTED = r"[^,'()\s]*"
+_SQL_QUOTED_RE = re.compile(_SQL_QUOTED, re.DOTALL)
+_SQL_FIRST_TUPLE_RE = re.compile(rf"\(((?:{_SQL_QUOTED}|[^'()])*)\)", re.DOTALL)
+_SQL_QUOTED_BYTES_RE = re.compile(_SQL_QUOTED_RE.pattern.encode(), re.DOTALL)
+_SQL_FIRST_TUPLE_BYTES_RE = re.compile(_SQL_FIRST_TUPLE_RE.pattern.encode(), re.DOTALL)
 
 
 def read_sql_gz(file_path: Path) -> Generator[str]:
@@ -28,6 +66,104 @@ def read_sql_gz(file_path: Path) -> Generator[str]:
             yield line
 
 
+def iter_gzip_blocks(path: Path, block_size: int = READ_BLOCK_SIZE) -> Generator[bytes]:
+    """Decompress a (possibly multi-member) gzip file in large blocks."""
+    decompressor = gzip_backend.decompressobj(GZIP_WBITS)
+    with path.open("rb", buffering=0) as file:
+        while block := file.read(block_size):
+            while block:
+                data = decompressor.decompress(block)
+                if data:
+                    yield data
+                if not decompressor.eof:
+                    break
+                # The rest of the block belongs to the next gzip member
+                block = decompressor.unused_data
+                decompressor = gzip_backend.decompressobj(GZIP_WBITS)
+    if tail := decompressor.flush():
+        yield tail
+
+
+def prefetch(iterable: Iterable, maxsize: int = 4) -> Generator:
+    """
+    Consume `iterable` in a background thread, up to `maxsize` items ahead.
+
+    zlib releases the GIL while it decompresses, so decompression in the
+    background overlaps with parsing in the consuming thread.
+    """
+    items = queue.Queue(maxsize)
+    stop = threading.Event()
+    done = object()
+
+    def put(entry: tuple) -> bool:
+        # Give up when the consumer has stopped, instead of blocking on a full queue
+        while not stop.is_set():
+            try:
+                items.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+            put((done, None))
+        except Exception as e:
+            put((done, e))
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def read_sql_gz_statements(
+    path: Path,
+    block_size: int = READ_BLOCK_SIZE,
+    threaded: bool = False,
+) -> Generator[bytes]:
+    """
+    Stream the `INSERT INTO` lines of a gzipped SQL dump as undecoded bytes.
+
+    Unlike `read_sql_gz`, nothing is decoded here: the lines are found in large
+    decompressed blocks, and callers decode only the fields they keep.
+
+    Args:
+        path (Path): The path to the gzipped SQL dump.
+        block_size (int): The number of compressed bytes to read at a time. Defaults to 1 MiB.
+        threaded (bool): Decompress in a background thread. Defaults to False.
+
+    Yields:
+        bytes: Each `INSERT INTO ... VALUES (...),(...);` line, including its newline.
+    """
+    blocks = iter_gzip_blocks(path, block_size)
+    if threaded:
+        blocks = prefetch(blocks)
+    pending = b""
+    for block in blocks:
+        buffer = pending + block if pending else block
+        start = 0
+        while (end := buffer.find(b"\n", start)) != -1:
+            if buffer.startswith(b"INSERT INTO", start):
+                yield buffer[start : end + 1]
+            start = end + 1
+        pending = buffer[start:]
+    if pending.startswith(b"INSERT INTO"):
+        yield pending
+
+
 def parse_sql_inserts(sql_content: str) -> list[tuple]:
     """Parse SQL INSERT statements from a string to extract data into tuples for DataFrame creation."""
     records = []
@@ -79,43 +215,278 @@ def parse_sql_inserts(sql_content: str) -> list[tuple]:
     return records
 
 
+@functools.lru_cache(maxsize=16)
+def _compile_tuple_pattern(n_fields: int, binary: bool = False) -> re.Pattern:
+    """Match one `n_fields`-column tuple and the separator that follows it."""
+    field = f"({_SQL_QUOTED}|{_SQL_UNQUOTED})"
+    pattern = r"\(" + ",".join([field] * n_fields) + r"\)(?:,|;?\s*\Z)"
+    return re.compile(pattern.encode() if binary else pattern, re.DOTALL)
+
+
+def _parse_sql_inserts_bytes(sql_content: bytes) -> list[tuple]:
+    return [
+        tuple(value.encode("latin1") for value in record)
+        for record in parse_sql_inserts(sql_content.decode("latin1"))
+    ]
+
+
+def tokenize_sql_inserts(sql_content: str | bytes) -> list[tuple]:
+    """
+    Parse an SQL INSERT statement into tuples of raw field values.
+
+    Gives the same records as `parse_sql_inserts`, but matches whole tuples with a
+    compiled regex so the fields are sliced out of the line by the regex engine.
+    Each tuple must start where the previous one ended, so a line that is not a
+    plain `VALUES (...),(...);` statement falls back to `parse_sql_inserts`.
+    A bytes line gives bytes values, so that only the kept values need decoding.
+
+    Args:
+        sql_content (str | bytes): A single `INSERT INTO ... VALUES (...),(...);` line.
+
+    Returns:
+        list[tuple]: One tuple per row, with string values still quoted.
+    """
+    if isinstance(sql_content, bytes):
+        fallback = _parse_sql_inserts_bytes
+        quoted_re, first_tuple_re = _SQL_QUOTED_BYTES_RE, _SQL_FIRST_TUPLE_BYTES_RE
+        paren, quote, close, comma, empty = b"(", b"'", b")", b",", b""
+    else:
+        fallback = parse_sql_inserts
+        quoted_re, first_tuple_re = _SQL_QUOTED_RE, _SQL_FIRST_TUPLE_RE
+        paren, quote, close, comma, empty = "(", "'", ")", ",", ""
+    start = sql_content.find(paren)
+    if start == -1 or quote in sql_content[:start] or close in sql_content[:start]:
+        return fallback(sql_content)
+    first = first_tuple_re.match(sql_content, start)
+    if first is None:
+        return fallback(sql_content)
+    n_fields = quoted_re.sub(empty, first.group(1)).count(comma) + 1
+    pattern = _compile_tuple_pattern(n_fields, binary=isinstance(sql_content, bytes))
+    scanner = pattern.scanner(sql_content, start)
+    matches = list(iter(scanner.match, None))
+    if not matches or matches[-1].end() != len(sql_content):
+        return fallback(sql_content)
+    return list(map(re.Match.groups, matches))
+
+
 def read_inserts(path: Path) -> list[tuple]:
-    new_sql_content = read_sql_gz(path)
-    all_new_records = []
-    for line in tqdm(new_sql_content):
-        new_records = parse_sql_inserts(line)
-        all_new_records.extend(new_records)
+    with instrumentation.measure("read_inserts", path=path.name) as metrics:
+        all_new_records = []
+        for line in tqdm(read_sql_gz_statements(path)):
+            all_new_records.extend(
+                tuple(value.decode("latin1") for value in record)
+                for record in tokenize_sql_inserts(line)
+            )
+        metrics.add(items=len(all_new_records), nbytes=path.stat().st_size)
     return all_new_records
 
 
+@dataclass(frozen=True)
+class FieldEquals:
+    """A picklable `stream_inserts` predicate: keeps records whose field `index` is `value`."""
+
+    index: int
+    value: bytes
+
+    def __call__(self, record: tuple) -> bool:
+        return record[self.index] == self.value
+
+
+def _batch_lines(lines: Iterable[bytes], batch_size: int) -> Generator[list[bytes]]:
+    batch, size = [], 0
+    for line in lines:
+        batch.append(line)
+        size += len(line)
+        if size >= batch_size:
+            yield batch
+            batch, size = [], 0
+    if batch:
+        yield batch
+
+
+def _parse_insert_batch(
+    task: tuple[list[bytes], list[int], list[str], Callable[[tuple], bool] | None],
+) -> tuple["pa.RecordBatch", int]:
+    """Parse, filter and project INSERT lines in a worker, returning the kept columns as Arrow."""
+    import pyarrow as pa
+
+    lines, indices, usecols, predicate = task
+    values = [[] for _ in indices]
+    n_records = 0
+    for line in lines:
+        records = tokenize_sql_inserts(line)
+        n_records += len(records)
+        for record in records:
+            if predicate is None or predicate(record):
+                for column, i in zip(values, indices):
+                    column.append(record[i].decode("latin1"))
+    arrays = [pa.array(column, type=pa.string()) for column in values]
+    return pa.RecordBatch.from_arrays(arrays, names=usecols), n_records
+
+
+def _parse_batches_parallel(
+    tasks: Iterable[tuple],
+    processes: int,
+) -> Generator[tuple["pa.RecordBatch", int]]:
+    """Run `_parse_insert_batch` over `tasks` in a pool, in order and with a bounded backlog."""
+    with multiprocessing.Pool(processes) as pool:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.apply_async(_parse_insert_batch, (task,)))
+            # Unlike imap, don't read ahead more of the dump than the workers can take
+            if len(pending) >= 2 * processes:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def stream_inserts(
+    path: Path,
+    columns: list[str],
+    usecols: list[str],
+    predicate: Callable[[tuple], bool] | None = None,
+    chunk_size: int = 100_000,
+    threaded: bool = False,
+    processes: int = 1,
+) -> Generator[pd.DataFrame]:
+    """
+    Stream the records of an SQL dump as projected, filtered DataFrame chunks.
+
+    Rows are filtered and projected while the dump is parsed, so only the kept
+    columns of the kept rows are held in memory, about `chunk_size` rows at a time.
+    The dump is parsed as bytes and only the kept values are decoded (as latin1).
+
+    With `processes > 1`, batches of INSERT lines are parsed, filtered and
+    projected in a process pool, which sends back only the kept columns as Arrow
+    record batches. The chunks are still yielded in dump order.
+
+    Args:
+        path (Path): The path to the gzipped SQL dump.
+        columns (list[str]): The names of the table's columns in order. Trailing columns that are never kept may be left out.
+        usecols (list[str]): The columns to keep, in output order.
+        predicate (Callable[[tuple], bool]): Keeps a raw record of bytes values when it returns True. Defaults to None (keep all).
+        chunk_size (int): The number of rows after which a chunk is emitted (checked per INSERT line). Defaults to 100_000.
+        threaded (bool): Decompress in a background thread. Defaults to False.
+        processes (int): The number of worker processes. Defaults to 1 (parse in this process). The predicate must be picklable, e.g. a `FieldEquals`.
+
+    Yields:
+        pd.DataFrame: Chunks with the `usecols` columns.
+    """
+    indices = [columns.index(col) for col in usecols]
+    chunk = []
+    # Measured as read_inserts, including the time the consumer spends on each chunk
+    with instrumentation.measure(
+        "read_inserts",
+        path=path.name,
+        processes=processes,
+    ) as metrics:
+        metrics.add(nbytes=path.stat().st_size)
+        lines = tqdm(read_sql_gz_statements(path, threaded=threaded))
+        if processes > 1:
+            import pyarrow as pa
+
+            tasks = (
+                (batch, indices, usecols, predicate)
+                for batch in _batch_lines(lines, PARALLEL_BATCH_SIZE)
+            )
+            batches, n_rows = [], 0
+            for batch, n_records in _parse_batches_parallel(tasks, processes):
+                metrics.add(items=n_records)
+                batches.append(batch)
+                n_rows += batch.num_rows
+                if n_rows >= chunk_size:
+                    yield pa.Table.from_batches(batches).to_pandas()
+                    batches, n_rows = [], 0
+            if n_rows:
+                yield pa.Table.from_batches(batches).to_pandas()
+            return
+        for line in lines:
+            records = tokenize_sql_inserts(line)
+            metrics.add(items=len(records))
+            for record in records:
+                if predicate is None or predicate(record):
+                    chunk.append(tuple(record[i].decode("latin1") for i in indices))
+            if len(chunk) >= chunk_size:
+                yield pd.DataFrame(chunk, columns=usecols)
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=usecols)
+
+
+def encode_titles(
+    chunks: Iterable[pd.DataFrame],
+    id_column: str,
+    title_column: str,
+    vocab: CategoryVocabulary,
+) -> Generator[pd.DataFrame]:
+    """Replace the title column of each chunk with int32 vocabulary ids."""
+    for chunk in chunks:
+        yield pd.DataFrame(
+            {
+                id_column: chunk[id_column].astype("int64"),
+                f"{title_column}_id": vocab.encode(chunk[title_column]),
+            },
+        )
+
+
 def main(args: argparse.Namespace):
     logger.info("Parsing SQL GZ files to extract category links and pages")
     config: Config = Config.from_json(args.config_path)
-    categorylinks_path = Path(
-        f"local_data/{config.prefix}wiki-latest-categorylinks.csv",
+    instrumentation.set_language(config.prefix)
+    fmt = args.intermediate_format
+    vocab_path = vocabulary_path(config.prefix, fmt)
+    # The extracted files hold vocabulary ids, so they are only valid with their vocabulary
+    rebuild = args.force or not vocab_path.exists()
+    vocab = CategoryVocabulary() if rebuild else CategoryVocabulary.load(vocab_path)
+    # Incremental runs parse new dumps into the existing vocabulary, so the ids stay the same
+    extract = rebuild or args.incremental
+
+    categorylinks_path = fileio.intermediate_path(
+        config.prefix,
+        "latest-categorylinks",
+        fmt,
     )
-    if not categorylinks_path.exists():
+    if extract or not categorylinks_path.exists():
         new_path = Path(f"local_data/{config.prefix}wiki-latest-categorylinks.sql.gz")
-        new_real_records = read_inserts(new_path)
-        new_df = pd.DataFrame(new_real_records, columns=CATEGORYLINKS_COLS)
-        new_df.loc[new_df["cl_type"] == "'subcat'", ["cl_from", "cl_to"]].to_csv(
+        cl_type = CATEGORYLINKS_COLS.index("cl_type")
+        chunks = stream_inserts(
+            new_path,
+            columns=CATEGORYLINKS_COLS,
+            usecols=["cl_from", "cl_to"],
+            predicate=FieldEquals(cl_type, b"'subcat'"),
+            chunk_size=args.chunk_size,
+            threaded=args.threaded,
+            processes=args.processes,
+        )
+        fileio.write_chunks(
+            encode_titles(chunks, "cl_from", "cl_to", vocab),
             categorylinks_path,
-            index=False,
+            columns=["cl_from", "cl_to_id"],
         )
+        vocab.save(vocab_path)
     else:
         logger.info("Category links already extracted")
 
-    category_ids_path = Path(f"local_data/{config.prefix}wiki-category-ids.csv")
-    if not category_ids_path.exists():
+    category_ids_path = fileio.intermediate_path(config.prefix, "category-ids", fmt)
+    if extract or not category_ids_path.exists():
         pagepath = Path(f"local_data/{config.prefix}wiki-latest-page.sql.gz")
-        pages = read_inserts(pagepath)
-        CATEGORYSPACE = "14"
-        columns = ["cat_id", "cat_title"]
-        cats = [
-            (record[0], record[2]) for record in pages if record[1] == CATEGORYSPACE
-        ]
-        catdf = pd.DataFrame(cats, columns=columns)
-        catdf.to_csv(category_ids_path, index=False)
+        namespace = PAGE_COLS.index("page_namespace")
+        chunks = stream_inserts(
+            pagepath,
+            columns=PAGE_COLS,
+            usecols=["page_id", "page_title"],
+            predicate=FieldEquals(namespace, CATEGORYSPACE),
+            chunk_size=args.chunk_size,
+            threaded=args.threaded,
+            processes=args.processes,
+        )
+        renamed = (chunk.set_axis(["cat_id", "cat_title"], axis=1) for chunk in chunks)
+        fileio.write_chunks(
+            encode_titles(renamed, "cat_id", "cat_title", vocab),
+            category_ids_path,
+            columns=["cat_id", "cat_title_id"],
+        )
+        vocab.save(vocab_path)
         logger.info("Done parsing SQL GZ files")
     else:
         logger.info("Category IDs already extracted")
@@ -130,6 +501,39 @@ if __name__ == "__main__":
         type=Path,
         default=Path("da-config.json"),
     )
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=100_000,
+        help="The number of kept rows to hold in memory before writing. Defaults to 100,000.",
+    )
+    parser.add_argument(
+        "--intermediate-format",
+        choices=fileio.INTERMEDIATE_FORMATS,
+        default="parquet",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Parse the dumps again but extend the existing vocabulary, so that the category ids of the previous run stay valid.",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Parse the INSERT lines with this many processes. Defaults to 1 (serial).",
+    )
+    parser.add_argument(
+        "--threaded",
+        action="store_true",
+        help="Decompress the dumps in a background thread while parsing.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Extract again even if the extracted files already exist.",
+    )
     args = parser.parse_args()
 
     main(args)
+    instrumentation.write_report()
@@ -0,0 +1,414 @@
+import argparse
+import hashlib
+import json
+from collections.abc import Callable
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from loguru import logger
+
+import src.fileio as fileio
+import src.instrumentation as instrumentation
+from src import (
+    category_index,
+    create_categories,
+    download_wikidump,
+    join_categories,
+    parse_articles,
+    parse_sql_gz,
+)
+from src.ancestor_index import ancestor_index_path
+from src.vocabulary import vocabulary_path
+
+CACHE_DIR = fileio.DATA_DIR / ".pipeline"
+STAGE_NAMES = [
+    "download",
+    "parse_articles",
+    "index_articles",
+    "parse_sql_gz",
+    "join_categories",
+    "create_categories",
+    "upload",
+]
+
+
+@dataclass
+class Stage:
+    """
+    One stage of the pipeline for one language.
+
+    A stage is skipped when it has succeeded before with the same parameters and
+    the same input contents, and its outputs are still the files it wrote.
+    """
+
+    name: str
+    prefix: str
+    run: Callable[[], None]
+    inputs: list[Path] = field(default_factory=list)
+    outputs: list[Path] = field(default_factory=list)
+    params: dict = field(default_factory=dict)
+    depends_on: list[str] = field(default_factory=list)
+
+    @property
+    def key(self) -> str:
+        return f"{self.prefix}:{self.name}"
+
+    @property
+    def record_path(self) -> Path:
+        return CACHE_DIR / f"{self.prefix}-{self.name}.json"
+
+
+def stage_key(stage: Stage, hasher: fileio.FileHasher) -> str:
+    """Hash the name, parameters and input contents of a stage."""
+    description = {
+        "name": stage.name,
+        "params": stage.params,
+        "inputs": {str(path): hasher(path) for path in stage.inputs},
+    }
+    return hashlib.sha256(
+        json.dumps(description, sort_keys=True, default=str).encode("utf-8"),
+    ).hexdigest()
+
+
+def is_fresh(stage: Stage, key: str, hasher: fileio.FileHasher) -> bool:
+    if not stage.record_path.exists():
+        return False
+    record = json.loads(stage.record_path.read_text())
+    return record["key"] == key and all(
+        hasher(path) == record["outputs"].get(str(path)) for path in stage.outputs
+    )
+
+
+def run_stage(stage: Stage, hasher: fileio.FileHasher, force: bool = False) -> bool:
+    """
+    Run a stage unless its cached result is still valid.
+
+    Args:
+        stage (Stage): The stage to run.
+        hasher (FileHasher): The content hashes of the inputs and outputs.
+        force (bool): Run the stage even if its cached result is valid. Defaults to False.
+
+    Returns:
+        bool: Whether the stage was run.
+    """
+    key = stage_key(stage, hasher)
+    if not force and is_fresh(stage, key, hasher):
+        logger.info(f"{stage.key} is up to date")
+        return False
+    logger.info(f"Running {stage.key}")
+    with instrumentation.language(stage.prefix), instrumentation.measure(stage.name):
+        stage.run()
+    missing = [path for path in stage.outputs if not path.exists()]
+    if missing:
+        raise FileNotFoundError(f"{stage.key} did not write {missing}")
+    record = {
+        "key": key,
+        "params": stage.params,
+        "outputs": {str(path): hasher(path) for path in stage.outputs},
+    }
+    stage.record_path.write_text(json.dumps(record, indent=1, default=str))
+    logger.info(f"Finished {stage.key}")
+    return True
+
+
+def run_pipeline(
+    stages: list[Stage],
+    workers: int = 4,
+    force: bool = False,
+) -> dict[str, str]:
+    """
+    Run stages in dependency order, running independent stages concurrently.
+
+    When a stage fails, the stages that depend on it are not run, but the other
+    stages (e.g. those of other languages) still are.
+
+    Args:
+        stages (list[Stage]): The stages, with every stage after the stages it depends on.
+        workers (int): The number of stages to run at once. Defaults to 4.
+        force (bool): Ignore the cached results. Defaults to False.
+
+    Returns:
+        dict[str, str]: The status of every stage: "ran", "cached", "failed" or "blocked".
+    """
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    hasher = fileio.FileHasher(CACHE_DIR / "hashes.json")
+    pending = {stage.key: stage for stage in stages}
+    status: dict[str, str] = {}
+    running: dict[Future, Stage] = {}
+    with ThreadPoolExecutor(workers) as pool:
+        while pending or running:
+            for key, stage in list(pending.items()):
+                deps = [status.get(f"{stage.prefix}:{dep}") for dep in stage.depends_on]
+                if any(dep in ("failed", "blocked") for dep in deps):
+                    logger.warning(f"Not running {key} because a dependency failed")
+                    status[key] = "blocked"
+                    del pending[key]
+                elif all(dep in ("ran", "cached") for dep in deps):
+                    running[pool.submit(run_stage, stage, hasher, force)] = stage
+                    del pending[key]
+            if not running:
+                if pending:
+                    raise ValueError(f"Unsatisfiable dependencies: {list(pending)}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    status[stage.key] = "ran" if future.result() else "cached"
+                except Exception:
+                    logger.exception(f"{stage.key} failed")
+                    status[stage.key] = "failed"
+    hasher.save()
+    return status
+
+
+def language_stages(prefix: str, args: argparse.Namespace) -> list[Stage]:
+    """Declare the stages for one language, in dependency order."""
+    config_path = fileio.CONFIG_DIR / f"{prefix}-config.json"
+    fmt = args.intermediate_format
+    multistream = args.processes > 1 or args.full_index
+    dumps = [
+        fileio.DATA_DIR / name
+        for name in download_wikidump.wikidump_files(prefix, multistream=multistream)
+    ]
+    categorylinks_dump, page_dump, articles_dump, *multistream_dumps = dumps
+    articles = fileio.DATA_DIR / f"{prefix}wiki-sample-{args.num_articles}.jsonl"
+    article_index = [
+        category_index.article_index_path(prefix),
+        category_index.index_categories_path(prefix),
+        category_index.index_texts_path(prefix),
+    ]
+    vocab = vocabulary_path(prefix, fmt)
+    categorylinks = fileio.intermediate_path(prefix, "latest-categorylinks", fmt)
+    category_ids = fileio.intermediate_path(prefix, "category-ids", fmt)
+    all_parents = fileio.intermediate_path(prefix, "all-parents", fmt)
+    ancestor_index = ancestor_index_path(prefix)
+    dataset = fileio.dataset_path(prefix)
+
+    def upload() -> None:
+        # Only the upload needs the Hugging Face client
+        from huggingface_hub import HfApi
+
+        from src.upload_hf import upload_wiki_lang
+
+        upload_wiki_lang(HfApi(), prefix=prefix)
+
+    if args.full_index:
+        # Sample from every article, so later runs only read the texts of the sample
+        articles_stage = Stage(
+            name="index_articles",
+            prefix=prefix,
+            run=lambda: category_index.main(
+                argparse.Namespace(config_path=config_path, processes=args.processes),
+            ),
+            inputs=[config_path, *multistream_dumps],
+            outputs=article_index,
+            depends_on=["download"],
+        )
+        articles_inputs = article_index
+    else:
+        articles_stage = Stage(
+            name="parse_articles",
+            prefix=prefix,
+            run=lambda: parse_articles.main(
+                argparse.Namespace(
+                    num_articles=args.num_articles,
+                    config_path=config_path,
+                    skip_if_exists=False,
+                    processes=args.processes,
+                    output_path=articles,
+                    incremental=args.incremental,
+                ),
+            ),
+            inputs=[config_path, *(multistream_dumps or [articles_dump])],
+            outputs=[articles, articles.with_name(articles.stem + ".index.parquet")],
+            params={"num_articles": args.num_articles},
+            depends_on=["download"],
+        )
+        articles_inputs = [articles]
+
+    return [
+        Stage(
+            name="download",
+            prefix=prefix,
+            run=lambda: download_wikidump.download_wikidumps(
+                [prefix],
+                multistream=multistream,
+                n_parts=args.n_parts,
+            ),
+            outputs=dumps,
+            params={"multistream": multistream},
+        ),
+        articles_stage,
+        Stage(
+            name="parse_sql_gz",
+            prefix=prefix,
+            run=lambda: parse_sql_gz.main(
+                argparse.Namespace(
+                    config_path=config_path,
+                    chunk_size=args.chunk_size,
+                    intermediate_format=fmt,
+                    threaded=args.threaded,
+                    processes=args.processes,
+                    force=not args.incremental,
+                    incremental=args.incremental,
+                ),
+            ),
+            inputs=[config_path, categorylinks_dump, page_dump],
+            outputs=[vocab, categorylinks, category_ids],
+            depends_on=["download"],
+        ),
+        Stage(
+            name="join_categories",
+            prefix=prefix,
+            run=lambda: join_categories.main(
+                argparse.Namespace(
+                    config_path=config_path,
+                    intermediate_format=fmt,
+                    incremental=args.incremental,
+                ),
+            ),
+            inputs=[config_path, vocab, categorylinks, category_ids],
+            outputs=[
+                all_parents,
+                ancestor_index,
+                fileio.intermediate_path(prefix, "category-edges", fmt),
+                fileio.intermediate_path(prefix, "category-frontiers", fmt),
+                join_categories.state_path(prefix),
+            ],
+            depends_on=["parse_sql_gz"],
+        ),
+        Stage(
+            name="create_categories",
+            prefix=prefix,
+            run=lambda: create_categories.create_dataset(
+                prefix,
+                n_articles=args.n_articles,
+                n_turns=args.n_turns,
+                fmt=fmt,
+                seed=args.seed,
+                stratify=args.stratify,
+                articles_path=articles,
+                full_index=args.full_index,
+            ),
+            inputs=[vocab, ancestor_index, *articles_inputs],
+            outputs=[dataset],
+            params={
+                "n_articles": args.n_articles,
+                "n_turns": args.n_turns,
+                "seed": args.seed,
+                "stratify": args.stratify,
+                "full_index": args.full_index,
+            },
+            depends_on=[articles_stage.name, "join_categories"],
+        ),
+        Stage(
+            name="upload",
+            prefix=prefix,
+            run=upload,
+            inputs=[dataset],
+            depends_on=["create_categories"],
+        ),
+    ]
+
+
+def select_stages(stages: list[Stage], targets: list[str]) -> list[Stage]:
+    """Keep the target stages and everything they depend on, in order."""
+    by_name = {stage.name: stage for stage in stages}
+    needed = set()
+    todo = [name for name in targets if name in by_name]
+    while todo:
+        name = todo.pop()
+        if name not in needed:
+            needed.add(name)
+            todo.extend(by_name[name].depends_on)
+    return [stage for stage in stages if stage.name in needed]
+
+
+def main(args: argparse.Namespace) -> None:
+    instrumentation.enable_profiling(*args.profile)
+    targets = args.targets + (["upload"] if args.upload else [])
+    stages = [
+        stage
+        for prefix in args.prefixes or fileio.get_all_prefixes()
+        for stage in select_stages(language_stages(prefix, args), targets)
+    ]
+    status = run_pipeline(stages, workers=args.workers, force=args.force)
+    instrumentation.write_report()
+    for stage in stages:
+        logger.info(f"{stage.key}: {status[stage.key]}")
+    failed = [key for key, state in status.items() if state == "failed"]
+    if failed:
+        raise RuntimeError(f"Failed stages: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Run the pipeline for several languages, skipping up-to-date stages",
+    )
+    parser.add_argument(
+        "--prefixes",
+        nargs="+",
+        default=None,
+        help="The languages to run. Defaults to all configured languages.",
+    )
+    parser.add_argument(
+        "--targets",
+        nargs="+",
+        choices=STAGE_NAMES,
+        default=["create_categories"],
+        help="The stages to bring up to date, along with the stages they depend on.",
+    )
+    parser.add_argument(
+        "--upload",
+        action="store_true",
+        help="Also upload the datasets to Hugging Face.",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=4,
+        help="The number of stages to run at once, across languages. Defaults to 4.",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Run every selected stage, even if it is up to date.",
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="+",
+        default=[],
+        help="Save a cProfile of these stages or measured functions, e.g. parse_sql_gz or read_inserts.",
+    )
+    parser.add_argument("--num-articles", type=int, default=300_000)
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Update the previous run's articles, vocabulary and ancestors instead of recomputing them. Run without it after changing how articles are cleaned.",
+    )
+    parser.add_argument(
+        "--full-index",
+        action="store_true",
+        help="Index the categories of all articles (index_articles) and sample from them instead of the first --num-articles.",
+    )
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--n-parts", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=100_000)
+    parser.add_argument(
+        "--threaded",
+        action="store_true",
+        help="Decompress the SQL dumps in a background thread while parsing.",
+    )
+    parser.add_argument("--n-articles", type=int, default=512)
+    parser.add_argument("--n-turns", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stratify", action="store_true")
+    parser.add_argument(
+        "--intermediate-format",
+        choices=fileio.INTERMEDIATE_FORMATS,
+        default="parquet",
+    )
+    args = parser.parse_args()
+    main(args=args)
@@ -0,0 +1,81 @@
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import src.fileio as fileio
+
+
+def vocabulary_path(prefix: str, fmt: str = "parquet") -> Path:
+    return fileio.intermediate_path(prefix, "category-vocab", fmt)
+
+
+class CategoryVocabulary:
+    """
+    Maps category titles, as they appear in the SQL dumps, to dense int32 ids.
+
+    The vocabulary is written once per language by `parse_sql_gz` and read by the
+    later stages, so that they can join on integer ids instead of title strings.
+    """
+
+    def __init__(self, titles: list[str] | None = None) -> None:
+        self.titles = list(titles or [])
+        self._ids = {title: i for i, title in enumerate(self.titles)}
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def encode(self, titles: pd.Series) -> np.ndarray:
+        """
+        Look up the ids of `titles`, adding the titles that are not in the vocabulary yet.
+
+        Args:
+            titles (pd.Series): The titles to encode.
+
+        Returns:
+            np.ndarray: The int32 ids, aligned with `titles`.
+        """
+        codes, uniques = pd.factorize(titles, use_na_sentinel=False)
+        ids = np.empty(len(uniques), dtype=np.int32)
+        for i, title in enumerate(uniques):
+            if title not in self._ids:
+                self._ids[title] = len(self.titles)
+                self.titles.append(title)
+            ids[i] = self._ids[title]
+        return ids[codes]
+
+    def lookup(self, titles: pd.Series | list[str]) -> np.ndarray:
+        """Look up the ids of `titles` without adding them. Unknown titles get -1."""
+        ids = pd.Series(titles, dtype=object).map(self._ids).fillna(-1)
+        return ids.to_numpy(dtype=np.int32)
+
+    def decode(self, ids: np.ndarray) -> np.ndarray:
+        """Look up the titles of `ids`."""
+        return np.asarray(self.titles, dtype=object)[ids]
+
+    def digest(self, n_titles: int | None = None) -> str:
+        """A hash of the first `n_titles` titles, to check that a later vocabulary only extends this one."""
+        digest = hashlib.sha256()
+        for title in self.titles[:n_titles]:
+            digest.update(title.encode("utf-8") + b"\n")
+        return digest.hexdigest()
+
+    def save(self, path: Path) -> None:
+        fileio.write_table(
+            pd.DataFrame(
+                {
+                    "id": np.arange(len(self.titles), dtype=np.int32),
+                    "title": pd.Series(self.titles, dtype=object),
+                },
+            ),
+            path,
+        )
+
+    @classmethod
+    def load(cls: "CategoryVocabulary", path: Path) -> "CategoryVocabulary":
+        if path.suffix == ".parquet":
+            vocab = fileio.read_table(path)
+        else:
+            vocab = pd.read_csv(path, keep_default_na=False)
+        return cls(vocab.sort_values("id")["title"].tolist())
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks.synthetic import category_graph
+from src.category_graph import (
+    CategoryGraph,
+    top_level_frontiers,
+    update_top_level_frontiers,
+)
+from src.join_categories import get_all_parents, get_all_parents_merge
+
+
+def random_edges(
+    rng: np.random.Generator,
+    n_categories: int,
+    n_edges: int,
+) -> tuple[pd.DataFrame, pd.Series]:
+    """Random (child, parent) title edges, with cycles and repeated edges, and random top-level categories."""
+    titles = np.array([f"Kategori_{i}" for i in range(n_categories)], dtype=object)
+    joined = pd.DataFrame(
+        {
+            "child": titles[rng.integers(0, n_categories, n_edges)],
+            "parent": titles[rng.integers(0, n_categories, n_edges)],
+        },
+    )
+    top_level = pd.Series(
+        rng.choice(titles, size=rng.integers(1, 6), replace=False),
+    )
+    return joined, top_level
+
+
+def rows(parents: pd.DataFrame) -> set[tuple[str, str]]:
+    return set(parents[["child", "parent"]].itertuples(index=False, name=None))
+
+
+@pytest.mark.parametrize("num_levels", [1, 3, 20])
+def test_get_all_parents_matches_merge(num_levels: int):
+    rng = np.random.default_rng(num_levels)
+    for _ in range(30):
+        joined, top_level = random_edges(
+            rng,
+            n_categories=int(rng.integers(2, 60)),
+            n_edges=int(rng.integers(0, 150)),
+        )
+        assert rows(get_all_parents(joined, top_level, num_levels)) == rows(
+            get_all_parents_merge(joined, top_level, num_levels),
+        )
+
+
+def test_get_all_parents_matches_merge_deep_graph():
+    titles, child, parent = category_graph(2000, max_depth=25, seed=0)
+    names = np.asarray(titles, dtype=object)
+    joined = pd.DataFrame({"child": names[child], "parent": names[parent]})
+    top_level = joined.loc[joined["parent"] == titles[0], "child"]
+    parents = get_all_parents(joined, top_level)
+    assert rows(parents) == rows(get_all_parents_merge(joined, top_level))
+    assert len(parents) == len(rows(parents))
+
+
+def changed_edges(
+    rng: np.random.Generator,
+    child_ids: np.ndarray,
+    parent_ids: np.ndarray,
+    n_categories: int,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Drop some edges and add some random ones, which may move categories to or from the root."""
+    keep = rng.random(len(child_ids)) > 0.05
+    n_new = int(rng.integers(0, 6))
+    return (
+        np.r_[child_ids[keep], rng.integers(1, n_categories, n_new)],
+        np.r_[parent_ids[keep], rng.integers(0, n_categories, n_new)],
+    )
+
+
+@pytest.mark.parametrize("num_levels", [3, 20, None])
+def test_update_top_level_frontiers_matches_full(num_levels: int | None):
+    rng = np.random.default_rng(0 if num_levels is None else num_levels)
+    for _ in range(30):
+        n_categories = int(rng.integers(5, 80))
+        names = np.array([f"Kategori_{i}" for i in range(n_categories)], dtype=object)
+        n_edges = int(rng.integers(n_categories, 3 * n_categories))
+        child_ids = rng.integers(1, n_categories, n_edges)
+        parent_ids = rng.integers(0, n_categories, n_edges)
+        # Category 0 is the root, and its children are the top-level categories
+        previous_graph = CategoryGraph.from_codes(child_ids, parent_ids, names)
+        previous = top_level_frontiers(
+            previous_graph,
+            child_ids[parent_ids == 0],
+            num_levels=num_levels,
+        )
+        child_ids, parent_ids = changed_edges(rng, child_ids, parent_ids, n_categories)
+        graph = CategoryGraph.from_codes(child_ids, parent_ids, names)
+        top_ids = child_ids[parent_ids == 0]
+        updated, _ = update_top_level_frontiers(
+            graph,
+            top_ids,
+            previous_graph,
+            previous,
+            num_levels=num_levels,
+        )
+        full = top_level_frontiers(graph, top_ids, num_levels=num_levels)
+        for updated_column, full_column in zip(updated, full):
+            np.testing.assert_array_equal(updated_column, full_column)
+
+
+def test_update_top_level_frontiers_unchanged_graph():
+    titles, child, parent = category_graph(500, seed=1)
+    graph = CategoryGraph.from_codes(child, parent, np.asarray(titles, dtype=object))
+    top_ids = child[parent == 0]
+    full = top_level_frontiers(graph, top_ids)
+    updated, n_updated = update_top_level_frontiers(graph, top_ids, graph, full)
+    assert n_updated == 0
+    for updated_column, full_column in zip(updated, full):
+        np.testing.assert_array_equal(updated_column, full_column)
@@ -0,0 +1,134 @@
+import hashlib
+import re
+import threading
+from collections.abc import Generator
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import pytest
+
+from src.download_wikidump import download_file
+
+PAYLOAD = bytes(range(256)) * 1000 + b"tail"
+NAME = "xxwiki-latest-page.sql.gz"
+N_PARTS = 4
+PART_SIZE = -(-len(PAYLOAD) // N_PARTS)
+
+
+class DumpServer(ThreadingHTTPServer):
+    """Serves `PAYLOAD` at every path, with byte ranges unless `accept_ranges` is off."""
+
+    def __init__(self, accept_ranges: bool = True) -> None:
+        super().__init__(("127.0.0.1", 0), DumpHandler)
+        self.accept_ranges = accept_ranges
+        self.ranges: list[str | None] = []
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/{NAME}"
+
+
+class DumpHandler(BaseHTTPRequestHandler):
+    server: DumpServer
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+    def do_HEAD(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(PAYLOAD)))
+        if self.server.accept_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        header = self.headers.get("Range")
+        self.server.ranges.append(header)
+        if header is None or not self.server.accept_ranges:
+            body = PAYLOAD
+            self.send_response(200)
+        else:
+            start, end = map(int, re.fullmatch(r"bytes=(\d+)-(\d+)", header).groups())
+            body = PAYLOAD[start : end + 1]
+            self.send_response(206)
+            self.send_header(
+                "Content-Range",
+                f"bytes {start}-{start + len(body) - 1}/{len(PAYLOAD)}",
+            )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve(accept_ranges: bool) -> Generator[DumpServer]:
+    server = DumpServer(accept_ranges=accept_ranges)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture()
+def server() -> Generator[DumpServer]:
+    yield from serve(accept_ranges=True)
+
+
+@pytest.fixture()
+def server_without_ranges() -> Generator[DumpServer]:
+    yield from serve(accept_ranges=False)
+
+
+def md5(data: bytes) -> str:
+    return hashlib.md5(data).hexdigest()
+
+
+def test_parallel_ranges(server: DumpServer, tmp_path: Path):
+    path = tmp_path / NAME
+    download_file(server.url, path, n_parts=N_PARTS, checksum=md5(PAYLOAD))
+    assert path.read_bytes() == PAYLOAD
+    assert sorted(server.ranges) == sorted(
+        f"bytes={start}-{min(start + PART_SIZE, len(PAYLOAD)) - 1}"
+        for start in range(0, len(PAYLOAD), PART_SIZE)
+    )
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_resume_from_parts(server: DumpServer, tmp_path: Path):
+    path = tmp_path / NAME
+    # An earlier run finished the second range and half of the first one
+    part_paths = [
+        tmp_path / f"{NAME}.{len(PAYLOAD)}.part{i}of{N_PARTS}" for i in range(N_PARTS)
+    ]
+    part_paths[0].write_bytes(PAYLOAD[:1000])
+    part_paths[1].write_bytes(PAYLOAD[PART_SIZE : 2 * PART_SIZE])
+    download_file(server.url, path, n_parts=N_PARTS, checksum=md5(PAYLOAD))
+    assert path.read_bytes() == PAYLOAD
+    assert f"bytes=1000-{PART_SIZE - 1}" in server.ranges
+    assert not any(header.startswith(f"bytes={PART_SIZE}-") for header in server.ranges)
+    assert len(server.ranges) == N_PARTS - 1
+    assert not any(part_path.exists() for part_path in part_paths)
+
+
+def test_single_stream_without_ranges(
+    server_without_ranges: DumpServer,
+    tmp_path: Path,
+):
+    path = tmp_path / NAME
+    download_file(
+        server_without_ranges.url,
+        path,
+        n_parts=N_PARTS,
+        checksum=md5(PAYLOAD),
+    )
+    assert path.read_bytes() == PAYLOAD
+    assert server_without_ranges.ranges == [None]
+    assert list(tmp_path.iterdir()) == [path]
+
+
+def test_checksum_mismatch(server: DumpServer, tmp_path: Path):
+    path = tmp_path / NAME
+    with pytest.raises(ValueError, match="md5 mismatch"):
+        download_file(server.url, path, n_parts=N_PARTS, checksum=md5(b"other"))
+    assert list(tmp_path.iterdir()) == []
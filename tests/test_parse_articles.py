@@ -0,0 +1,157 @@
+import bz2
+import random
+import re
+from pathlib import Path
+
+import pytest
+
+from benchmarks.clean_text import synthetic_article
+from benchmarks.synthetic import (
+    CONFIG,
+    article_categories,
+    article_text,
+    category_graph,
+    vocabulary,
+    write_articles_dump,
+)
+from src.article_store import ArticleStore, write_articles
+from src.config import Config
+from src.parse_articles import (
+    Page,
+    clean_text,
+    clean_text_generic,
+    extract_categories,
+    iter_articles,
+    parse_page,
+    reuse_unchanged,
+    strip_constructs,
+)
+
+CONSTRUCTS = [("[[Fil:", "]]"), ("{{Infoboks", "}}")]
+# Text without brackets, so no construct nests inside another
+INNER = ["x", " ", "\n", "\n\n", "|", "=", "æ"]
+OUTER = [*INNER, "]]", "}}", "[[link]]", "{{nowrap}}"]
+TOKENS = [*OUTER, "[[Fil:", "{{Infoboks", "[[", "{{", "]", "}", "\t"]
+
+
+def clean_text_generic_twice(text: str) -> str:
+    cleaned = clean_text_generic(text, "[[Fil:", "]]")
+    return clean_text_generic(cleaned, "{{Infoboks", "}}")
+
+
+def flat_wikitext(rng: random.Random) -> str:
+    """Text with file links and infoboxes that contain no brackets, possibly left unclosed at the end."""
+    parts = []
+    for _ in range(rng.randint(0, 8)):
+        if rng.random() < 0.4:
+            start, end = rng.choice(CONSTRUCTS)
+            parts.append(start + "".join(rng.choices(INNER, k=rng.randint(0, 5))) + end)
+        else:
+            parts.append("".join(rng.choices(OUTER, k=rng.randint(0, 6))))
+    if rng.random() < 0.2:
+        parts.append(rng.choice(CONSTRUCTS)[0] + "".join(rng.choices(INNER, k=3)))
+    return "".join(parts)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_strip_constructs_matches_clean_text_generic(seed: int):
+    rng = random.Random(seed)
+    for _ in range(2000):
+        text = flat_wikitext(rng)
+        assert strip_constructs(text, CONSTRUCTS) == clean_text_generic_twice(text)
+
+
+def test_strip_constructs_closes_nested_brackets():
+    text = "{{Infoboks person\n| født = {{nowrap|1900}}\n}}\n'''Emne''' er [[et emne]]."
+    assert strip_constructs(text, CONSTRUCTS) == "'''Emne''' er [[et emne]]."
+    assert clean_text_generic_twice(text).startswith("}}")
+
+
+def test_strip_constructs_unclosed_construct():
+    assert strip_constructs("Tekst [[Fil:a.jpg|[[link]]", CONSTRUCTS) == "Tekst"
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_first_paragraph_matches_full_clean(seed: int):
+    rng = random.Random(seed)
+    texts = [synthetic_article(rng.randint(0, 5), seed=seed)]
+    texts += ["".join(rng.choices(TOKENS, k=rng.randint(0, 30))) for _ in range(2000)]
+    for text in texts:
+        assert (
+            clean_text(text, first_paragraph=True) == clean_text(text).split("\n\n")[0]
+        )
+
+
+def test_parse_page_matches_full_clean():
+    config = Config(prefix="xx", **CONFIG)
+    rng = random.Random(0)
+    words = vocabulary(n_words=100)
+    titles = ["Danmark", "Kunst", "Byer_(Jylland)", "Æbler_og_Ørred"]
+    for page_id in range(1, 200):
+        categories = rng.sample(range(len(titles)), rng.randint(0, len(titles)))
+        text = article_text(rng, page_id, titles, categories, words)
+        _, cleaned, found, *_ = parse_page(
+            Page(str(page_id), page_id, 1, text),
+            config,
+        )
+        assert cleaned == clean_text(text, config=config).split("\n\n")[0]
+        assert found == re.findall(rf"\[\[{config.category}:(.*?)\]\]", text)
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "Ingen kategorier [[Kunst]]",
+        "[[Kategori:A]] tekst [[Kategori:B|*]]\n[[Kategori:C]]",
+        "[[Kategori:]] [[Kategori:Åben",
+    ],
+)
+def test_extract_categories_matches_findall(text: str):
+    assert extract_categories(text) == re.findall(r"\[\[Kategori:(.*?)\]\]", text)
+
+
+def edit_pages(dump_path: Path, page_ids: list[int]) -> None:
+    """Give pages of a synthetic dump a new revision with a new text."""
+    xml = bz2.decompress(dump_path.read_bytes()).decode()
+    for page_id in page_ids:
+        xml = xml.replace(
+            f"<id>{page_id}</id>\n    <revision>\n      <id>{page_id * 10}</id>",
+            f"<id>{page_id}</id>\n    <revision>\n      <id>{page_id * 10 + 1}</id>",
+            1,
+        )
+        xml = re.sub(
+            rf'(<title>Artikel {page_id}</title>.*?xml:space="preserve">)',
+            r"\1Ny tekst. ",
+            xml,
+            count=1,
+            flags=re.DOTALL,
+        )
+    dump_path.write_bytes(bz2.compress(xml.encode()))
+
+
+def test_reuse_unchanged_matches_full_parse(tmp_path: Path):
+    config = Config(prefix="xx", **CONFIG)
+    titles, _, _ = category_graph(50)
+    write_articles_dump(tmp_path, "xx", titles, article_categories(300, 50))
+    dump_path = tmp_path / "xxwiki-latest-pages-articles.xml.bz2"
+    store_path = tmp_path / "xxwiki-sample.jsonl"
+    write_articles(
+        iter_articles(dump_path, num_articles=300, config=config),
+        store_path,
+    )
+
+    edited = [5, 17, 101]
+    edit_pages(dump_path, edited)
+    with ArticleStore(store_path) as previous:
+        pages = list(
+            iter_articles(
+                dump_path,
+                num_articles=300,
+                config=config,
+                revisions=previous.revisions(),
+            ),
+        )
+        assert sorted(page[3] for page in pages if page[1] is not None) == edited
+        articles = list(reuse_unchanged(pages, previous))
+    assert articles == list(iter_articles(dump_path, num_articles=300, config=config))
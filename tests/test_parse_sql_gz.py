@@ -0,0 +1,52 @@
+import gzip
+from pathlib import Path
+
+import pytest
+
+from benchmarks.sql_tokenizer import synthetic_categorylinks_line
+from src.parse_sql_gz import (
+    parse_sql_inserts,
+    read_inserts,
+    read_sql_gz,
+    tokenize_sql_inserts,
+)
+
+LINES = [
+    synthetic_categorylinks_line(500, seed=0),
+    "INSERT INTO `page` VALUES (1,0,'Danmark'),(2,14,'Kunst');\n",
+    "INSERT INTO `page` VALUES (1,NULL,'a'),(-2,3.5,'');",
+    "INSERT INTO `page` VALUES (1,0,'Kommaer, (parenteser) og ;'),(2,0,'x');\n",
+    "INSERT INTO `page` VALUES (1,0,'O\\'Brien'),(2,0,'a\\\\'),(3,0,'b\\\\\\'c');\n",
+    "INSERT INTO `page` VALUES (1,0,'Det ''gamle'' navn'),(2,0,'y');\n",
+    "INSERT INTO `page` VALUES (1,0,'Linje\\nskift\\r\\t'),(2,0,'Æbler');\n",
+    "INSERT INTO `page` VALUES (1,0,'single');\n",
+    # Not plain tuples, so the tokenizer falls back to the parser
+    "INSERT INTO `page` VALUES (1,0,'a'),(2,0);\n",
+    "INSERT INTO `page` (`page_id`) VALUES (1),(2);\n",
+]
+
+
+@pytest.mark.parametrize("line", LINES)
+def test_tokenizer_matches_parser(line: str):
+    assert tokenize_sql_inserts(line) == parse_sql_inserts(line)
+
+
+@pytest.mark.parametrize("line", LINES)
+def test_tokenizer_bytes_match_str(line: str):
+    expected = [
+        tuple(value.encode("latin1") for value in record)
+        for record in parse_sql_inserts(line)
+    ]
+    assert tokenize_sql_inserts(line.encode("latin1")) == expected
+
+
+def test_read_inserts_matches_parser(tmp_path: Path):
+    path = tmp_path / "xxwiki-latest-page.sql.gz"
+    # A multi-member gzip file, as written by parallel compressors
+    with path.open("wb") as file:
+        file.write(gzip.compress(b"-- MySQL dump\n" + LINES[0].encode("latin1")))
+        file.write(gzip.compress("".join(LINES[1:]).encode("latin1")))
+    expected = [
+        record for line in read_sql_gz(path) for record in parse_sql_inserts(line)
+    ]
+    assert read_inserts(path) == expected